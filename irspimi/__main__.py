@@ -1,7 +1,14 @@
 import argparse
+import json
+import sys
 import irsystem
+import int_codecs
+import reuters
+from spimi import SPIMI
+from inverted_index import InvertedIndex, InvertedIndexException, DEFAULT_POSTINGS_CACHE_SIZE
+from query_cache import QueryResultCache, DEFAULT_RESULT_CACHE_SIZE
 from itertools import islice
-from dict_compression import PorterStemmer, NoStopWords, CaseFolding, NoNumbers, MultipleCompression
+from dict_compression import PorterStemmer, NoStopWords, CaseFolding, NoNumbers, MultipleCompression, hit_rate
 
 filters_dict = {"nonum": NoNumbers(),
                 "casefold": CaseFolding(),
@@ -18,51 +25,148 @@ def build_index(args: argparse.Namespace):
         if filters:
             compress_filter = MultipleCompression(filters)
     """Builds the Inverted Index"""
-    print("Building index with multipass merge")
-    outfile = irsystem.build_index(args.corpus_files, args.directory, compress_filter)
-    print(outfile)
+    if args.partitions > 1:
+        print("Building index with {} term partitions".format(args.partitions))
+    else:
+        print("Building index with multipass merge")
+    build_stats = irsystem.build_index(args.corpus_files, args.directory, compress_filter, args.codec,
+                                       args.memory_budget, args.jobs, args.partitions, args.quantize_doclengths,
+                                       args.reader, impact_bm25=args.impact_bm25, positions=args.positions)
+    print(build_stats.index_filename)
+    print("Blocks: {}, Peak block memory: {:.1f} MB, Peak RSS: {:.1f} MB".format(
+        build_stats.block_count, build_stats.peak_block_memory / 2 ** 20, build_stats.peak_rss / 2 ** 20))
+    if compress_filter:
+        print("Normalization memo: {:.1%} hits, {} evictions".format(hit_rate(build_stats.compression_stats),
+                                                                     build_stats.compression_stats.evictions))
+
+
+def add_documents(args: argparse.Namespace):
+    """Adds documents to the Inverted Index in a new segment"""
+    try:
+        build_stats, merger = irsystem.add_documents(args.corpus_files, args.directory, args.memory_budget, args.jobs,
+                                                     args.reader, background_merge=not args.no_merge,
+                                                     replace=args.replace)
+    except InvertedIndexException as e:
+        # Documents already in the index without --replace, or no index to add to
+        print(e)
+        sys.exit(1)
+    print(build_stats.index_filename)
+    print("Blocks: {}, Peak block memory: {:.1f} MB, Peak RSS: {:.1f} MB".format(
+        build_stats.block_count, build_stats.peak_block_memory / 2 ** 20, build_stats.peak_rss / 2 ** 20))
+    if merger:
+        print("Merging segments in the background...")
+        merger.join()
+        print("Merges: {}".format(merger.merge_count))
+
+
+def delete_documents(args: argparse.Namespace):
+    """Deletes documents from the Inverted Index"""
+    print("Deleted documents: {}".format(irsystem.delete_documents(args.directory, args.docids)))
+
+
+def compact_index(args: argparse.Namespace):
+    """Merges the segments of the Inverted Index"""
+    print("Merges: {}".format(irsystem.compact_index(args.directory, args.merge_all)))
+
+
+def memory_size(size: str):
+    """Parses a memory size in bytes with an optional K, M or G suffix"""
+    units = {"K": 2 ** 10, "M": 2 ** 20, "G": 2 ** 30}
+    size = size.strip().upper().rstrip("B")
+    try:
+        if size and size[-1] in units:
+            return int(float(size[:-1]) * units[size[-1]])
+        return int(size)
+    except ValueError:
+        raise argparse.ArgumentTypeError("Invalid memory size: {}".format(size))
+
+
+def print_cache_stats(index: InvertedIndex, result_cache: QueryResultCache = None):
+    cache_stats = index.get_postings_cache_stats()
+    print("Postings cache: {:.1%} hits, {} evictions, {:.1f} MB".format(hit_rate(cache_stats), cache_stats.evictions,
+                                                                       cache_stats.size / 2 ** 20))
+    if result_cache is not None:
+        result_stats = result_cache.stats()
+        print("Result cache: {:.1%} hits, {} evictions, {} invalidations, {} queries".format(
+            hit_rate(result_stats), result_stats.evictions, result_stats.invalidations, result_stats.size))
+
+
+def batch_search(args: argparse.Namespace, ranked: bool):
+    """Searches the queries of a file, one per line, and writes the results of each query as a JSON line"""
+    index = irsystem.load_index(args.directory, args.cache_size)
+    with open(args.batch, "r") as f:
+        queries = [line.strip() for line in f if line.strip()]
+    batch = irsystem.search_many(index, queries, ranked, args.k1, args.b, args.resultLimit, args.impact_ordered,
+                                 args.postings_budget, args.jobs, args.max_score)
+    with open(args.output, "w") as f:
+        for query, eval_result in zip(queries, batch.results):
+            if ranked:
+                results = [{"docid": int(docid), "weight": float(details["weight"])}
+                           for docid, details in eval_result.results.items()]
+            else:
+                results = [{"docid": docid, "tf": details["tf"]} for docid, details in eval_result.results.items()]
+            f.write(json.dumps({"query": query, "results": results}) + "\n")
+    print("Queries: {}, Distinct terms: {}, {:.1f} queries/s".format(
+        len(queries), batch.term_count, len(queries) / batch.seconds if batch.seconds else 0.0))
+    print_cache_stats(index)
 
 
 def search_mode(args: argparse.Namespace):
     """Search a corpus using a pre-built Inverted Index"""
-    index = irsystem.load_index(args.directory)
+    if args.batch:
+        batch_search(args, ranked=False)
+        return
+    index = irsystem.load_index(args.directory, args.cache_size)
+    result_cache = QueryResultCache(args.result_cache_size) if args.result_cache_size else None
     while True:
         expr = input("What do you want to search for? (Type q to exit)\n")
         if expr == "q":
+            print_cache_stats(index, result_cache)
             print("Goodbye!")
             break
-        eval_result = irsystem.search_expr(index, expr)
+        # With a limit, the first results in docid order are shown as they are found instead of sorting them all
+        eval_result = irsystem.search_expr(index, expr, args.resultLimit, result_cache)
         if args.show_title:
             eval_result.update_details(args.corpus_dir[0])
         result_count = 0
-        for docid, details in sorted(eval_result.results.items(),
-                                     key=lambda item: (len(item[1]['terms']), len(item[1]['positions'])),
-                                     reverse=True):
+        results = eval_result.results.items()
+        if not eval_result.limit:
+            results = sorted(results, key=lambda item: (len(item[1]['terms']), item[1]['tf']), reverse=True)
+        for docid, details in results:
             result_count += 1
             if args.show_title:
                 print("#{num}: {title} - DocId {docid}".format(num=result_count, title=details['title'], docid=docid))
             else:
                 print("#{num}: DocId {docid}".format(num=result_count, docid=docid))
 
-            print("\tCount:{count}, Terms:{terms}\n".format(count=len(details['positions']),
+            print("\tCount:{count}, Terms:{terms}\n".format(count=details['tf'],
                                                             terms=", ".join(details['terms'])))
-        print('\nRetrieved {} results.'.format(result_count))
+        if eval_result.limit:
+            print('\nRetrieved the first {} results.'.format(result_count))
+        else:
+            print('\nRetrieved {} results.'.format(result_count))
         if result_count > 0:
             doc_retrieval_mode(eval_result)
 
 
 def search_ranked_mode(args: argparse.Namespace):
     """Search a corpus with ranked retrieval using a pre-built Inverted Index"""
-    index = irsystem.load_index(args.directory)
+    if args.batch:
+        batch_search(args, ranked=True)
+        return
+    index = irsystem.load_index(args.directory, args.cache_size)
     k1 = args.k1
     b = args.b
     resultLimit = args.resultLimit
+    result_cache = QueryResultCache(args.result_cache_size) if args.result_cache_size else None
     while True:
         query = input("What do you want to search for? (Type q to exit)\n")
         if query == "q":
+            print_cache_stats(index, result_cache)
             print("Goodbye!")
             break
-        eval_result = irsystem.search_ranked(index, query, k1, b)
+        eval_result = irsystem.search_ranked(index, query, k1, b, resultLimit, args.impact_ordered,
+                                             args.postings_budget, result_cache, args.max_score)
         if args.show_title:
             eval_result.update_details(args.corpus_dir[0], max_topk=resultLimit)
         result_count = 0
@@ -77,7 +181,10 @@ def search_ranked_mode(args: argparse.Namespace):
                                                                      weight=details['weight']))
             if resultLimit and result_count >= resultLimit:
                 break
-        print('\nRetrieved {} results out of {}.'.format(result_count, len(eval_result.results.items())))
+        if eval_result.limit:
+            print('\nRetrieved the top {} results.'.format(result_count))
+        else:
+            print('\nRetrieved {} results out of {}.'.format(result_count, len(eval_result.results.items())))
         if result_count > 0:
             doc_retrieval_mode(eval_result, resultLimit)
 
@@ -114,7 +221,8 @@ parser = argparse.ArgumentParser(
 
 subparsers = parser.add_subparsers(
     description="Select the mode of operation of the information retrieval system.",
-    help="build constructs the inverted index.\nsearch executes the search query module.")
+    help="build constructs the inverted index.\nadd adds documents to it in a new segment.\ndelete deletes "
+         "documents from it.\nmerge merges its segments.\nsearch executes the search query module.")
 
 # Build Inverted Index Sub Parser
 build_parser = subparsers.add_parser(
@@ -135,6 +243,73 @@ build_parser.add_argument(
     action="append",
     dest="filters"
 )
+build_parser.add_argument(
+    "--codec",
+    help="Select the integer codec for the gap encoded postings. DEFAULT vbyte",
+    choices=int_codecs.CODECS.keys(),
+    action="store",
+    default=int_codecs.DEFAULT_CODEC,
+    dest="codec"
+)
+build_parser.add_argument(
+    "--memory-budget", "-m",
+    help="Memory used by a SPIMI block before it is written to disk, in bytes or with a K, M or G suffix. DEFAULT 32M",
+    type=memory_size,
+    action="store",
+    default=SPIMI.DEFAULT_MEMORY_BUDGET,
+    metavar="SIZE",
+    dest="memory_budget"
+)
+build_parser.add_argument(
+    "--jobs", "-j",
+    help="Number of processes inverting the corpus files in parallel. DEFAULT 1",
+    type=int,
+    action="store",
+    default=1,
+    dest="jobs"
+)
+build_parser.add_argument(
+    "--partitions", "-p",
+    help="Build a term partitioned index: parser processes route the tokens to this many term ranges and each range is "
+         "inverted and merged by its own process. DEFAULT 1, not partitioned",
+    type=int,
+    action="store",
+    default=1,
+    dest="partitions"
+)
+build_parser.add_argument(
+    "--quantize-doclengths",
+    help="Store the document lengths on one byte each, about 2%% of precision for BM25 length normalization",
+    action="store_true",
+    dest="quantize_doclengths"
+)
+build_parser.add_argument(
+    "--impact-ordered",
+    help="Also store the postings of each term ordered by their quantized BM25 weight for these k1 and b, for the "
+         "score at a time ranked search",
+    type=float,
+    nargs=2,
+    action="store",
+    metavar=("K1", "B"),
+    dest="impact_bm25"
+)
+build_parser.add_argument(
+    "--no-positions",
+    help="Store only the docids and term frequencies in the postings, for deployments which never read the positions "
+         "of the terms",
+    action="store_false",
+    dest="positions"
+)
+build_parser.add_argument(
+    "--reader",
+    help="Reader backend of the corpus files. compat: streaming SGML reader with the same tokens as NLTK, "
+         "fast: streaming SGML reader with a regular expression tokenizer, soup: BeautifulSoup and NLTK. "
+         "DEFAULT: {}".format(reuters.DEFAULT_READER_BACKEND),
+    choices=reuters.READER_BACKENDS,
+    action="store",
+    default=reuters.DEFAULT_READER_BACKEND,
+    dest="reader"
+)
 build_parser.add_argument(
     "corpus_files",
     help="List of ordered files for the Reuters Corpus.",
@@ -144,6 +319,106 @@ build_parser.add_argument(
 )
 build_parser.set_defaults(func=build_index)
 
+# Add Documents Sub Parser
+add_parser = subparsers.add_parser(
+    "add",
+    description="Adds documents to the inverted index in a new segment, then merges the small segments")
+add_parser.add_argument(
+    "--dest-dir", "-d",
+    help="Selects the directory of the inverted index",
+    action="store",
+    default=".",
+    metavar="DIR",
+    dest="directory"
+)
+add_parser.add_argument(
+    "--memory-budget", "-m",
+    help="Memory used by a SPIMI block before it is written to disk, in bytes or with a K, M or G suffix. DEFAULT 32M",
+    type=memory_size,
+    action="store",
+    default=SPIMI.DEFAULT_MEMORY_BUDGET,
+    metavar="SIZE",
+    dest="memory_budget"
+)
+add_parser.add_argument(
+    "--jobs", "-j",
+    help="Number of processes inverting the files in parallel. DEFAULT 1",
+    type=int,
+    action="store",
+    default=1,
+    dest="jobs"
+)
+add_parser.add_argument(
+    "--reader",
+    help="Reader backend of the files. DEFAULT: {}".format(reuters.DEFAULT_READER_BACKEND),
+    choices=reuters.READER_BACKENDS,
+    action="store",
+    default=reuters.DEFAULT_READER_BACKEND,
+    dest="reader"
+)
+add_parser.add_argument(
+    "--no-merge",
+    help="Do not merge the segments after adding the new one",
+    action="store_true",
+    dest="no_merge"
+)
+add_parser.add_argument(
+    "--replace",
+    help="Replace the documents already in the index instead of rejecting them",
+    action="store_true",
+    dest="replace"
+)
+add_parser.add_argument(
+    "corpus_files",
+    help="List of ordered files of the new documents.",
+    action="store",
+    metavar="CORPUS_FILE",
+    nargs="+"
+)
+add_parser.set_defaults(func=add_documents)
+
+# Delete Documents Sub Parser
+delete_parser = subparsers.add_parser(
+    "delete",
+    description="Deletes documents from the inverted index, their postings are purged by the next merge")
+delete_parser.add_argument(
+    "--dest-dir", "-d",
+    help="Selects the directory of the inverted index",
+    action="store",
+    default=".",
+    metavar="DIR",
+    dest="directory"
+)
+delete_parser.add_argument(
+    "docids",
+    help="Docids of the documents to delete",
+    type=int,
+    action="store",
+    metavar="DOCID",
+    nargs="+"
+)
+delete_parser.set_defaults(func=delete_documents)
+
+# Merge Segments Sub Parser
+merge_parser = subparsers.add_parser(
+    "merge",
+    description="Merges the segments of the inverted index with the tiered merge policy")
+merge_parser.add_argument(
+    "--dest-dir", "-d",
+    help="Selects the directory of the inverted index",
+    action="store",
+    default=".",
+    metavar="DIR",
+    dest="directory"
+)
+merge_parser.add_argument(
+    "--all",
+    help="Merge all the segments into one",
+    action="store_true",
+    dest="merge_all"
+)
+merge_parser.set_defaults(func=compact_index)
+
 # Search Sub Parser
 search_parser = subparsers.add_parser(
     "search",
@@ -174,17 +449,83 @@ search_parser.add_argument(
 )
 search_parser.add_argument(
     "--limit", "-l",
-    help="Limit the number of results to return",
+    help="Limit the number of results to return, the boolean search stops after the first results in docid order",
     type=int,
     action="store",
     dest="resultLimit"
 )
+search_parser.add_argument(
+    "--impact-ordered",
+    help="Find the top results of the ranked retrieval score at a time in the impact ordered postings, with --limit. "
+         "The index must be built with --impact-ordered and the same k1 and b",
+    action="store_true",
+    dest="impact_ordered"
+)
+search_parser.add_argument(
+    "--max-score",
+    help="Find the top results of the ranked retrieval document at a time with the MaxScore pruning on the block "
+         "impacts of the index, with --limit",
+    action="store_true",
+    dest="max_score"
+)
+search_parser.add_argument(
+    "--postings-budget",
+    help="Maximum number of impact ordered postings scored by a query, the best results found so far are returned",
+    type=int,
+    action="store",
+    metavar="N",
+    dest="postings_budget"
+)
+search_parser.add_argument(
+    "--batch",
+    help="Search the queries of a file, one per line, instead of reading them interactively. The postings of the "
+         "distinct terms of the queries are read once",
+    action="store",
+    metavar="QUERIES_FILE",
+    dest="batch"
+)
+search_parser.add_argument(
+    "--output", "-o",
+    help="File where the results of the batch queries are written, one JSON line per query. DEFAULT results.jsonl",
+    action="store",
+    default="results.jsonl",
+    metavar="RESULTS_FILE",
+    dest="output"
+)
+search_parser.add_argument(
+    "--jobs", "-j",
+    help="Number of threads evaluating the batch queries. DEFAULT 1",
+    type=int,
+    action="store",
+    default=1,
+    dest="jobs"
+)
 search_parser.add_argument(
     "--title", "-t",
     help="Show titles in results found, This slows down the results",
     action="store_true",
     dest="show_title"
 )
+search_parser.add_argument(
+    "--postings-cache",
+    help="Memory used to cache the postings of the query terms, in bytes or with a K, M or G suffix. 0 disables the "
+         "cache. DEFAULT 64M",
+    type=memory_size,
+    action="store",
+    default=DEFAULT_POSTINGS_CACHE_SIZE,
+    metavar="SIZE",
+    dest="cache_size"
+)
+search_parser.add_argument(
+    "--result-cache",
+    help="Number of queries whose results are cached, the repeated queries are not evaluated again. 0 disables the "
+         "cache. DEFAULT {}".format(DEFAULT_RESULT_CACHE_SIZE),
+    type=int,
+    action="store",
+    default=DEFAULT_RESULT_CACHE_SIZE,
+    metavar="QUERIES",
+    dest="result_cache_size"
+)
 search_parser.add_argument(
     "--src-dir", "-d",
     help="Selects the directory of the inverted index, descriptor and dictionary",
@@ -1,6 +1,6 @@
 import irsystem
 import dict_compression
-from inverted_index import extern_input
+from inverted_index import open_postings_file, InvertedIndexDescriptor, INVERTED_INDEX_DESCRIPTOR_SUFFIX
 import json
 import os
 
@@ -12,28 +12,30 @@ def build_indexes(dfilters: dict):
     """Build inverted index with each compression techniques in dict_filters"""
     for dname, dfilter in dfilters.items():
         print("Creating inverted index with compressions: {}".format(dfilter))
-        outfile = irsystem.build_index(["reuters/reut2-0{:02}.sgm".format(k) for k in range(0, 22)],
-                                       "./index_{}".format(dname), dfilter)
-        print(outfile)
+        build_stats = irsystem.build_index(["reuters/reut2-0{:02}.sgm".format(k) for k in range(0, 22)],
+                                           "./index_{}".format(dname), dfilter)
+        print(build_stats.index_filename)
 
 
 def analyze(dfilters: dict):
     """Create statistics for terms, non-positional postings and positional postings for each index"""
     stats = {}
     for dname, dfilter in dfilters.items():
-        with open("./index_{}/{}".format(dname, irsystem.INVERTED_INDEX_FILENAME), "r") as f:
-            term_count = 0
-            postings_count = 0
-            positional_postings_count = 0
-            for line in f:
-                term_posting = extern_input(line)
-                if not term_posting.term:
-                    raise Exception("This should not happen")
-                term_count += 1
-                postings_count += len(term_posting.postings)
-                for posting in term_posting.postings:
-                    positional_postings_count += len(posting.positions)
-            f.close()
+        index_path = "./index_{}/{}".format(dname, irsystem.INVERTED_INDEX_FILENAME)
+        descriptor = InvertedIndexDescriptor.build_from_file("{}.{}".format(index_path,
+                                                                            INVERTED_INDEX_DESCRIPTOR_SUFFIX))
+        f = open_postings_file(index_path, descriptor.format_version, descriptor.codec)
+        term_count = 0
+        postings_count = 0
+        positional_postings_count = 0
+        for term_posting in f:
+            if not term_posting.term:
+                raise Exception("This should not happen")
+            term_count += 1
+            postings_count += len(term_posting.postings)
+            for posting in term_posting.postings:
+                positional_postings_count += posting.tf
+        f.close()
         stats[dname] = {
             "term_count": term_count,
             "postings_count": postings_count,
@@ -1,15 +1,29 @@
 from abc import ABC, abstractmethod
 from nltk.stem.porter import PorterStemmer as PS
+from collections import namedtuple
+from functools import lru_cache
 from typing import List
 import string
 import re
 
+DEFAULT_MEMO_SIZE = 256 * 1024  # Surface tokens
+
+CompressionStats = namedtuple("CompressionStats", ["hits", "misses", "evictions"])
+
 
 class Compression(ABC):
     @abstractmethod
     def compress(self, token: str):
         pass
 
+    def compile(self):
+        """Compiles the filter into a plain function of a token, used by CompiledCompression
+
+        :return: Function applying the filter to a token
+        :rtype: Callable[[str], Optional[str]]
+        """
+        return self.compress
+
 
 class MultipleCompression(Compression):
     def __init__(self, filters: List[Compression]):
@@ -23,10 +37,85 @@ class MultipleCompression(Compression):
                 return last_tok
         return last_tok
 
+    def compile(self):
+        steps = [sf.compile() for sf in self.filters]
+
+        def compress(token: str):
+            for step in steps:
+                token = step(token)
+                if not token:
+                    return token
+            return token
+
+        return compress
+
     def __repr__(self):
         return "MultipleCompression(filters={})".format(repr(self.filters))
 
 
+class CompiledCompression(Compression):
+    def __init__(self, compression: Compression, memo_size: int = DEFAULT_MEMO_SIZE):
+        """Filters compiled into one function behind a bounded LRU memo of the surface tokens.
+
+        The token distribution of a corpus is Zipfian, so most tokens are already in the memo and are not filtered
+        again. The representation is the one of the compiled filters, so the descriptors do not change.
+
+        :param compression: Filters to compile
+        :param memo_size: Maximum number of surface tokens in the memo
+        """
+        self.compression = compression
+        self.memo_size = memo_size
+        self._compress = lru_cache(maxsize=memo_size)(compression.compile())
+
+    def compress(self, token: str):
+        return self._compress(token)
+
+    def compile(self):
+        return self._compress
+
+    def stats(self):
+        """Counters of the memo since the pipeline was compiled
+
+        :rtype: CompressionStats
+        """
+        info = self._compress.cache_info()
+        return CompressionStats(info.hits, info.misses, info.misses - info.currsize)
+
+    def __getstate__(self):
+        # The memo is local to each process
+        return {"compression": self.compression, "memo_size": self.memo_size}
+
+    def __setstate__(self, state):
+        self.__init__(state["compression"], state["memo_size"])
+
+    def __repr__(self):
+        return repr(self.compression)
+
+
+_compiled_compressions = {}
+
+
+def compile_compression(compression: Compression, memo_size: int = DEFAULT_MEMO_SIZE):
+    """Compiled pipeline of the filters, shared by the builds and the indexes of the process using the same filters
+
+    :param compression: Filters to compile
+    :param memo_size: Maximum number of surface tokens in the memo of a new pipeline
+    :return: Compiled pipeline of the filters
+    :rtype: CompiledCompression
+    """
+    if isinstance(compression, CompiledCompression):
+        return compression
+    key = repr(compression)
+    if key not in _compiled_compressions:
+        _compiled_compressions[key] = CompiledCompression(compression, memo_size)
+    return _compiled_compressions[key]
+
+
+def hit_rate(stats: CompressionStats):
+    lookups = stats.hits + stats.misses
+    return stats.hits / lookups if lookups else 0.0
+
+
 class NoNumbers(Compression):
     def __init__(self):
         self._regex_punct = re.compile("[{}]".format(string.punctuation))
@@ -38,6 +127,15 @@ class NoNumbers(Compression):
         else:
             return token
 
+    def compile(self):
+        strip_punct = self._regex_punct.sub
+        match_num = self._regex_num.match
+
+        def compress(token: str):
+            return None if match_num(strip_punct('', token)) is not None else token
+
+        return compress
+
     def __repr__(self):
         return "NoNumbers()"
 
@@ -46,6 +144,9 @@ class CaseFolding(Compression):
     def compress(self, token: str):
         return token.casefold()
 
+    def compile(self):
+        return str.casefold
+
     def __repr__(self):
         return "CaseFolding()"
 
@@ -54,13 +155,13 @@ class NoStopWords(Compression):
     def __init__(self, count: int, filename: str):
         self._count = count
         self._filename = filename
+        self._stop_words = set()
         try:
             f = open(filename, "r")
-            self._stop_words = []
             for i in range(0, count):
                 w = f.readline().strip()
                 if w:
-                    self._stop_words.append(w)
+                    self._stop_words.add(w)
         except IOError as e:
             print("Error while reading {}: {}".format(filename, e))
 
@@ -68,6 +169,15 @@ class NoStopWords(Compression):
         token = token.casefold()
         return token if token not in self._stop_words else None
 
+    def compile(self):
+        stop_words = frozenset(self._stop_words)
+
+        def compress(token: str):
+            token = token.casefold()
+            return token if token not in stop_words else None
+
+        return compress
+
     def __repr__(self):
         return "NoStopWords(count={}, filename=\"{}\")".format(self._count, self._filename)
 
@@ -79,5 +189,8 @@ class PorterStemmer(Compression):
     def compress(self, token: str):
         return self._porter_stemmer.stem(token)
 
+    def compile(self):
+        return self._porter_stemmer.stem
+
     def __repr__(self):
         return "PorterStemmer()"
@@ -1,5 +1,6 @@
-from typing import List, Tuple
+from typing import List, Tuple, Sequence, Callable
 from inverted_index import Posting
+from search import contains
 from collections import OrderedDict
 from itertools import islice
 import reuters
@@ -8,44 +9,61 @@ import reuters
 class EvaluationResult:
     def __init__(self):
         self.postings_map = {}
-        self.term_map = {}
+        self._term_postings = []
         self.results = None
+        # Postings of the boolean results, their positions are decoded only when asked for with get_positions
+        self._result_postings = {}
+        # Evaluation of the query again for the postings of results copied from the result cache, see with_terms
+        self._reevaluate = None
         self.complete = False
         self.ranked = None
+        # Number of results a ranking or a boolean search was cut to, None when all the matching documents are returned
+        self.limit = None
 
-    def add_postings(self, term: str, postings: List[Posting]):
-        """Add postings list to the evaluation result"""
+    def add_postings(self, term: str, postings: Sequence[Posting]):
+        """Add postings list to the evaluation result.
+
+        The postings are not scanned: the terms of a document are looked up in the postings when the document is in
+        the results, so a long postings list costs nothing more than its lookups.
+        """
         self.postings_map[term] = postings
-        for p in postings:
-            if p.docid not in self.term_map:
-                self.term_map[p.docid] = []
-            self.term_map[p.docid].append(term)
+        self._term_postings.append((term, postings))
 
-    def update_results(self, query_result: List[Posting]):
-        """Update the results once they are computed for query"""
+    def update_results(self, query_result: List[Posting], limit: int = None):
+        """Update the results once they are computed for query. The count of a result is the number of occurrences
+        of the query terms in the document, its positions are not decoded
+
+        :param query_result: Postings of the results in docid order
+        :param limit: Number of results the search was cut to, None for all the matching documents
+        """
+        self._result_postings = {posting.docid: posting for posting in query_result}
         self.results = {posting.docid: {
-            "positions": posting.positions,
-            "terms": self.term_map[posting.docid] if posting.docid in self.term_map else []
+            "tf": posting.tf,
+            "terms": self.get_terms(posting.docid)
         } for posting in query_result}
 
         self.complete = True
         self.ranked = False
+        self.limit = limit
 
-    def update_ranked_results(self, query_results: List[Tuple[int, float]]):
+    def update_ranked_results(self, query_results: List[Tuple[int, float]], limit: int = None):
         """ Update the ranked results. This should be used after postings list have been added with add_postings.
 
         :param query_results: Ordered list of tuple (docid, weight)
+        :param limit: Number of results the ranking was cut to, None for all the matching documents
         :type query_results: List[Tuple[int, float]]
+        :type limit: int
         :return: None
         """
         self.results = OrderedDict(
             (docid, {
-                "terms": self.term_map[docid] if docid in self.term_map else [],
+                "terms": self.get_terms(docid),
                 "weight": weight
             }) for docid, weight in query_results)
 
         self.complete = True
         self.ranked = True
+        self.limit = limit
 
     def get_postings(self, term: str):
         """Retrieves the postings for a given term"""
@@ -55,13 +73,65 @@ class EvaluationResult:
         else:
             postings = []
 
+    def get_positions(self, docid: int):
+        """Retrieves the sorted positions of the query terms in a result of a boolean query, decoded on demand
+
+        :param docid: Docid of the result
+        :return: Positions of the query terms in the document, empty for a document not in the results or an index
+            built without positions
+        :rtype: List[int]
+        """
+        posting = self._result_postings.get(docid)
+        if posting is None and self._reevaluate is not None and docid in self.results:
+            # Results copied from the result cache: the postings of the results are the ones of a new evaluation, the
+            # positions of a document depend on the operators of the query and not only on its terms
+            self._result_postings = self._reevaluate()._result_postings
+            self._reevaluate = None
+            posting = self._result_postings.get(docid)
+        return posting.positions if posting is not None else []
+
     def get_terms(self, docid: int):
         """Retrieves the terms found in the given docid"""
-        terms = None
-        if docid in self.term_map:
-            terms = self.term_map[docid]
+        return [term for term, postings in self._term_postings if contains(postings, docid)]
 
-        return terms if terms is not None else []
+    def cached(self):
+        """Copy of the results to keep in a result cache, only the docids and their term frequency or weight: the
+        postings and the terms of the documents are left out, so the size of the copy is the number of results
+
+        :rtype: EvaluationResult
+        """
+        score = "weight" if self.ranked else "tf"
+        result = EvaluationResult()
+        result.results = type(self.results)((docid, {score: details[score]}) for docid, details in self.results.items())
+        result.complete = self.complete
+        result.ranked = self.ranked
+        result.limit = self.limit
+        return result
+
+    def with_terms(self, term_postings: List[Tuple[str, Sequence[Posting]]],
+                   reevaluate: Callable[[], "EvaluationResult"] = None):
+        """Copy of cached results for a query with these results, with the terms of the query in each document as if
+        the query was evaluated, see cached
+
+        :param term_postings: Terms of the query in query order with their postings
+        :param reevaluate: Evaluates the boolean query again, called once by get_positions for the postings of the
+            results. DEFAULT None, no positions
+        :rtype: EvaluationResult
+        """
+        result = EvaluationResult()
+        result._reevaluate = reevaluate
+        for term, postings in term_postings:
+            result.add_postings(term, postings)
+        if self.ranked:
+            result.results = OrderedDict((docid, {"terms": result.get_terms(docid), "weight": details["weight"]})
+                                         for docid, details in self.results.items())
+        else:
+            result.results = {docid: {"tf": details["tf"], "terms": result.get_terms(docid)}
+                              for docid, details in self.results.items()}
+        result.complete = self.complete
+        result.ranked = self.ranked
+        result.limit = self.limit
+        return result
 
     def update_details(self, reuters_path: str, docid: int = None, max_topk: int = None):
         """Updates the results with the title of each doc and the doc reference"""
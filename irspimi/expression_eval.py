@@ -1,8 +1,8 @@
 from nltk import word_tokenize
-from typing import List
+from typing import List, Callable, Dict
 from enum import Enum
 import search
-from inverted_index import InvertedIndex
+from inverted_index import InvertedIndex, TermPostings
 from eval_result import EvaluationResult
 
 
@@ -72,6 +72,19 @@ class UnaryOp(ParseTree):
         self.child = child
 
 
+class NaryOp(ParseTree):
+    def __init__(self, op: Token, children: List[ParseTree], key: str):
+        """AND or OR of any number of children, built by the QueryOptimizer
+
+        :param op: AND or OR operator
+        :param children: Operands in evaluation order, the NOT operands of an AND are subtracted after the others
+        :param key: Canonical form of the expression, equal for the expressions with the same results
+        """
+        self.op = op
+        self.children = children
+        self.key = key
+
+
 class Parser:
     def __init__(self, expression: str):
         # self._expression = expression
@@ -80,10 +93,12 @@ class Parser:
         self._tokens = lexer(self._tokens)
         self._tokens_stream = iter(self._tokens)
         self._current_token = next(self._tokens_stream)
+        self._tree = None
 
     def parse(self):
         """
-        Creates the ParseTree from the initialized expression
+        Creates the ParseTree from the initialized expression, the expression is parsed once and the later calls return
+        the same tree
 
         Grammar:
             expr : conj (OR conj)*
@@ -91,7 +106,9 @@ class Parser:
             term : (NOT) TERM | LPAR expr RPAR
         :return ParseTree: Abstract Syntax Tree of the expression for evaluation
         """
-        return self._expression()
+        if self._tree is None:
+            self._tree = self._expression()
+        return self._tree
 
     def _ingest(self, type: TokenType):
         if self._current_token.type == type:
@@ -134,18 +151,143 @@ class Parser:
         return node
 
 
+class QueryOptimizer:
+    # Operands of an OR from which the postings are merged with one heap instead of successive unions
+    WIDE_UNION = 3
+
+    def __init__(self, doc_freq: Callable[[str], int]):
+        """Rewrites a parse tree into an equivalent tree which is cheaper to evaluate.
+
+        - The chains of AND and of OR are flattened into NaryOp nodes.
+        - The operands of an AND are ordered by increasing document frequency, so the intersections start with the
+          shortest postings and stop as soon as the intersection is empty.
+        - The NOT operands of an AND are moved last and subtracted from the intersection of the other operands,
+          instead of intersecting with the complement of their postings in the universe.
+        - The repeated subexpressions get the same key, the evaluator computes them once.
+
+        The rewritten tree gives the same documents and positions as the parse tree: AND and OR are commutative and
+        associative, the positions of the results are sorted, and a repeated operand still counts each time.
+
+        :param doc_freq: Document frequency of a term of the query, 0 for a term ignored by the index
+        """
+        self._doc_freq = doc_freq
+
+    def optimize(self, node: ParseTree):
+        """Optimizes a parse tree
+
+        :return: Optimized tree, with NaryOp nodes instead of BinOp nodes
+        :rtype: ParseTree
+        """
+        return self._rewrite(node)[0]
+
+    def _rewrite(self, node: ParseTree):
+        """Rewrites a subtree
+
+        :return: Tuple (rewritten node, key, estimated number of results)
+        :rtype: Tuple[ParseTree, str, int]
+        """
+        if isinstance(node, Term):
+            return node, repr(node.term.value), self._doc_freq(node.term.value)
+        elif isinstance(node, UnaryOp):
+            child, key, cost = self._rewrite(node.child)
+            return UnaryOp(node.op, child), "NOT {}".format(key), cost
+        elif isinstance(node, BinOp):
+            operands = [self._rewrite(operand) for operand in self._flatten(node, node.op.type)]
+            if node.op.type == TokenType.AND:
+                # The negated operands are subtracted last, the largest first
+                included = sorted((operand for operand in operands if not isinstance(operand[0], UnaryOp)),
+                                  key=lambda operand: operand[2])
+                excluded = sorted((operand for operand in operands if isinstance(operand[0], UnaryOp)),
+                                  key=lambda operand: operand[2], reverse=True)
+                operands = included + excluded
+                cost = min((operand[2] for operand in included), default=0)
+            else:
+                cost = sum(operand[2] for operand in operands)
+            key = "({})".format(" {} ".format(node.op.value).join(sorted(operand[1] for operand in operands)))
+            return NaryOp(node.op, [operand[0] for operand in operands], key), key, cost
+        else:
+            raise ExpressionParserException("Invalid Node Type: Aborting!")
+
+    @staticmethod
+    def _flatten(node: ParseTree, op_type: TokenType):
+        """Operands of a chain of the same binary operator, in textual order"""
+        if isinstance(node, BinOp) and node.op.type == op_type:
+            return QueryOptimizer._flatten(node.left_child, op_type) + QueryOptimizer._flatten(node.right_child, op_type)
+        return [node]
+
+
+def canonical_form(node: ParseTree, normalize: Callable[[str], str]):
+    """Canonical form of a parse tree, the expressions with the same canonical form have the same results
+
+    The terms are normalized, the chains of AND and of OR are flattened and their operands sorted. The repeated
+    operands are kept, they count each time in the positions of the results.
+
+    :param node: Parse tree of the expression
+    :param normalize: Normalization of a term by the index, None for a term filtered out
+    :rtype: str
+    """
+    if isinstance(node, Term):
+        return repr(normalize(node.term.value))
+    elif isinstance(node, UnaryOp):
+        return "NOT {}".format(canonical_form(node.child, normalize))
+    elif isinstance(node, BinOp):
+        operands = sorted(canonical_form(operand, normalize) for operand in QueryOptimizer._flatten(node, node.op.type))
+        return "({})".format(" {} ".format(node.op.value).join(operands))
+    else:
+        raise ExpressionParserException("Invalid Node Type: Aborting!")
+
+
+def expression_terms(node: ParseTree):
+    """Terms of a parse tree, in textual order
+
+    :rtype: List[str]
+    """
+    if isinstance(node, BinOp):
+        return expression_terms(node.left_child) + expression_terms(node.right_child)
+    elif isinstance(node, NaryOp):
+        return [term for child in node.children for term in expression_terms(child)]
+    elif isinstance(node, UnaryOp):
+        return expression_terms(node.child)
+    elif isinstance(node, Term):
+        return [node.term.value]
+    return []
+
+
 class Evaluator:
-    def __init__(self, parser: Parser, index: InvertedIndex):
+    def __init__(self, parser: Parser, index: InvertedIndex, optimize: bool = True, limit: int = None,
+                 postings: Dict[str, TermPostings] = None):
+        """Evaluates a boolean expression on an index
+
+        Without limit, the postings of each operation are computed in full. With a limit, the expression is compiled
+        into a tree of postings cursors instead, and only its first limit results in docid order are enumerated.
+
+        :param parser: Parser of the expression
+        :param index: Index to search
+        :param optimize: Set to false to evaluate the parse tree as written, without the QueryOptimizer
+        :param limit: Number of results, the first ones in docid order. DEFAULT None, all the results
+        :param postings: Postings of the terms already read with InvertedIndex.get_postings_many, the other terms are
+            read from the index
+        """
         self._parser = parser
         self._index = index
+        self._optimize = optimize
+        self._limit = limit
+        self._postings = postings if postings is not None else {}
         self._reset()
 
     def _reset(self):
         self.eval_result = EvaluationResult()
+        self._term_postings = {}
+        self._term_bitmaps = {}
+        self._results = {}
 
     def _visit(self, node):
         if isinstance(node, BinOp):
             return self._visit_binop(node)
+        elif isinstance(node, NaryOp):
+            if node.key not in self._results:
+                self._results[node.key] = self._visit_naryop(node)
+            return self._results[node.key]
         elif isinstance(node, Term):
             return self._visit_term(node)
         elif isinstance(node, UnaryOp):
@@ -153,6 +295,29 @@ class Evaluator:
         else:
             raise ExpressionParserException("Invalid Node Type: Aborting!")
 
+    def _visit_naryop(self, node: NaryOp):
+        live_docs = self._index.get_live_docs()
+        if node.op.type == TokenType.OR:
+            postings_lists = [self._materialize(self._visit(child)) for child in node.children]
+            if len(postings_lists) >= QueryOptimizer.WIDE_UNION:
+                return search.union_many(postings_lists, live_docs)
+            return search.union(postings_lists[0], postings_lists[1], live_docs)
+        elif node.op.type == TokenType.AND:
+            # Operands disregarded by the compression (Stop Words, no numbers) do not restrict the intersection.
+            # The NOT operands are complements, subtracted from the intersection of the other operands or, without
+            # other operands, merged into the complement of their union
+            result = None
+            for child in node.children:
+                postings = self._visit(child)
+                if postings is None:
+                    continue
+                result = search.intersect(result, postings, live_docs) if result is not None else postings
+                if not result:
+                    break
+            return result
+        else:
+            raise ExpressionParserException("Invalid N-ary Operator Type: Aborting!")
+
     def _visit_binop(self, node):
         if node.op.type == TokenType.AND:
             left_postings = self._visit(node.left_child)
@@ -166,29 +331,140 @@ class Evaluator:
             elif right_postings is None:
                 return left_postings
             else:
-                return search.intersect(left_postings, right_postings)
+                return search.intersect(left_postings, right_postings, self._index.get_live_docs())
         elif node.op.type == TokenType.OR:
-            return search.union(self._visit(node.left_child), self._visit(node.right_child))
+            return search.union(self._materialize(self._visit(node.left_child)),
+                                self._materialize(self._visit(node.right_child)), self._index.get_live_docs())
         else:
             raise ExpressionParserException("Invalid Binary Operator Type: Aborting!")
 
     def _visit_term(self, node):
-        term_postings = self._index.get_postings(node.term.value)
-
+        term_postings = self._get_term_postings(node.term.value)
         if term_postings is None:
-            self.eval_result.add_postings(node.term.value, [])
-        else:
-            self.eval_result.add_postings(node.term.value, term_postings.postings)
+            return None
+        # The frequent terms are evaluated on their bitmap
+        if node.term.value not in self._term_bitmaps:
+            self._term_bitmaps[node.term.value] = self._index.get_bitmap(node.term.value)
+        bitmap = self._term_bitmaps[node.term.value]
+        if bitmap is not None:
+            return search.BitmapPostings(bitmap, [term_postings.postings])
         return term_postings.postings
 
+    def _get_term_postings(self, term: str):
+        """Postings of a term of the expression, read once per expression, the terms not in the index are not read"""
+        if term in self._postings:
+            return self._postings[term]
+        if term not in self._term_postings:
+            stats = self._index.get_term_stats(term)
+            if stats is None:
+                self._term_postings[term] = None
+            elif stats.doc_freq == 0:
+                self._term_postings[term] = TermPostings(term, [])
+            else:
+                self._term_postings[term] = self._index.get_postings(term)
+        return self._term_postings[term]
+
+    def _add_terms(self, node):
+        """Adds the postings of the terms of the expression to the result, in textual order"""
+        if isinstance(node, BinOp):
+            self._add_terms(node.left_child)
+            self._add_terms(node.right_child)
+        elif isinstance(node, UnaryOp):
+            self._add_terms(node.child)
+        elif isinstance(node, Term):
+            term_postings = self._get_term_postings(node.term.value)
+            self.eval_result.add_postings(node.term.value, term_postings.postings if term_postings else [])
+
+    def _doc_freq(self, term: str):
+        """Document frequency of the dictionary, an upper bound of the live documents of the term"""
+        stats = self._index.get_term_stats(term)
+        return stats.doc_freq if stats is not None else 0
+
     def _visit_unaryop(self, node):
-        return search.neg(self._index.get_universe(), self._visit(node.child))
+        return search.complement(self._visit(node.child), self._index.get_live_docs())
+
+    def _materialize(self, postings):
+        """Enumerates the documents of a complement, as a bitmap"""
+        if isinstance(postings, search.Complement):
+            return postings.materialize(self._index.get_universe_bitmap())
+        return postings
+
+    def _compile(self, node: ParseTree):
+        """Compiles a subtree into a cursor over its results
+
+        :return: Cursor of the subtree, None for an operand ignored by the compression
+        :rtype: search.PostingsCursor
+        """
+        cursor, negated = self._compile_operand(node)
+        return search.ComplementCursor(self._index.get_universe(), cursor) if negated else cursor
+
+    def _compile_operand(self, node: ParseTree):
+        """Compiles a subtree into a cursor, a complement is kept as the cursor of its excluded documents
+
+        The cursors follow the set operations of the evaluation: the operands ignored by the compression do not
+        restrict an AND, the NOT operands of an AND are subtracted from the intersection of the other operands or,
+        without other operands, are the complement of their union. A complement is only enumerated from the universe
+        by a union or as the result of the expression.
+
+        :return: Tuple (cursor, negated), the cursor of the excluded documents for a complement, None cursor for an
+            operand ignored by the compression
+        :rtype: Tuple[search.PostingsCursor, bool]
+        """
+        if isinstance(node, Term):
+            term_postings = self._get_term_postings(node.term.value)
+            return (search.ListCursor(term_postings.postings) if term_postings is not None else None), False
+        elif isinstance(node, UnaryOp):
+            cursor, negated = self._compile_operand(node.child)
+            if negated:
+                return search.BareCursor(cursor), False
+            return (cursor if cursor is not None else search.ListCursor([])), True
+        elif isinstance(node, (BinOp, NaryOp)):
+            children = node.children if isinstance(node, NaryOp) else [node.left_child, node.right_child]
+            operands = [operand for operand in (self._compile_operand(child) for child in children)
+                        if operand[0] is not None]
+            if node.op.type == TokenType.OR:
+                return search.OrCursor([search.ComplementCursor(self._index.get_universe(), cursor) if negated
+                                        else cursor for cursor, negated in operands]), False
+            elif node.op.type == TokenType.AND:
+                if not operands:
+                    return None, False
+                included = [cursor for cursor, negated in operands if not negated]
+                excluded = [cursor for cursor, negated in operands if negated]
+                if not included:
+                    return search.OrCursor(excluded), True
+                return search.AndCursor(included, excluded), False
+            raise ExpressionParserException("Invalid Operator Type: Aborting!")
+        else:
+            raise ExpressionParserException("Invalid Node Type: Aborting!")
+
+    def _first_results(self, cursor: search.PostingsCursor):
+        """Enumerates the first limit live results of a cursor
+
+        :rtype: List[Posting]
+        """
+        results = []
+        if cursor is None:
+            return results
+        live_docs = self._index.get_live_docs()
+        while cursor.docid != search.PostingsCursor.END and len(results) < self._limit:
+            if live_docs is None or cursor.docid in live_docs:
+                results.append(cursor.posting)
+            cursor.next()
+        return results
 
     def evaluate(self):
         self._reset()
         tree = self._parser.parse()
-        query_result = self._visit(tree)
-        query_result = query_result if query_result is not None else []
+        self._add_terms(tree)
+        if self._optimize:
+            tree = QueryOptimizer(self._doc_freq).optimize(tree)
+        if self._limit is not None:
+            self.eval_result.update_results(self._first_results(self._compile(tree)), self._limit)
+            return self.eval_result
+        query_result = self._materialize(self._visit(tree))
+        if isinstance(query_result, search.BitmapPostings):
+            query_result = query_result.to_postings()
+        query_result = search.live(query_result, self._index.get_live_docs()) if query_result is not None else []
         self.eval_result.update_results(query_result)
 
         return self.eval_result
@@ -0,0 +1,229 @@
+## Integer codecs used to compress the gap encoded postings on disk
+import struct
+from abc import ABC, abstractmethod
+from typing import List
+
+DEFAULT_CODEC = "vbyte"
+
+
+class IntCodec(ABC):
+    name = None
+
+    @abstractmethod
+    def encode(self, values: List[int]):
+        """Encodes a list of non negative integers.
+
+        :param values: Integers to encode
+        :type values: List[int]
+        :return: Encoded values
+        :rtype: bytes
+        """
+        pass
+
+    @abstractmethod
+    def decode(self, data: bytes, count: int):
+        """Decodes count integers from the given data.
+
+        :param data: Encoded values
+        :param count: Number of integers encoded in data
+        :type data: bytes
+        :type count: int
+        :return: Decoded integers
+        :rtype: List[int]
+        """
+        pass
+
+    def __repr__(self):
+        return "{}()".format(type(self).__name__)
+
+
+class VariableByteCodec(IntCodec):
+    """Variable byte encoding, 7 bits of payload per byte with the high bit set on the last byte of an integer."""
+    name = "vbyte"
+
+    def encode(self, values: List[int]):
+        out = bytearray()
+        for n in values:
+            while n >= 0x80:
+                out.append(n & 0x7F)
+                n >>= 7
+            out.append(n | 0x80)
+        return bytes(out)
+
+    def decode(self, data: bytes, count: int):
+        values = []
+        n = 0
+        shift = 0
+        for byte in data:
+            if byte & 0x80:
+                values.append(n | ((byte & 0x7F) << shift))
+                if len(values) == count:
+                    break
+                n = 0
+                shift = 0
+            else:
+                n |= byte << shift
+                shift += 7
+        return values
+
+
+class EliasGammaCodec(IntCodec):
+    """Elias gamma encoding of n + 1, unary length followed by the binary offset."""
+    name = "gamma"
+
+    def encode(self, values: List[int]):
+        bits = "".join(EliasGammaCodec._gamma_bits(n + 1) for n in values)
+        return _bits_to_bytes(bits)
+
+    def decode(self, data: bytes, count: int):
+        bits = _bytes_to_bits(data)
+        values = []
+        pos = 0
+        for i in range(0, count):
+            n, pos = EliasGammaCodec._read_gamma(bits, pos)
+            values.append(n - 1)
+        return values
+
+    @staticmethod
+    def _gamma_bits(n: int):
+        binary = bin(n)[2:]
+        return "0" * (len(binary) - 1) + binary
+
+    @staticmethod
+    def _read_gamma(bits: str, pos: int):
+        """Reads one gamma code from a bit string
+
+        :return: Tuple (value, position after the code)
+        :rtype: Tuple[int, int]
+        """
+        length = bits.index("1", pos) - pos
+        end = pos + 2 * length + 1
+        return int(bits[pos + length:end], 2), end
+
+
+class EliasDeltaCodec(IntCodec):
+    """Elias delta encoding of n + 1, gamma coded length followed by the binary offset."""
+    name = "delta"
+
+    def encode(self, values: List[int]):
+        codes = []
+        for n in values:
+            binary = bin(n + 1)[2:]
+            codes.append(EliasGammaCodec._gamma_bits(len(binary)))
+            codes.append(binary[1:])
+        return _bits_to_bytes("".join(codes))
+
+    def decode(self, data: bytes, count: int):
+        bits = _bytes_to_bits(data)
+        values = []
+        pos = 0
+        for i in range(0, count):
+            length, pos = EliasGammaCodec._read_gamma(bits, pos)
+            end = pos + length - 1
+            values.append(int("1" + bits[pos:end], 2) - 1)
+            pos = end
+        return values
+
+
+class Simple8bCodec(IntCodec):
+    """Simple-8b word aligned encoding, packs as many integers as possible in 64 bits words.
+
+    The 4 high bits of a word select how the remaining 60 bits are split between the integers.
+    """
+    name = "simple8b"
+    # (integer count, bits per integer) for each selector
+    SELECTORS = ((240, 0), (120, 0), (60, 1), (30, 2), (20, 3), (15, 4), (12, 5), (10, 6), (8, 7), (7, 8),
+                 (6, 10), (5, 12), (4, 15), (3, 20), (2, 30), (1, 60))
+
+    def encode(self, values: List[int]):
+        words = []
+        i = 0
+        while i < len(values):
+            for selector, (count, bits) in enumerate(Simple8bCodec.SELECTORS):
+                packed = values[i:i + count]
+                if max(packed) < (1 << bits):
+                    word = selector << 60
+                    shift = 0
+                    for n in packed:
+                        word |= n << shift
+                        shift += bits
+                    words.append(word)
+                    i += len(packed)
+                    break
+            else:
+                raise IntCodecException("Simple-8b cannot encode integers of more than 60 bits: {}".format(values[i]))
+        return struct.pack("<{}Q".format(len(words)), *words)
+
+    def decode(self, data: bytes, count: int):
+        values = []
+        for word in struct.unpack("<{}Q".format(len(data) // 8), data):
+            n, bits = Simple8bCodec.SELECTORS[word >> 60]
+            if bits == 0:
+                values.extend([0] * n)
+            else:
+                mask = (1 << bits) - 1
+                values.extend((word >> shift) & mask for shift in range(0, n * bits, bits))
+            if len(values) >= count:
+                break
+        del values[count:]
+        return values
+
+
+CODECS = {codec.name: codec for codec in [VariableByteCodec, EliasGammaCodec, EliasDeltaCodec, Simple8bCodec]}
+
+
+def get_codec(name: str):
+    """Creates the integer codec registered under name
+
+    :param name: Name of the codec (vbyte, gamma, delta, simple8b)
+    :return: Codec instance
+    :rtype: IntCodec
+    """
+    if name not in CODECS:
+        raise IntCodecException("Unknown integer codec: {}".format(name))
+    return CODECS[name]()
+
+
+def encode_uint(n: int):
+    """Variable byte encoding of a single integer, used for the headers of the binary formats."""
+    out = bytearray()
+    while n >= 0x80:
+        out.append(n & 0x7F)
+        n >>= 7
+    out.append(n | 0x80)
+    return bytes(out)
+
+
+def decode_uint(data: bytes, pos: int):
+    """Decodes a single variable byte integer at pos
+
+    :param data: Buffer holding the encoded integer
+    :param pos: Position of the integer in the buffer
+    :return: Tuple (value, position after the integer)
+    :rtype: Tuple[int, int]
+    """
+    n = 0
+    shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        if byte & 0x80:
+            return n | ((byte & 0x7F) << shift), pos
+        n |= byte << shift
+        shift += 7
+
+
+def _bits_to_bytes(bits: str):
+    """Packs a string of 0 and 1 into bytes, the last byte is padded with zeros"""
+    if not bits:
+        return b""
+    padding = -len(bits) % 8
+    return int(bits + "0" * padding, 2).to_bytes((len(bits) + padding) // 8, "big")
+
+
+def _bytes_to_bits(data: bytes):
+    return bin(int.from_bytes(data, "big"))[2:].zfill(len(data) * 8) if data else ""
+
+
+class IntCodecException(Exception):
+    pass
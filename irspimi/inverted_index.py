@@ -1,52 +1,309 @@
-from typing import List, Dict
+from typing import List, Dict, Sequence, Iterable, Tuple
+from contextlib import contextmanager
 from functools import total_ordering
+from itertools import accumulate, chain
+from bisect import bisect_left, bisect_right
 import re
-from dict_compression import MultipleCompression, NoNumbers, CaseFolding, NoStopWords, PorterStemmer
+from dict_compression import MultipleCompression, NoNumbers, CaseFolding, NoStopWords, PorterStemmer, \
+    compile_compression
+from int_codecs import DEFAULT_CODEC, IntCodec, encode_uint, decode_uint
 import dict_compression
+import int_codecs
+from collections import namedtuple, OrderedDict
+import collections.abc
+from array import array
+from math import log2
 import json
+import heapq
+import fcntl
+import os
+import sys
+import io
+import mmap
+import struct
+import threading
 
 DICTIONARY_FILE_SUFFIX = "dictionary"
+SEGMENTS_FILE_SUFFIX = "segments"
+DELETES_FILE_SUFFIX = "deletes"
+BITMAPS_FILE_SUFFIX = "bitmaps"
+IMPACTS_FILE_SUFFIX = "impacts"
+IMPACT_ORDER_FILE_SUFFIX = "impactorder"
+DOCLENGTHS_FILE_SUFFIX = "doclengths"
 INVERTED_INDEX_DESCRIPTOR_SUFFIX = "desc"
 
+# Format of the postings files, the text format is kept to read indexes built before the binary format
+TEXT_FORMAT_VERSION = 1
+BINARY_FORMAT_VERSION = 7
+POSTINGS_CHUNK_SIZE = 128
+DICTIONARY_BLOCK_SIZE = 16
+# The postings of a term are also stored as a bitmap when the bitmap is at most BITMAP_DENSITY bits per document of the
+# term, the bitmaps of the frequent terms are no larger than their postings
+BITMAP_MIN_DF = 64
+BITMAP_DENSITY = 16
+DEFAULT_POSTINGS_CACHE_SIZE = 64 * 1024 * 1024  # 64 MB of decoded postings
+ESTIMATED_POSTING_SIZE = 160  # Bytes of a decoded Posting with its positions list
+# The impacts of the impact ordered postings are BM25 weights quantized on this many levels, from 1 to IMPACT_LEVELS
+IMPACT_LEVELS = 255
+
+DictionaryEntry = namedtuple("DictionaryEntry", ["file_pos", "doc_freq", "coll_freq", "max_tf", "impacts_pos",
+                                                 "impact_order_pos"])
+# Statistics of a term in the whole index: number of documents, number of occurrences and highest term frequency
+TermStats = namedtuple("TermStats", ["doc_freq", "coll_freq", "max_tf"])
+# Impacts of the blocks of postings of a term: the last docid of each block and its (tf, doclength) impact pairs
+TermImpacts = namedtuple("TermImpacts", ["last_docids", "blocks"])
+# BM25 parameters of the impact ordered postings of an index and the weight of one level of impact
+ImpactOrder = namedtuple("ImpactOrder", ["k1", "b", "scale"])
+# Header of a chunk of encoded postings, pos is the position of its docid gaps in the encoded postings
+ChunkHeader = namedtuple("ChunkHeader", ["doc_count", "first_docid", "last_docid", "pos", "docids_length",
+                                         "tfs_length", "positions_length"])
+CacheStats = namedtuple("CacheStats", ["hits", "misses", "evictions", "size", "capacity"])
+
 
 class InvertedIndex:
-    def __init__(self, index_filename: str):
-        self._dictionary = {}
-        self._descriptor = None
-        self._index_file = open(index_filename)
-        self._load_dictionary("{}.{}".format(index_filename, DICTIONARY_FILE_SUFFIX))
-        self._load_descriptor("{}.{}".format(index_filename, INVERTED_INDEX_DESCRIPTOR_SUFFIX))
-        self.avg_doclength = sum(self._descriptor.doclengths.values()) / len(self._descriptor.doclengths)
+    def __init__(self, index_filename: str, cache_size: int = DEFAULT_POSTINGS_CACHE_SIZE):
+        """Opens an inverted index built by irsystem.build_index
 
-    def _load_dictionary(self, filename: str):
-        with open(filename, "r") as f:
-            for next_line in f:
-                next_line = next_line.strip()
-                if next_line:
-                    term, file_pos = next_line.split(" : ")
-                    self._dictionary[term] = int(file_pos)
+        An index extended by irsystem.add_documents is made of the immutable segments listed in its segments file,
+        the postings of a term are gathered from all the live segments and the document lengths are combined, so
+        the BM25 statistics are the ones of the whole collection.
+
+        The deleted documents are left in the postings until their segment is merged. The postings of several segments
+        skip the documents deleted from each segment as they are combined, so a replaced document is only found in
+        its new segment. The searches skip the other deleted documents with the live documents bitset of the index:
+        the documents deleted from a single segment and the documents deleted since the index was opened, so the
+        postings of a single segment are read as they are stored.
 
-    def _load_descriptor(self, filename):
-        self._descriptor = InvertedIndexDescriptor.build_from_file(filename)
+        The postings of the terms are kept in a least recently used cache of cache_size bytes, the hot terms of the
+        queries are read and decoded once.
+
+        :param index_filename: Filename of the index, or base filename of the partitions
+        :param cache_size: Size in bytes of the postings cache, 0 to disable it
+        """
+        self._index_filename = index_filename
+        self._postings_cache = PostingsCache(cache_size)
+        if os.path.exists(segments_filename(index_filename)):
+            manifest = SegmentManifest.build_from_file(segments_filename(index_filename))
+            self.generation = manifest.generation
+            filenames = [os.path.join(os.path.dirname(index_filename), segment) for segment in manifest.segments]
+        else:
+            self.generation = 0
+            filenames = [index_filename]
+        # The segments are searched in docid order, so their postings lists can usually be concatenated
+        self._segments = sorted((IndexSegment(filename) for filename in filenames), key=IndexSegment.first_docid)
+        self._descriptor = self._segments[0].descriptor
+        if len(self._segments) == 1:
+            self._doclengths = self._segments[0].doclength_table
+        else:
+            self._doclengths = DocLengthTable.combine([segment.doclength_table for segment in self._segments])
+        self.avg_doclength = self._doclengths.avg_length()
+        self._universe = self._doclengths.docids
+        self._live_length = self._doclengths.total_length
+        self._live_docs = LiveDocs(self._universe) \
+            if len(self._segments) == 1 and self._segments[0].live_docs is not None else None
+        self._universe_bitmap = None
+        # The impacts of the impact ordered postings are computed with the statistics of their segment
+        self.impact_order = self._descriptor.impact_order if len(self._segments) == 1 else None
+        # Whether the postings hold the positions of the terms, they are empty lists otherwise
+        self.positions = self._descriptor.positions
+        # The query terms share the normalization memo of the process
+        self._compression = compile_compression(self._descriptor.compression) if self._descriptor.compression \
+            else None
 
     def get_postings(self, term: str):
         """Retrieves the postings for a given term
 
+        The postings may be shared with the postings cache and the other callers, they must not be modified. The
+        TermPostings itself is a new object, its attributes can be reassigned.
+
         :param term: term to search for
         :return: Postings list for the search term
         :rtype: TermPostings
         """
-        if self._descriptor.compression:
-            term = self._descriptor.compression.compress(term)
+        if self._compression:
+            term = self._compression.compress(term)
         # Fix for compression which filters out words, differentiates the case where no postings are found from
         # the case where the term should be disregarded for the search
         if term is None:
             return None
-        if term in self._dictionary:
-            self._index_file.seek(self._dictionary[term])
-            return extern_input(self._index_file.readline())
-        else:
-            return TermPostings(term, [])
+        postings = self._postings_cache.get(term)
+        if postings is None:
+            postings = self._read_postings(term)
+            self._postings_cache.put(term, postings)
+        return TermPostings(term, postings)
+
+    def normalize(self, term: str):
+        """Term normalized by the compression of the index
+
+        :return: Normalized term, None if the term is filtered out
+        :rtype: str
+        """
+        return self._compression.compress(term) if self._compression else term
+
+    def get_postings_many(self, terms: Iterable[str]):
+        """Retrieves the postings of several terms, as for a batch of queries
+
+        The terms are normalized first, the postings of each distinct term missing from the postings cache are then
+        read once, in the order of their position in the postings files.
+
+        :param terms: Terms to search for
+        :return: Postings list of each term, None for a term which should be disregarded for the search
+        :rtype: Dict[str, TermPostings]
+        """
+        normalized = {term: self.normalize(term) for term in terms}
+        postings_map = {}
+        missing = []
+        for term in set(normalized.values()):
+            if term is None:
+                continue
+            postings = self._postings_cache.get(term)
+            if postings is None:
+                missing.append(term)
+            else:
+                postings_map[term] = postings
+        segment_postings = [segment.get_postings_many(missing) for segment in self._segments]
+        for term in missing:
+            postings = self._combine_postings([term_postings[term].postings for term_postings in segment_postings])
+            self._postings_cache.put(term, postings)
+            postings_map[term] = postings
+        return {term: TermPostings(normalized_term, postings_map[normalized_term]) if normalized_term is not None
+                else None for term, normalized_term in normalized.items()}
+
+    def _read_postings(self, term: str):
+        """Reads the postings of a normalized term from the segments
+
+        :rtype: Sequence[Posting]
+        """
+        return self._combine_postings([segment.get_postings(term).postings for segment in self._segments])
+
+    def _combine_postings(self, segment_postings: List[Sequence]):
+        """Postings of a term in the index from its postings in each segment, in the docid order of the segments.
+
+        The postings of a single segment are kept with their deleted documents, see get_live_docs. The postings of
+        several segments are decoded without the documents deleted from each segment.
+
+        :rtype: Sequence[Posting]
+        """
+        if len(segment_postings) == 1:
+            postings = segment_postings[0]
+            return postings if isinstance(postings, ChunkedPostings) else tuple(postings)
+        postings_lists = [segment.live_postings(postings)
+                          for segment, postings in zip(self._segments, segment_postings)]
+        postings_lists = [postings for postings in postings_lists if postings]
+        if all(previous[-1].docid < postings[0].docid for previous, postings in zip(postings_lists, postings_lists[1:])):
+            return tuple(chain.from_iterable(postings_lists))
+        return tuple(heapq.merge(*postings_lists))
+
+    def get_term_stats(self, term: str):
+        """Statistics of a term read from the dictionaries, without reading its postings
+
+        The statistics are stored by the merge, so they count the deleted documents until their segment is merged,
+        see has_deletions.
+
+        :param term: Term to look up, normalized by the compression of the index
+        :return: Statistics of the term, all 0 for a term not in the index, None if the term is filtered out
+        :rtype: TermStats
+        """
+        if self._compression:
+            term = self._compression.compress(term)
+        if term is None:
+            return None
+        if len(self._segments) == 1:
+            return self._segments[0].get_term_stats(term)
+        segment_stats = [segment.get_term_stats(term) for segment in self._segments]
+        return TermStats(sum(stats.doc_freq for stats in segment_stats),
+                         sum(stats.coll_freq for stats in segment_stats), max(stats.max_tf for stats in segment_stats))
+
+    def get_term_impacts(self, term: str):
+        """Impacts of the blocks of postings of a term, the upper bounds of its scores, without reading its postings
+
+        The blocks of the segments follow each other when their postings do, otherwise the impacts of the segments are
+        gathered in one block.
+
+        :param term: Term to look up, normalized by the compression of the index
+        :return: Impacts of the term, None if the term is filtered out or if a segment has no impacts
+        :rtype: TermImpacts
+        """
+        if self._compression:
+            term = self._compression.compress(term)
+        if term is None:
+            return None
+        segment_impacts = [(segment, segment.get_impacts(term)) for segment in self._segments]
+        if any(impacts is None for segment, impacts in segment_impacts):
+            return None
+        segment_impacts = [(segment, impacts) for segment, impacts in segment_impacts if impacts.blocks]
+        if len(segment_impacts) <= 1:
+            return segment_impacts[0][1] if segment_impacts else TermImpacts([], [])
+        if all(previous.last_docids[-1] < segment.first_docid()
+               for (_, previous), (segment, _) in zip(segment_impacts, segment_impacts[1:])):
+            return TermImpacts(list(chain.from_iterable(impacts.last_docids for _, impacts in segment_impacts)),
+                               list(chain.from_iterable(impacts.blocks for _, impacts in segment_impacts)))
+        pairs = chain.from_iterable(chain.from_iterable(impacts.blocks for _, impacts in segment_impacts))
+        return TermImpacts([max(impacts.last_docids[-1] for _, impacts in segment_impacts)],
+                           [block_impacts(*zip(*pairs))])
+
+    def get_impact_segments(self, term: str):
+        """Postings of a term grouped by impact, the quantized BM25 weight of the term in their documents
+
+        :param term: Term to look up, normalized by the compression of the index
+        :return: Impact segments of the term in decreasing impact order, None if the term is filtered out or if the
+            index has no impact ordered postings, see impact_order
+        :rtype: List[ImpactSegment]
+        """
+        if self._compression:
+            term = self._compression.compress(term)
+        if term is None or self.impact_order is None:
+            return None
+        return self._segments[0].get_impact_segments(term)
+
+    def has_deletions(self):
+        """True if some documents of the index are deleted, their postings are then counted in the term statistics
+
+        :rtype: bool
+        """
+        return self._live_docs is not None or any(segment.live_docs is not None for segment in self._segments)
+
+    def get_postings_cache_stats(self):
+        """Hits, misses and evictions of the postings cache since the index was opened
+
+        :rtype: CacheStats
+        """
+        return self._postings_cache.stats()
+
+    def get_bitmap(self, term: str):
+        """Retrieves the bitmap of the live documents of a frequent term
+
+        :param term: term to search for
+        :return: Bitmap with the bit docid set for each document of the term, None if the term is not stored as a
+            bitmap or is disregarded by the compression
+        :rtype: int
+        """
+        if self._compression:
+            term = self._compression.compress(term)
+        if term is None:
+            return None
+        bitmaps = [segment.get_bitmap(term) for segment in self._segments]
+        if all(bitmap is None for bitmap in bitmaps):
+            return None
+        # The docids of the segments are disjoint, a segment without the bitmap converts its postings
+        bitmap = 0
+        for segment, segment_bitmap in zip(self._segments, bitmaps):
+            if segment_bitmap is None:
+                segment_bitmap = bitmap_from_docids(
+                    posting.docid for posting in segment.live_postings(segment.get_postings(term).postings))
+            bitmap |= segment_bitmap
+        if self._live_docs is not None:
+            bitmap &= self._live_docs.bitmap()
+        return bitmap
+
+    def get_universe_bitmap(self):
+        """Bitmap of the live documents
+
+        :rtype: int
+        """
+        if self._universe_bitmap is None:
+            self._universe_bitmap = bitmap_from_docids(self._universe)
+        return self._universe_bitmap
 
     def get_multiple_postings(self, terms: List[str]):
         postings_map = {}
@@ -55,32 +312,595 @@ class InvertedIndex:
             postings_map[term] = postings
         return postings_map
 
+    def get_compression_stats(self):
+        """Counters of the normalization memo shared by the process, None without compression
+
+        :rtype: CompressionStats
+        """
+        return self._compression.stats() if self._compression else None
+
+    def delete_documents(self, docids: Iterable[int]):
+        """Deletes documents from the index.
+
+        The documents are removed from the live documents of this index right away, and recorded in the deletes
+        file of their segments for the indexes opened afterwards. Their postings are purged when their segments are
+        merged.
+
+        :param docids: Documents to delete, the documents not in the index are ignored
+        :return: Number of documents deleted
+        :rtype: int
+        """
+        deleted = self._apply_deletes(sorted(set(docids)))
+        if deleted:
+            with segments_lock(self._index_filename):
+                manifest = read_segments(self._index_filename)
+                # The segments may have been merged since this index was opened
+                for segment in manifest.segments:
+                    segment_filename = os.path.join(os.path.dirname(self._index_filename), segment)
+                    doclength_table = InvertedIndexDescriptor.build_from_file(
+                        "{}.{}".format(segment_filename, INVERTED_INDEX_DESCRIPTOR_SUFFIX)).doclength_table
+                    segment_deleted = [docid for docid in deleted if docid in doclength_table]
+                    if segment_deleted:
+                        write_deleted_docids(segment_filename, segment_deleted)
+                manifest.generation += 1
+                manifest.write_to_file(segments_filename(self._index_filename))
+            self.generation = manifest.generation
+        return len(deleted)
+
+    def _apply_deletes(self, docids: List[int]):
+        """Removes documents from the live documents
+
+        :return: Documents which were live
+        :rtype: List[int]
+        """
+        if not docids:
+            return []
+        if self._live_docs is None:
+            self._live_docs = LiveDocs(self._doclengths.docids)
+        deleted = [docid for docid in docids if self._live_docs.delete(docid)]
+        if deleted:
+            removed = set(deleted)
+            self._universe = array("I", (docid for docid in self._universe if docid not in removed))
+            self._universe_bitmap = None
+            self._live_length -= sum(self._doclengths.get(docid) for docid in deleted)
+            self.avg_doclength = self._live_length / len(self._universe) if self._universe else 0
+        return deleted
+
+    def get_live_docs(self):
+        """Live documents bitset, None if no document was deleted
+
+        :rtype: LiveDocs
+        """
+        return self._live_docs
+
+    def get_segment_count(self):
+        return len(self._segments)
+
     def get_universe(self):
-        return self._descriptor.docid_list
+        return self._universe
 
     def get_doclength(self, docid: int):
-        docid = str(docid)
-        if docid in self._descriptor.doclengths:
-            return self._descriptor.doclengths[docid]
+        return self._doclengths.get(docid)
+
+    def get_doclength_table(self):
+        """Lengths of the documents indexed by docid, the deleted documents are kept
+
+        :rtype: DocLengthTable
+        """
+        return self._doclengths
+
+    def get_doc_count(self):
+        return len(self._universe)
+
+    def close(self):
+        """Closes the files of the segments, the postings read from them can no longer be decoded"""
+        self._postings_cache.clear()
+        for segment in self._segments:
+            segment.close()
+
+
+class PostingsCache:
+    def __init__(self, capacity: int):
+        """Least recently used cache of the postings of the terms, bounded by the estimated size of the postings.
+        The cache is shared by the threads of a batch search, its entries are read and updated under a lock.
+
+        :param capacity: Size in bytes of the cache, 0 disables the cache
+        """
+        self.capacity = capacity
+        self._entries = OrderedDict()
+        self._size = 0
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def estimate_size(postings: Sequence["Posting"]):
+        """Estimated size in bytes of postings once decoded"""
+        encoded_size = len(postings.data) if isinstance(postings, ChunkedPostings) else 0
+        return encoded_size + ESTIMATED_POSTING_SIZE * len(postings)
+
+    def get(self, term: str):
+        """Postings of a term, None if they are not cached
+
+        :rtype: Sequence[Posting]
+        """
+        with self._lock:
+            entry = self._entries.get(term)
+            if entry is None:
+                self._misses += 1
+                return None
+            self._hits += 1
+            self._entries.move_to_end(term)
+            return entry[0]
+
+    def put(self, term: str, postings: Sequence["Posting"]):
+        """Caches the postings of a term, evicting the least recently used terms to stay within the capacity"""
+        size = PostingsCache.estimate_size(postings)
+        if size > self.capacity:
+            return
+        with self._lock:
+            if term in self._entries:
+                self._size -= self._entries.pop(term)[1]
+            while self._size + size > self.capacity:
+                self._size -= self._entries.popitem(last=False)[1][1]
+                self._evictions += 1
+            self._entries[term] = (postings, size)
+            self._size += size
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+    def stats(self):
+        """
+        :rtype: CacheStats
+        """
+        with self._lock:
+            return CacheStats(self._hits, self._misses, self._evictions, self._size, self.capacity)
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class LiveDocs:
+    def __init__(self, docids: Sequence[int]):
+        """Bitset of the live documents of an index, one bit per docid
+
+        :param docids: Sorted docids of the documents of the index
+        """
+        self._bits = bytearray((docids[-1] + 8) // 8 if docids else 0)
+        for docid in docids:
+            self._bits[docid >> 3] |= 1 << (docid & 7)
+        self.count = len(docids)
+        self._bitmap = None
+
+    def __contains__(self, docid: int):
+        return (docid >> 3) < len(self._bits) and self._bits[docid >> 3] & (1 << (docid & 7)) != 0
+
+    def delete(self, docid: int):
+        """Clears the bit of a document
+
+        :return: True if the document was live
+        :rtype: bool
+        """
+        if docid not in self:
+            return False
+        self._bits[docid >> 3] &= ~(1 << (docid & 7)) & 0xFF
+        self.count -= 1
+        self._bitmap = None
+        return True
+
+    def bitmap(self):
+        """Live documents as a bitmap, bit docid of the integer is set for a live document
+
+        :rtype: int
+        """
+        if self._bitmap is None:
+            self._bitmap = int.from_bytes(self._bits, "little")
+        return self._bitmap
+
+    def __len__(self):
+        return self.count
+
+
+class IndexSegment:
+    def __init__(self, index_filename: str):
+        """Opens one immutable index, its postings file and dictionary with its descriptor
+
+        A term partitioned index is opened behind one dictionary, each term is looked up in the partition covering
+        its term range.
+
+        :param index_filename: Filename of the index, or base filename of the partitions
+        """
+        self.name = index_filename
+        self.descriptor = InvertedIndexDescriptor.build_from_file(
+            "{}.{}".format(index_filename, INVERTED_INDEX_DESCRIPTOR_SUFFIX))
+        if self.descriptor.partitions:
+            self._partition_first_terms = self.descriptor.partitions
+            filenames = [partition_filename(index_filename, i) for i in range(0, len(self.descriptor.partitions))]
         else:
+            self._partition_first_terms = [""]
+            filenames = [index_filename]
+        self._index_files = [open_postings_file(filename, self.descriptor.format_version, self.descriptor.codec)
+                             for filename in filenames]
+        self._dictionaries = [self._load_dictionary("{}.{}".format(filename, DICTIONARY_FILE_SUFFIX))
+                              for filename in filenames]
+        self._bitmaps = [BitmapFile.open("{}.{}".format(filename, BITMAPS_FILE_SUFFIX)) for filename in filenames]
+        self._impacts = [ImpactsFile.open("{}.{}".format(filename, IMPACTS_FILE_SUFFIX)) for filename in filenames]
+        self._impact_orders = [ImpactOrderFile("{}.{}".format(filename, IMPACT_ORDER_FILE_SUFFIX),
+                                               self.descriptor.codec) if self.descriptor.impact_order else None
+                               for filename in filenames]
+        self.deleted_docids = read_deleted_docids(index_filename)
+        self.doclength_table = self.descriptor.doclength_table
+        self.live_docs = None
+        if self.deleted_docids:
+            self.doclength_table = self.doclength_table.remove(self.deleted_docids)
+            self.live_docs = LiveDocs(self.doclength_table.docids)
+
+    def _load_dictionary(self, filename: str):
+        if self.descriptor.format_version == TEXT_FORMAT_VERSION:
+            return TextDictionary(filename)
+        return DictionaryFile(filename)
+
+    def get_postings(self, term: str):
+        """Retrieves the postings of a term already normalized by the compression of the index
+
+        :rtype: TermPostings
+        """
+        partition = bisect_right(self._partition_first_terms, term) - 1
+        entry = self._dictionaries[partition].lookup(term)
+        if entry:
+            return self._read_postings_at(partition, entry.file_pos)
+        else:
+            return TermPostings(term, [])
+
+    def get_postings_many(self, terms: Iterable[str]):
+        """Retrieves the postings of terms already normalized by the compression of the index. The dictionary entries
+        are looked up first, each postings file is then read forward, in the order of the positions of the postings
+
+        :rtype: Dict[str, TermPostings]
+        """
+        term_postings = {}
+        entries = []
+        for term in terms:
+            partition = bisect_right(self._partition_first_terms, term) - 1
+            entry = self._dictionaries[partition].lookup(term)
+            if entry:
+                entries.append((partition, entry.file_pos, term))
+            else:
+                term_postings[term] = TermPostings(term, [])
+        for partition, file_pos, term in sorted(entries):
+            term_postings[term] = self._read_postings_at(partition, file_pos)
+        return term_postings
+
+    def _read_postings_at(self, partition: int, file_pos: int):
+        """Reads the postings record at a position of the postings file of a partition, deleted documents included
+
+        :rtype: TermPostings
+        """
+        return self._index_files[partition].read_at(file_pos)
+
+    def live_postings(self, postings: Sequence["Posting"]):
+        """Postings of a term of the segment without the documents deleted from the segment
+
+        :rtype: Sequence[Posting]
+        """
+        if self.live_docs is None:
+            return postings
+        return [posting for posting in postings if posting.docid in self.live_docs]
+
+    def get_term_stats(self, term: str):
+        """Statistics of a term already normalized by the compression of the index, deleted documents included.
+
+        The text format has no statistics in its dictionary, they are computed from the postings.
+
+        :rtype: TermStats
+        """
+        partition = bisect_right(self._partition_first_terms, term) - 1
+        entry = self._dictionaries[partition].lookup(term)
+        if entry is None:
+            return TermStats(0, 0, 0)
+        if entry.doc_freq is None:
+            tfs = [posting.tf for posting in self._index_files[partition].read_at(entry.file_pos).postings]
+            return TermStats(len(tfs), sum(tfs), max(tfs, default=0))
+        return TermStats(entry.doc_freq, entry.coll_freq, entry.max_tf)
+
+    def get_impacts(self, term: str):
+        """Impacts of the blocks of postings of a term already normalized by the compression of the index, the deleted
+        documents are still counted in the impacts
+
+        :return: Impacts of the term, None if the index has no impacts
+        :rtype: TermImpacts
+        """
+        partition = bisect_right(self._partition_first_terms, term) - 1
+        if self._impacts[partition] is None:
+            return None
+        entry = self._dictionaries[partition].lookup(term)
+        return self._impacts[partition].read_at(entry.impacts_pos) if entry else TermImpacts([], [])
+
+    def get_impact_segments(self, term: str):
+        """Impact ordered postings of a term already normalized by the compression of the index, deleted documents
+        included
+
+        :return: Postings of the term grouped by impact, in decreasing impact order, None if the index has no impact
+            ordered postings
+        :rtype: List[ImpactSegment]
+        """
+        partition = bisect_right(self._partition_first_terms, term) - 1
+        if self._impact_orders[partition] is None:
+            return None
+        entry = self._dictionaries[partition].lookup(term)
+        return self._impact_orders[partition].read_at(entry.impact_order_pos) if entry else []
+
+    def get_bitmap(self, term: str):
+        """Retrieves the bitmap of the live documents of a term already normalized by the compression of the index
+
+        :return: Bitmap of the term, None if the term is not stored as a bitmap
+        :rtype: int
+        """
+        bitmaps = self._bitmaps[bisect_right(self._partition_first_terms, term) - 1]
+        bitmap = bitmaps.get(term) if bitmaps else None
+        if bitmap is not None and self.live_docs is not None:
+            bitmap &= self.live_docs.bitmap()
+        return bitmap
+
+    def first_docid(self):
+        docids = self.descriptor.doclength_table.docids
+        return docids[0] if docids else 0
+
+    def close(self):
+        for f in chain(self._index_files, self._dictionaries, filter(None, self._bitmaps), filter(None, self._impacts),
+                       filter(None, self._impact_orders)):
+            f.close()
+
+
+class SegmentManifest:
+    def __init__(self, segments: List[str], generation: int = 0, next_segment: int = 1):
+        """Live segments of an incremental index, written next to the index as its segments file
+
+        :param segments: Filenames of the live segments, relative to the directory of the index
+        :param generation: Incremented each time the live segments change
+        :param next_segment: Number of the next segment to create
+        """
+        self.segments = segments
+        self.generation = generation
+        self.next_segment = next_segment
+
+    def write_to_file(self, filename: str):
+        """Replaces the segments file atomically, readers see either the previous or the new segments"""
+        tmp_filename = "{}.tmp".format(filename)
+        with open(tmp_filename, "w") as f:
+            json.dump({"segments": self.segments, "generation": self.generation, "next_segment": self.next_segment},
+                      f, indent=4)
+        os.replace(tmp_filename, filename)
+
+    @staticmethod
+    def build_from_file(filename: str):
+        """Reads a segments file
+
+        :rtype: SegmentManifest
+        """
+        with open(filename, "r") as f:
+            manifest_dict = json.load(f)
+        return SegmentManifest(manifest_dict["segments"], manifest_dict["generation"], manifest_dict["next_segment"])
+
+
+def segments_filename(index_filename: str):
+    return "{}.{}".format(index_filename, SEGMENTS_FILE_SUFFIX)
+
+
+@contextmanager
+def segments_lock(index_filename: str):
+    """Exclusive lock on the segments file of an index, between the threads and the processes updating it"""
+    with open("{}.lock".format(segments_filename(index_filename)), "w") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def read_segments(index_filename: str):
+    """Live segments of an index, an index built by build_index is its only segment
+
+    :rtype: SegmentManifest
+    """
+    if os.path.exists(segments_filename(index_filename)):
+        return SegmentManifest.build_from_file(segments_filename(index_filename))
+    if os.path.exists("{}.{}".format(index_filename, INVERTED_INDEX_DESCRIPTOR_SUFFIX)):
+        return SegmentManifest([os.path.basename(index_filename)])
+    return SegmentManifest([])
+
+
+def read_deleted_docids(index_filename: str):
+    """Sorted docids deleted from an index segment, stored as little endian unsigned integers in its deletes file
+
+    :rtype: array
+    """
+    docids = array("I")
+    filename = "{}.{}".format(index_filename, DELETES_FILE_SUFFIX)
+    if os.path.exists(filename):
+        with open(filename, "rb") as f:
+            docids.frombytes(f.read())
+        if sys.byteorder == "big":
+            docids.byteswap()
+    return docids
+
+
+def write_deleted_docids(index_filename: str, docids: Iterable[int]):
+    """Adds docids to the deletes file of an index segment, the file is replaced atomically"""
+    deleted_docids = array("I", sorted(set(read_deleted_docids(index_filename)).union(docids)))
+    if sys.byteorder == "big":
+        deleted_docids.byteswap()
+    filename = "{}.{}".format(index_filename, DELETES_FILE_SUFFIX)
+    with open("{}.tmp".format(filename), "wb") as f:
+        f.write(deleted_docids.tobytes())
+    os.replace("{}.tmp".format(filename), filename)
+
+
+class DocLengthTable:
+    HEADER = struct.Struct("<4sBIIQ")
+    MAGIC = b"IIDL"
+    # Quantized lengths are stored on one byte as round(16 * log2(1 + length)), about 2% of precision
+    QUANTIZATION_SCALE = 16
+    # Length of the documents of each quantized value
+    QUANTIZED_LENGTHS = [2 ** (q / 16) - 1 for q in range(0, 256)]
+
+    def __init__(self, docids: array, lengths: array, total_length: int, quantized: bool = False):
+        """Packed table of the document lengths indexed by docid, with the sorted docids of the collection.
+
+        :param docids: Sorted docids of the collection
+        :param lengths: Length of each document indexed by docid, 0 for docids not in the collection
+        :param total_length: Sum of the exact lengths of the documents
+        :param quantized: True if the lengths are quantized on one byte
+        """
+        self.docids = docids
+        self.lengths = lengths
+        self.total_length = total_length
+        self.quantized = quantized
+
+    @staticmethod
+    def from_map(doclength_map: Dict[int, int], quantized: bool = False):
+        """Builds the table from a map of docid to document length
+
+        :param doclength_map: Length of each document
+        :param quantized: Set to true to quantize the lengths on one byte
+        :return: Document length table
+        :rtype: DocLengthTable
+        """
+        docids = array("I", sorted(int(docid) for docid in doclength_map))
+        lengths = array("B" if quantized else "I", [0]) * (docids[-1] + 1 if docids else 0)
+        for docid, length in doclength_map.items():
+            lengths[int(docid)] = DocLengthTable.quantize(length) if quantized else length
+        return DocLengthTable(docids, lengths, sum(doclength_map.values()), quantized)
+
+    @staticmethod
+    def quantize(length: int):
+        return min(255, round(DocLengthTable.QUANTIZATION_SCALE * log2(1 + length)))
+
+    @staticmethod
+    def combine(tables: List["DocLengthTable"]):
+        """Table of the documents of several tables with disjoint docids, quantized if all the tables are
+
+        :rtype: DocLengthTable
+        """
+        quantized = all(table.quantized for table in tables)
+        docids = array("I", sorted(chain.from_iterable(table.docids for table in tables)))
+        lengths = array("B" if quantized else "I", [0]) * (docids[-1] + 1 if docids else 0)
+        for table in tables:
+            for docid in table.docids:
+                lengths[docid] = table.lengths[docid] if quantized or not table.quantized else round(table.get(docid))
+        return DocLengthTable(docids, lengths, sum(table.total_length for table in tables), quantized)
+
+    def remove(self, docids: Iterable[int]):
+        """Table without the given documents
+
+        :rtype: DocLengthTable
+        """
+        removed = set(docids)
+        if not removed:
+            return self
+        lengths = array(self.lengths.typecode, self.lengths)
+        total_length = self.total_length
+        for docid in removed:
+            if docid in self:
+                total_length -= self.get(docid)
+                lengths[docid] = 0
+        docids = array("I", (docid for docid in self.docids if docid not in removed))
+        return DocLengthTable(docids, lengths, round(total_length), self.quantized)
+
+    def __contains__(self, docid: int):
+        i = bisect_left(self.docids, docid)
+        return i < len(self.docids) and self.docids[i] == docid
+
+    def get(self, docid: int):
+        """Length of a document, 0 if the docid is not in the collection"""
+        if docid >= len(self.lengths):
             return 0
+        if self.quantized:
+            return DocLengthTable.QUANTIZED_LENGTHS[self.lengths[docid]]
+        return self.lengths[docid]
 
-    def get_doc_count(self):
-        return len(self._descriptor.docid_list)
+    def avg_length(self):
+        return self.total_length / len(self.docids) if self.docids else 0
+
+    def __len__(self):
+        return len(self.docids)
+
+    def write_to_file(self, filename: str):
+        """Writes the table in little endian: header | lengths | docids
+
+        The header is: magic | quantized | lengths count | docids count | total length
+        """
+        lengths = array(self.lengths.typecode, self.lengths)
+        docids = array(self.docids.typecode, self.docids)
+        if sys.byteorder == "big":
+            lengths.byteswap()
+            docids.byteswap()
+        with open(filename, "wb") as f:
+            f.write(DocLengthTable.HEADER.pack(DocLengthTable.MAGIC, self.quantized, len(lengths), len(docids),
+                                               self.total_length))
+            f.write(lengths.tobytes())
+            f.write(docids.tobytes())
+
+    @staticmethod
+    def build_from_file(filename: str):
+        """Reads a table written by write_to_file with a single read
+
+        :rtype: DocLengthTable
+        """
+        with open(filename, "rb") as f:
+            data = f.read()
+        magic, quantized, lengths_count, docids_count, total_length = DocLengthTable.HEADER.unpack_from(data, 0)
+        if magic != DocLengthTable.MAGIC:
+            raise InvertedIndexException("Invalid document length table: {}".format(filename))
+        lengths = array("B" if quantized else "I")
+        pos = DocLengthTable.HEADER.size
+        lengths.frombytes(data[pos:pos + lengths_count * lengths.itemsize])
+        docids = array("I")
+        pos += lengths_count * lengths.itemsize
+        docids.frombytes(data[pos:pos + docids_count * docids.itemsize])
+        if sys.byteorder == "big":
+            lengths.byteswap()
+            docids.byteswap()
+        return DocLengthTable(docids, lengths, total_length, bool(quantized))
 
 
 class InvertedIndexDescriptor:
-    def __init__(self, docid_list: list, doclengths: Dict[int, int], compression: dict_compression.Compression = None):
-        self.docid_list = sorted(docid_list) if docid_list else None
-        self.doclengths = doclengths
+    def __init__(self, doclength_table: DocLengthTable, compression: dict_compression.Compression = None,
+                 format_version: int = BINARY_FORMAT_VERSION, codec: str = DEFAULT_CODEC, partitions: List[str] = None,
+                 impact_order: ImpactOrder = None, positions: bool = True):
+        """Details of an inverted index needed to read it and to score its documents
+
+        :param doclength_table: Docids of the collection and length in tokens of each document
+        :param compression: Dictionary compression applied to the terms
+        :param format_version: Format version of the postings files
+        :param codec: Name of the integer codec of the binary format
+        :param partitions: First term of each partition of a term partitioned index, None for a single index file
+        :param impact_order: Parameters of the impact ordered postings, None for an index built without them
+        :param positions: Whether the postings hold the positions of the terms, False for a docid and tf only index
+        """
+        self.doclength_table = doclength_table
         self.compression = compression
+        self.format_version = format_version
+        self.codec = codec
+        self.partitions = partitions
+        self.impact_order = impact_order
+        self.positions = positions
 
-    def _as_dict(self):
-        return {"compression": repr(self.compression), "doclengths": self.doclengths}
+    def _as_dict(self, doclengths_filename: str):
+        return {"compression": repr(self.compression), "format_version": self.format_version, "codec": self.codec,
+                "partitions": self.partitions, "doclengths_file": doclengths_filename,
+                "impact_order": list(self.impact_order) if self.impact_order else None, "positions": self.positions}
 
     def write_to_file(self, filename: str):
+        """Writes the descriptor as JSON and its document length table next to it"""
+        doclengths_filename = "{}.{}".format(os.path.basename(filename), DOCLENGTHS_FILE_SUFFIX)
+        self.doclength_table.write_to_file(os.path.join(os.path.dirname(filename), doclengths_filename))
         f = open(filename, "w")
-        json.dump(self._as_dict(), f, indent=4)
+        json.dump(self._as_dict(doclengths_filename), f, indent=4)
         f.close()
 
     @staticmethod
@@ -93,11 +913,22 @@ class InvertedIndexDescriptor:
         """
         f = open(filename, "r")
         descriptor_dict = json.load(f)
-        doclengths = descriptor_dict["doclengths"]
-        docid_list = list(doclengths.keys())
+        f.close()
+        if "doclengths_file" in descriptor_dict:
+            doclength_table = DocLengthTable.build_from_file(
+                os.path.join(os.path.dirname(filename), descriptor_dict["doclengths_file"]))
+        else:
+            # Older descriptors hold the doclengths as a JSON object with string docids
+            doclength_table = DocLengthTable.from_map(descriptor_dict["doclengths"])
         compression = eval(descriptor_dict["compression"]) if "compression" in descriptor_dict and \
                                                               descriptor_dict["compression"] else None
-        descriptor = InvertedIndexDescriptor(docid_list, doclengths, compression)
+        # Descriptors without a format version were written with the text format
+        format_version = descriptor_dict.get("format_version", TEXT_FORMAT_VERSION)
+        codec = descriptor_dict.get("codec")
+        impact_order = ImpactOrder(*descriptor_dict["impact_order"]) if descriptor_dict.get("impact_order") else None
+        descriptor = InvertedIndexDescriptor(doclength_table, compression, format_version, codec,
+                                             descriptor_dict.get("partitions"), impact_order,
+                                             descriptor_dict.get("positions", True))
 
         return descriptor
 
@@ -108,6 +939,11 @@ class Posting:
         self.docid = docid
         self.positions = positions
 
+    @property
+    def tf(self):
+        """Term frequency of the term in the document"""
+        return len(self.positions)
+
     def __eq__(self, other):
         if isinstance(other, int):
             return self.docid == other
@@ -132,6 +968,61 @@ class Posting:
         return "({}, {})".format(self.docid, positions_str)
 
 
+class LazyPosting(Posting):
+    def __init__(self, docid: int, tf: int, chunk_positions: "ChunkPositions", start: int):
+        """Posting decoded from a chunk of encoded postings. Its term frequency is decoded with the docid, its
+        positions are decoded the first time they are read
+
+        :param docid: Docid of the document
+        :param tf: Term frequency of the term in the document
+        :param chunk_positions: Positions of the chunk of the posting
+        :param start: Index of the first position of the posting in the positions of the chunk
+        """
+        self.docid = docid
+        self._tf = tf
+        self._chunk_positions = chunk_positions
+        self._start = start
+        self._positions = None
+
+    @property
+    def tf(self):
+        return self._tf
+
+    @property
+    def positions(self):
+        if self._positions is None:
+            self._positions = self._chunk_positions.get(self._start, self._tf)
+        return self._positions
+
+
+class ChunkPositions:
+    def __init__(self, data: bytes, count: int, codec: IntCodec):
+        """Position gaps of a chunk of encoded postings, decoded once the first time a posting of the chunk reads
+        its positions
+
+        :param data: Encoded position gaps, empty for an index built without positions
+        :param count: Number of positions of the chunk
+        :param codec: Integer codec of the position gaps
+        """
+        self._data = data
+        self._count = count
+        self._codec = codec
+        self._gaps = None
+
+    def get(self, start: int, tf: int):
+        """Positions of one posting of the chunk, empty for an index built without positions
+
+        :param start: Index of the first position of the posting in the chunk
+        :param tf: Term frequency of the posting
+        :rtype: List[int]
+        """
+        if not self._data:
+            return []
+        if self._gaps is None:
+            self._gaps = self._codec.decode(self._data, self._count)
+        return list(accumulate(self._gaps[start:start + tf]))
+
+
 class TermPostings:
     def __init__(self, term: str, postings: List[Posting]):
         self.term = term
@@ -168,3 +1059,1012 @@ def extern_input(line: str):
         postings.append(Posting(docid, positions))
 
     return TermPostings(term, postings)
+
+
+def encode_postings(postings: List[Posting], codec: IntCodec):
+    """Encodes a postings list in the binary format.
+
+    :param postings: Postings list sorted by docid
+    :param codec: Integer codec for the docids, tfs and positions
+    :type postings: List[Posting]
+    :type codec: IntCodec
+    :return: Encoded postings
+    :rtype: bytes
+    """
+    return encode_postings_columns([posting.docid for posting in postings],
+                                   [posting.tf for posting in postings],
+                                   list(chain.from_iterable(posting.positions for posting in postings)), codec)
+
+
+def encode_postings_columns(docids: Sequence[int], tfs: Sequence[int], positions: Sequence[int], codec: IntCodec):
+    """Encodes a postings list given as columns in the binary format.
+
+    The postings are split in chunks of at most POSTINGS_CHUNK_SIZE postings, the layout is:
+    doc count | chunk count | last docid | chunk*
+
+    Each chunk is: doc count | first docid gap | last docid - first docid | docids length | tfs length |
+    positions length | docid gaps | tfs | position gaps
+
+    The first docid of a chunk is a gap from the last docid of the previous chunk, or from 0 for the first chunk.
+    The docids of a chunk and the positions of each posting are gap encoded with the codec.
+
+    :param docids: Sorted docids of the postings
+    :param tfs: Term frequency of each posting
+    :param positions: Positions of all the postings, in docid order, empty to encode the postings without positions
+    :param codec: Integer codec for the docids, tfs and positions
+    :type docids: Sequence[int]
+    :type tfs: Sequence[int]
+    :type positions: Sequence[int]
+    :type codec: IntCodec
+    :return: Encoded postings
+    :rtype: bytes
+    """
+    position_gaps = list(positions)
+    if position_gaps:
+        i = 0
+        for tf in tfs:
+            for j in range(i + tf - 1, i, -1):
+                position_gaps[j] -= position_gaps[j - 1]
+            i += tf
+
+    chunks = []
+    last_docid = 0
+    position_i = 0
+    for chunk_start in range(0, len(docids), POSTINGS_CHUNK_SIZE):
+        chunk_docids = docids[chunk_start:chunk_start + POSTINGS_CHUNK_SIZE]
+        chunk_tfs = tfs[chunk_start:chunk_start + POSTINGS_CHUNK_SIZE]
+        position_count = sum(chunk_tfs)
+        docids_data = codec.encode([docid - previous for previous, docid in zip(chunk_docids, chunk_docids[1:])])
+        tfs_data = codec.encode(chunk_tfs)
+        positions_data = codec.encode(position_gaps[position_i:position_i + position_count])
+        position_i += position_count
+        chunks.extend([encode_uint(len(chunk_docids)), encode_uint(chunk_docids[0] - last_docid),
+                       encode_uint(chunk_docids[-1] - chunk_docids[0]), encode_uint(len(docids_data)),
+                       encode_uint(len(tfs_data)), encode_uint(len(positions_data)),
+                       docids_data, tfs_data, positions_data])
+        last_docid = chunk_docids[-1]
+
+    chunk_count = (len(docids) + POSTINGS_CHUNK_SIZE - 1) // POSTINGS_CHUNK_SIZE
+    return b"".join([encode_uint(len(docids)), encode_uint(chunk_count), encode_uint(last_docid)] + chunks)
+
+
+def decode_postings(data: bytes, codec: IntCodec):
+    """Decodes a postings list encoded with encode_postings
+
+    :param data: Encoded postings
+    :param codec: Integer codec used to encode the postings
+    :type data: bytes
+    :type codec: IntCodec
+    :return: Postings list
+    :rtype: List[Posting]
+    """
+    return list(chain.from_iterable(decode_chunk(data, header, codec) for header in read_chunk_headers(data)))
+
+
+def read_chunk_headers(data: bytes):
+    """Reads the headers of the chunks of encoded postings, without decoding the postings.
+
+    The first and last docids of the chunks are the skip pointers of the postings list: a search for a docid
+    decodes only the chunk which can hold it.
+
+    :param data: Encoded postings
+    :return: Header of each chunk
+    :rtype: List[ChunkHeader]
+    """
+    doc_count, pos = decode_uint(data, 0)
+    chunk_count, pos = decode_uint(data, pos)
+    last_docid, pos = decode_uint(data, pos)
+
+    headers = []
+    docid = 0
+    for chunk in range(0, chunk_count):
+        chunk_doc_count, pos = decode_uint(data, pos)
+        first_docid_gap, pos = decode_uint(data, pos)
+        docid_span, pos = decode_uint(data, pos)
+        docids_length, pos = decode_uint(data, pos)
+        tfs_length, pos = decode_uint(data, pos)
+        positions_length, pos = decode_uint(data, pos)
+        first_docid = docid + first_docid_gap
+        docid = first_docid + docid_span
+        headers.append(ChunkHeader(chunk_doc_count, first_docid, docid, pos, docids_length, tfs_length,
+                                   positions_length))
+        pos += docids_length + tfs_length + positions_length
+    return headers
+
+
+def decode_chunk(data: bytes, header: ChunkHeader, codec: IntCodec):
+    """Decodes the postings of one chunk of encoded postings. The positions of the postings are decoded only when
+    they are read
+
+    :rtype: List[Posting]
+    """
+    pos = header.pos
+    docids = accumulate(codec.decode(data[pos:pos + header.docids_length], header.doc_count - 1),
+                        initial=header.first_docid)
+    pos += header.docids_length
+    tfs = codec.decode(data[pos:pos + header.tfs_length], header.doc_count)
+    pos += header.tfs_length
+    chunk_positions = ChunkPositions(data[pos:pos + header.positions_length], sum(tfs), codec)
+
+    postings = []
+    i = 0
+    for docid, tf in zip(docids, tfs):
+        postings.append(LazyPosting(docid, tf, chunk_positions, i))
+        i += tf
+    return postings
+
+
+def decode_docids(data: bytes, codec: IntCodec):
+    """Decodes the docids of encoded postings, without their term frequencies and positions
+
+    :rtype: List[int]
+    """
+    return list(chain.from_iterable(
+        accumulate(codec.decode(data[header.pos:header.pos + header.docids_length], header.doc_count - 1),
+                   initial=header.first_docid) for header in read_chunk_headers(data)))
+
+
+def decode_tfs(data: bytes, codec: IntCodec):
+    """Decodes the term frequencies of encoded postings, without their docids and positions
+
+    :rtype: List[int]
+    """
+    return list(chain.from_iterable(
+        codec.decode(data[header.pos + header.docids_length:header.pos + header.docids_length + header.tfs_length],
+                     header.doc_count) for header in read_chunk_headers(data)))
+
+
+def bitmap_from_docids(docids: Iterable[int]):
+    """Bitmap with the bit docid set for each docid
+
+    :rtype: int
+    """
+    bits = bytearray()
+    for docid in docids:
+        if docid >> 3 >= len(bits):
+            bits.extend(bytes((docid >> 3) + 1 - len(bits)))
+        bits[docid >> 3] |= 1 << (docid & 7)
+    return int.from_bytes(bits, "little")
+
+
+def docids_from_bitmap(bitmap: int):
+    """Sorted docids of the bits set in a bitmap
+
+    :rtype: List[int]
+    """
+    docids = []
+    for i, byte in enumerate(bitmap.to_bytes((bitmap.bit_length() + 7) // 8, "little")):
+        while byte:
+            low_bit = byte & -byte
+            docids.append((i << 3) + low_bit.bit_length() - 1)
+            byte ^= low_bit
+    return docids
+
+
+class ChunkedPostings(collections.abc.Sequence):
+    def __init__(self, data: bytes, codec: IntCodec):
+        """Postings list read from encoded postings, each chunk is decoded the first time one of its postings is read.
+
+        The last docid of each chunk is a skip pointer: search jumps over the chunks ending before the searched docid
+        without decoding them, so an intersection with a short list decodes about one chunk per posting of the short
+        list.
+
+        :param data: Encoded postings
+        :param codec: Integer codec used to encode the postings
+        """
+        self.data = data
+        self._codec = codec
+        self._headers = read_chunk_headers(data)
+        self._last_docids = [header.last_docid for header in self._headers]
+        self._chunk_starts = list(accumulate((header.doc_count for header in self._headers), initial=0))
+        self._chunks = [None] * len(self._headers)
+        self._chunk_docids = [None] * len(self._headers)
+        self._columns = None
+
+    def _chunk(self, chunk: int):
+        postings = self._chunks[chunk]
+        if postings is None:
+            # The postings are shared by the threads of a batch search: a chunk is published with its docids already
+            # set, a chunk decoded by two threads at once is only decoded twice
+            postings = decode_chunk(self.data, self._headers[chunk], self._codec)
+            self._chunk_docids[chunk] = [posting.docid for posting in postings]
+            self._chunks[chunk] = postings
+        return postings
+
+    def search(self, docid: int, lo: int = 0):
+        """Index of the first posting at or after lo with a docid greater or equal to docid
+
+        :param docid: Docid to search for
+        :param lo: Index where the search starts
+        :return: Index of the posting, len(self) if all the docids after lo are lower
+        :rtype: int
+        """
+        if lo >= len(self):
+            return len(self)
+        chunk = bisect_right(self._chunk_starts, lo) - 1
+        if self._last_docids[chunk] < docid:
+            chunk = bisect_left(self._last_docids, docid, chunk + 1)
+            if chunk == len(self._headers):
+                return len(self)
+            lo = self._chunk_starts[chunk]
+        start = self._chunk_starts[chunk]
+        self._chunk(chunk)
+        return start + bisect_left(self._chunk_docids[chunk], docid, lo - start)
+
+    def columns(self):
+        """Docids and term frequencies of the postings, decoded once without the positions
+
+        :return: Tuple (docids, tfs) of packed arrays
+        :rtype: Tuple[array, array]
+        """
+        if self._columns is None:
+            self._columns = (array("I", decode_docids(self.data, self._codec)),
+                             array("I", decode_tfs(self.data, self._codec)))
+        return self._columns
+
+    def get(self, docid: int):
+        """Posting of a document, None if the document is not in the postings
+
+        :rtype: Posting
+        """
+        chunk = bisect_left(self._last_docids, docid)
+        if chunk == len(self._headers) or self._headers[chunk].first_docid > docid:
+            return None
+        postings = self._chunk(chunk)
+        i = bisect_left(self._chunk_docids[chunk], docid)
+        return postings[i] if self._chunk_docids[chunk][i] == docid else None
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return list(self)[i]
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError("postings index out of range")
+        chunk = bisect_right(self._chunk_starts, i) - 1
+        return self._chunk(chunk)[i - self._chunk_starts[chunk]]
+
+    def __iter__(self):
+        for chunk in range(0, len(self._headers)):
+            yield from self._chunk(chunk)
+
+    def __contains__(self, docid: int):
+        return self.get(docid) is not None
+
+    def __len__(self):
+        return self._chunk_starts[-1]
+
+
+def concat_encoded_postings(encoded_postings: List[bytes]):
+    """Concatenates encoded postings lists of a term without decoding them.
+
+    The chunks are copied as is, only the first docid gap of the first chunk of each list is re-based on the last
+    docid of the previous list.
+
+    :param encoded_postings: Encoded postings of the same term, each list must start after the end of the previous one
+    :type encoded_postings: List[bytes]
+    :return: Encoded postings of the concatenated lists
+    :rtype: bytes
+    """
+    doc_count = 0
+    chunk_count = 0
+    last_docid = 0
+    chunks = []
+    for data in encoded_postings:
+        list_doc_count, pos = decode_uint(data, 0)
+        list_chunk_count, pos = decode_uint(data, pos)
+        list_last_docid, pos = decode_uint(data, pos)
+        first_chunk_doc_count, first_docid_pos = decode_uint(data, pos)
+        first_docid, chunk_pos = decode_uint(data, first_docid_pos)
+        if first_docid <= last_docid:
+            raise InvertedIndexException("Postings lists must be in docid order to be concatenated: docid {} after {}"
+                                         .format(first_docid, last_docid))
+        chunks.append(data[pos:first_docid_pos])
+        chunks.append(encode_uint(first_docid - last_docid))
+        chunks.append(data[chunk_pos:])
+        doc_count += list_doc_count
+        chunk_count += list_chunk_count
+        last_docid = list_last_docid
+    return b"".join([encode_uint(doc_count), encode_uint(chunk_count), encode_uint(last_docid)] + chunks)
+
+
+def merge_encoded_postings(encoded_postings: List[bytes], codec: IntCodec):
+    """Merges encoded postings lists of a term with interleaved docids, by decoding them.
+
+    :param encoded_postings: Encoded postings of the same term, with disjoint docids
+    :param codec: Integer codec of the postings
+    :type encoded_postings: List[bytes]
+    :type codec: IntCodec
+    :return: Encoded postings of the merged lists
+    :rtype: bytes
+    """
+    return encode_postings(list(heapq.merge(*(decode_postings(data, codec) for data in encoded_postings))), codec)
+
+
+def _read_uint(file):
+    """Reads a single variable byte integer from a binary file, returns None at the end of the file."""
+    n = 0
+    shift = 0
+    while True:
+        byte = file.read(1)
+        if not byte:
+            return None
+        byte = byte[0]
+        if byte & 0x80:
+            return n | ((byte & 0x7F) << shift)
+        n |= byte << shift
+        shift += 7
+
+
+def partition_filename(index_filename: str, partition: int):
+    """Filename of a partition of a term partitioned index"""
+    return "{}.part{}".format(index_filename, partition)
+
+
+class PostingsFileWriter:
+    def __init__(self, filename: str, codec: str = DEFAULT_CODEC, buffer_size: int = io.DEFAULT_BUFFER_SIZE):
+        """Writes term postings records in the binary format.
+
+        Each record is: term length | term | postings length | postings
+
+        :param filename: Name of the postings file to create
+        :param codec: Name of the integer codec for the postings
+        :param buffer_size: Size in bytes of the write buffer
+        """
+        self.name = filename
+        self._file = open(filename, "wb", buffering=buffer_size)
+        self._codec = int_codecs.get_codec(codec)
+        self._file_pos = 0
+
+    def write(self, term_postings: TermPostings):
+        """Writes the postings of a term at the end of the file.
+
+        :param term_postings: Postings to write
+        :return: Position of the record in the file
+        :rtype: int
+        """
+        return self.write_record(term_postings.term, encode_postings(term_postings.postings, self._codec))
+
+    def write_columns(self, term: str, docids: Sequence[int], tfs: Sequence[int], positions: Sequence[int]):
+        """Writes the postings of a term given as columns at the end of the file, see encode_postings_columns.
+
+        :return: Position of the record in the file
+        :rtype: int
+        """
+        return self.write_record(term, encode_postings_columns(docids, tfs, positions, self._codec))
+
+    def write_record(self, term: str, postings: bytes):
+        """Writes a record with already encoded postings at the end of the file.
+
+        :param term: Term of the record
+        :param postings: Postings encoded with the codec of this file
+        :return: Position of the record in the file
+        :rtype: int
+        """
+        term = term.encode("utf-8")
+        record = b"".join([encode_uint(len(term)), term, encode_uint(len(postings)), postings])
+        file_pos = self._file_pos
+        self._file.write(record)
+        self._file_pos += len(record)
+        return file_pos
+
+    def flush(self):
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+
+class PostingsFileReader:
+    def __init__(self, filename: str, codec: str = DEFAULT_CODEC, buffer_size: int = io.DEFAULT_BUFFER_SIZE):
+        """Reads term postings records written by PostingsFileWriter.
+
+        Iterating over the reader returns the records in file order.
+
+        :param filename: Name of the postings file to read
+        :param codec: Name of the integer codec of the postings
+        :param buffer_size: Size in bytes of the read buffer
+        """
+        self.name = filename
+        self._file = open(filename, "rb", buffering=buffer_size)
+        self._codec = int_codecs.get_codec(codec)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        record = self.read_record()
+        if record is None:
+            raise StopIteration
+        term, postings = record
+        return TermPostings(term, decode_postings(postings, self._codec))
+
+    def read_record(self):
+        """Reads the next record without decoding its postings
+
+        :return: Tuple (term, encoded postings) or None at the end of the file
+        :rtype: Tuple[str, bytes]
+        """
+        term_length = _read_uint(self._file)
+        if term_length is None:
+            return None
+        term = self._file.read(term_length).decode("utf-8")
+        return term, self._file.read(_read_uint(self._file))
+
+    def read_at(self, file_pos: int):
+        """Reads the postings record found at the given position
+
+        :param file_pos: Position of the record in the file
+        :return: Postings of the record
+        :rtype: TermPostings
+        """
+        self._file.seek(file_pos)
+        term, postings = self.read_record()
+        return TermPostings(term, ChunkedPostings(postings, self._codec))
+
+    def close(self):
+        self._file.close()
+
+
+class TextPostingsFileReader:
+    def __init__(self, filename: str):
+        """Reads term postings lines in the text format of extern_output."""
+        self.name = filename
+        self._file = open(filename, "r")
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        next_line = self._file.readline().strip()
+        if not next_line:
+            raise StopIteration
+        return extern_input(next_line)
+
+    def read_at(self, file_pos: int):
+        self._file.seek(file_pos)
+        return extern_input(self._file.readline())
+
+    def close(self):
+        self._file.close()
+
+
+def open_postings_file(filename: str, format_version: int = BINARY_FORMAT_VERSION, codec: str = DEFAULT_CODEC):
+    """Opens a postings file for reading according to its format
+
+    :param filename: Name of the postings file
+    :param format_version: Format version of the file, found in the InvertedIndexDescriptor
+    :param codec: Name of the integer codec for the binary format
+    :return: Reader for the postings file
+    :rtype: PostingsFileReader
+    """
+    if format_version == TEXT_FORMAT_VERSION:
+        return TextPostingsFileReader(filename)
+    elif format_version == BINARY_FORMAT_VERSION:
+        return PostingsFileReader(filename, codec)
+    else:
+        raise InvertedIndexException("Unsupported postings format version: {}".format(format_version))
+
+
+class DictionaryFileWriter:
+    FOOTER = struct.Struct("<QII4s")
+    MAGIC = b"IIDF"
+
+    def __init__(self, filename: str, block_size: int = DICTIONARY_BLOCK_SIZE):
+        """Writes the sorted dictionary of term to postings record position in the binary format.
+
+        The terms are stored in blocks of block_size terms with front coding, followed by the table of the position of
+        each block and a fixed size footer: blocks table position | block count | term count | magic
+
+        Each block is: term count | entry*
+        Each entry is: common prefix length | suffix length | suffix | record position gap | document frequency |
+        collection frequency - document frequency | maximum term frequency | impacts position gap |
+        impact ordered postings position gap
+        The first entry of a block has no common prefix and its positions are not gaps.
+
+        :param filename: Name of the dictionary file
+        :param block_size: Number of terms in a block
+        """
+        self.name = filename
+        self._file = open(filename, "wb")
+        self._block_size = block_size
+        self._block = []
+        self._block_positions = []
+        self._file_pos = 0
+        self._term_count = 0
+
+    def write(self, term: str, file_pos: int, doc_freq: int, coll_freq: int, max_tf: int, impacts_pos: int,
+              impact_order_pos: int):
+        """Adds the next term of the dictionary, terms must be written in sorted order
+
+        :param term: Term of the entry
+        :param file_pos: Position of the postings record of the term
+        :param doc_freq: Document frequency of the term
+        :param coll_freq: Number of occurrences of the term in the collection
+        :param max_tf: Highest term frequency of the term in a document
+        :param impacts_pos: Position of the impacts of the term in the impacts file
+        :param impact_order_pos: Position of the impact ordered postings of the term, 0 without them
+        :return: None
+        """
+        self._block.append((term.encode("utf-8"), file_pos, doc_freq, coll_freq, max_tf, impacts_pos,
+                            impact_order_pos))
+        self._term_count += 1
+        if len(self._block) >= self._block_size:
+            self._write_block()
+
+    def _write_block(self):
+        entries = [encode_uint(len(self._block))]
+        last_term = b""
+        last_file_pos = 0
+        last_impacts_pos = 0
+        last_impact_order_pos = 0
+        for term, file_pos, doc_freq, coll_freq, max_tf, impacts_pos, impact_order_pos in self._block:
+            prefix_length = 0
+            for a, b in zip(last_term, term):
+                if a != b:
+                    break
+                prefix_length += 1
+            entries.extend([encode_uint(prefix_length), encode_uint(len(term) - prefix_length), term[prefix_length:],
+                            encode_uint(file_pos - last_file_pos), encode_uint(doc_freq),
+                            encode_uint(coll_freq - doc_freq), encode_uint(max_tf),
+                            encode_uint(impacts_pos - last_impacts_pos),
+                            encode_uint(impact_order_pos - last_impact_order_pos)])
+            last_term = term
+            last_file_pos = file_pos
+            last_impacts_pos = impacts_pos
+            last_impact_order_pos = impact_order_pos
+        block = b"".join(entries)
+        self._block_positions.append(self._file_pos)
+        self._file.write(block)
+        self._file_pos += len(block)
+        self._block = []
+
+    def flush(self):
+        self._file.flush()
+
+    def close(self):
+        if self._block:
+            self._write_block()
+        self._file.write(struct.pack("<{}Q".format(len(self._block_positions)), *self._block_positions))
+        self._file.write(DictionaryFileWriter.FOOTER.pack(self._file_pos, len(self._block_positions),
+                                                          self._term_count, DictionaryFileWriter.MAGIC))
+        self._file.close()
+
+
+class DictionaryFile:
+    def __init__(self, filename: str):
+        """Memory mapped dictionary written by DictionaryFileWriter.
+
+        Opening reads only the footer, the terms are searched in place with a binary search over the first term of
+        each block followed by a scan of the front coded block.
+
+        :param filename: Name of the dictionary file
+        """
+        self.name = filename
+        self._file = open(filename, "rb")
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        footer = DictionaryFileWriter.FOOTER
+        self._blocks_table_pos, self._block_count, self.term_count, magic = footer.unpack_from(
+            self._map, len(self._map) - footer.size)
+        if magic != DictionaryFileWriter.MAGIC:
+            raise InvertedIndexException("Invalid dictionary file: {}".format(filename))
+
+    def lookup(self, term: str):
+        """Searches the dictionary for a term
+
+        :param term: Term to search
+        :return: Entry of the term or None if the term is not in the dictionary
+        :rtype: DictionaryEntry
+        """
+        key = term.encode("utf-8")
+        # Find the last block starting at or before the term
+        lo = 0
+        hi = self._block_count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if key < self._block_head(mid):
+                hi = mid
+            else:
+                lo = mid + 1
+        if lo == 0:
+            return None
+        for block_term, entry in self._block_entries(lo - 1):
+            if block_term == key:
+                return entry
+            elif block_term > key:
+                break
+        return None
+
+    def __iter__(self):
+        """Iterates over the (term, DictionaryEntry) of the dictionary in sorted order"""
+        for block in range(0, self._block_count):
+            for term, entry in self._block_entries(block):
+                yield term.decode("utf-8"), entry
+
+    def __len__(self):
+        return self.term_count
+
+    def _block_pos(self, block: int):
+        return struct.unpack_from("<Q", self._map, self._blocks_table_pos + 8 * block)[0]
+
+    def _block_head(self, block: int):
+        """First term of a block, as bytes"""
+        pos = decode_uint(self._map, self._block_pos(block))[1]
+        pos = decode_uint(self._map, pos)[1]
+        length, pos = decode_uint(self._map, pos)
+        return self._map[pos:pos + length]
+
+    def _block_entries(self, block: int):
+        """Decodes the entries of a block
+
+        :return: Stream of tuples (term as bytes, DictionaryEntry)
+        :rtype: Iterable[Tuple[bytes, DictionaryEntry]]
+        """
+        term_count, pos = decode_uint(self._map, self._block_pos(block))
+        term = b""
+        file_pos = 0
+        impacts_pos = 0
+        impact_order_pos = 0
+        for i in range(0, term_count):
+            prefix_length, pos = decode_uint(self._map, pos)
+            suffix_length, pos = decode_uint(self._map, pos)
+            term = term[:prefix_length] + self._map[pos:pos + suffix_length]
+            file_pos_gap, pos = decode_uint(self._map, pos + suffix_length)
+            doc_freq, pos = decode_uint(self._map, pos)
+            coll_freq_gap, pos = decode_uint(self._map, pos)
+            max_tf, pos = decode_uint(self._map, pos)
+            impacts_pos_gap, pos = decode_uint(self._map, pos)
+            impact_order_pos_gap, pos = decode_uint(self._map, pos)
+            file_pos += file_pos_gap
+            impacts_pos += impacts_pos_gap
+            impact_order_pos += impact_order_pos_gap
+            yield term, DictionaryEntry(file_pos, doc_freq, doc_freq + coll_freq_gap, max_tf, impacts_pos,
+                                        impact_order_pos)
+
+    def close(self):
+        self._map.close()
+        self._file.close()
+
+
+class BitmapFileWriter:
+    def __init__(self, filename: str):
+        """Writes the bitmaps of the frequent terms of an index, in term order.
+
+        Each record is: term length | term | bitmap length | bitmap as a little endian integer
+
+        :param filename: Name of the bitmaps file
+        """
+        self.name = filename
+        self._file = open(filename, "wb")
+
+    @staticmethod
+    def is_dense(doc_freq: int, last_docid: int):
+        """True if the postings of a term are stored as a bitmap as well"""
+        return doc_freq >= BITMAP_MIN_DF and doc_freq * BITMAP_DENSITY > last_docid
+
+    def write(self, term: str, bitmap: int):
+        term = term.encode("utf-8")
+        data = bitmap.to_bytes((bitmap.bit_length() + 7) // 8, "little")
+        self._file.write(b"".join([encode_uint(len(term)), term, encode_uint(len(data)), data]))
+
+    def close(self):
+        self._file.close()
+
+
+class BitmapFile:
+    def __init__(self, filename: str):
+        """Memory mapped bitmaps written by BitmapFileWriter, opening reads the terms and the position of their bitmap
+
+        :param filename: Name of the bitmaps file
+        """
+        self.name = filename
+        self._file = open(filename, "rb")
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if os.path.getsize(filename) else b""
+        self._bitmaps = {}
+        pos = 0
+        while pos < len(self._map):
+            term_length, pos = decode_uint(self._map, pos)
+            term = self._map[pos:pos + term_length].decode("utf-8")
+            length, pos = decode_uint(self._map, pos + term_length)
+            self._bitmaps[term] = (pos, length)
+            pos += length
+
+    @staticmethod
+    def open(filename: str):
+        """Opens a bitmaps file, None for the indexes built without bitmaps
+
+        :rtype: BitmapFile
+        """
+        return BitmapFile(filename) if os.path.exists(filename) else None
+
+    def get(self, term: str):
+        """Bitmap of a term, None if the term has no bitmap
+
+        :rtype: int
+        """
+        if term not in self._bitmaps:
+            return None
+        pos, length = self._bitmaps[term]
+        return int.from_bytes(self._map[pos:pos + length], "little")
+
+    def __len__(self):
+        return len(self._bitmaps)
+
+    def close(self):
+        if self._map:
+            self._map.close()
+        self._file.close()
+
+
+def block_impacts(tfs: Iterable[int], doclengths: Iterable[int]):
+    """Impacts of a block of postings: its (tf, doclength) pairs which no other pair beats with a higher or equal tf and
+    a lower or equal doclength.
+
+    A BM25 weight grows with the tf and decreases with the doclength, so the best weight of the block, whatever the
+    BM25 parameters, is the weight of one of its impacts.
+
+    :param tfs: Term frequency of each posting of the block
+    :param doclengths: Length of the document of each posting
+    :return: Impacts sorted by increasing tf and doclength
+    :rtype: List[Tuple[int, int]]
+    """
+    impacts = []
+    for tf, doclength in sorted(zip(tfs, doclengths), key=lambda pair: (-pair[0], pair[1])):
+        if not impacts or doclength < impacts[-1][1]:
+            impacts.append((tf, doclength))
+    impacts.reverse()
+    return impacts
+
+
+class ImpactsFileWriter:
+    def __init__(self, filename: str):
+        """Writes the impacts of the blocks of postings of each term, in term order.
+
+        Each record is: block count | block*
+        Each block is: last docid gap | impact count | (tf gap | doclength gap)*
+        The last docids are gaps from the previous block, the tfs and doclengths of a block are increasing and gap
+        encoded from 0.
+
+        :param filename: Name of the impacts file
+        """
+        self.name = filename
+        self._file = open(filename, "wb")
+        self._file_pos = 0
+
+    def write(self, last_docids: Sequence[int], blocks: Sequence[List[Tuple[int, int]]]):
+        """Writes the impacts of a term
+
+        :param last_docids: Last docid of each block of postings
+        :param blocks: Impacts of each block, see block_impacts
+        :return: Position of the record in the file
+        :rtype: int
+        """
+        record = [encode_uint(len(blocks))]
+        last_docid = 0
+        for block_last_docid, impacts in zip(last_docids, blocks):
+            record.extend([encode_uint(block_last_docid - last_docid), encode_uint(len(impacts))])
+            tf = 0
+            doclength = 0
+            for impact_tf, impact_doclength in impacts:
+                record.extend([encode_uint(impact_tf - tf), encode_uint(impact_doclength - doclength)])
+                tf = impact_tf
+                doclength = impact_doclength
+            last_docid = block_last_docid
+        record = b"".join(record)
+        file_pos = self._file_pos
+        self._file.write(record)
+        self._file_pos += len(record)
+        return file_pos
+
+    def close(self):
+        self._file.close()
+
+
+class ImpactsFile:
+    def __init__(self, filename: str):
+        """Memory mapped impacts written by ImpactsFileWriter, the records are found with the dictionary
+
+        :param filename: Name of the impacts file
+        """
+        self.name = filename
+        self._file = open(filename, "rb")
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if os.path.getsize(filename) else b""
+
+    @staticmethod
+    def open(filename: str):
+        """Opens an impacts file, None for the indexes built without impacts
+
+        :rtype: ImpactsFile
+        """
+        return ImpactsFile(filename) if os.path.exists(filename) else None
+
+    def read_at(self, file_pos: int):
+        """Reads the impacts record found at the given position
+
+        :rtype: TermImpacts
+        """
+        block_count, pos = decode_uint(self._map, file_pos)
+        last_docids = []
+        blocks = []
+        last_docid = 0
+        for block in range(0, block_count):
+            last_docid_gap, pos = decode_uint(self._map, pos)
+            impact_count, pos = decode_uint(self._map, pos)
+            last_docid += last_docid_gap
+            impacts = []
+            tf = 0
+            doclength = 0
+            for i in range(0, impact_count):
+                tf_gap, pos = decode_uint(self._map, pos)
+                doclength_gap, pos = decode_uint(self._map, pos)
+                tf += tf_gap
+                doclength += doclength_gap
+                impacts.append((tf, doclength))
+            last_docids.append(last_docid)
+            blocks.append(impacts)
+        return TermImpacts(last_docids, blocks)
+
+    def close(self):
+        if self._map:
+            self._map.close()
+        self._file.close()
+
+
+def impact_order_parameters(k1: float, b: float, doc_count: int):
+    """Parameters of the impact ordered postings of a collection.
+
+    A BM25 weight is lower than (k1 + 1) * log2(doc_count), this range is quantized on IMPACT_LEVELS levels.
+
+    :param k1: BM25 parameter k1 of the impacts
+    :param b: BM25 parameter b of the impacts
+    :param doc_count: Number of documents of the collection
+    :rtype: ImpactOrder
+    """
+    max_weight = (k1 + 1) * log2(doc_count) if doc_count > 1 else 1
+    return ImpactOrder(k1, b, max_weight / IMPACT_LEVELS)
+
+
+class ImpactSegment:
+    def __init__(self, impact: int, doc_count: int, data: bytes, codec: IntCodec):
+        """Postings of a term sharing one impact, the docids are decoded the first time they are read
+
+        :param impact: Quantized weight of the term in the documents
+        :param doc_count: Number of documents
+        :param data: Encoded docid gaps
+        :param codec: Integer codec of the docid gaps
+        """
+        self.impact = impact
+        self.doc_count = doc_count
+        self._data = data
+        self._codec = codec
+        self._docids = None
+
+    def docids(self):
+        """Sorted docids of the documents
+
+        :rtype: List[int]
+        """
+        if self._docids is None:
+            self._docids = list(accumulate(self._codec.decode(self._data, self.doc_count)))
+        return self._docids
+
+    def __len__(self):
+        return self.doc_count
+
+
+class ImpactOrderFileWriter:
+    def __init__(self, filename: str, codec: IntCodec):
+        """Writes the postings of each term grouped by impact in decreasing impact order, in term order.
+
+        Each record is: segment count | segment*
+        Each segment is: impact gap | doc count | docids length | docid gaps
+        The impacts are gaps from the impact of the previous segment, or from IMPACT_LEVELS for the first segment. The
+        docids of a segment are gap encoded from 0 with the codec.
+
+        :param filename: Name of the impact ordered postings file
+        :param codec: Integer codec of the docid gaps
+        """
+        self.name = filename
+        self._codec = codec
+        self._file = open(filename, "wb")
+        self._file_pos = 0
+
+    def write(self, docids: Sequence[int], impacts: Sequence[int]):
+        """Writes the impact ordered postings of a term
+
+        :param docids: Sorted docids of the postings of the term
+        :param impacts: Impact of the term in each document
+        :return: Position of the record in the file
+        :rtype: int
+        """
+        segments = {}
+        for docid, impact in zip(docids, impacts):
+            segments.setdefault(impact, []).append(docid)
+        record = [encode_uint(len(segments))]
+        last_impact = IMPACT_LEVELS
+        for impact in sorted(segments, reverse=True):
+            segment_docids = segments[impact]
+            data = self._codec.encode([docid - previous for previous, docid
+                                       in zip([0] + segment_docids, segment_docids)])
+            record.extend([encode_uint(last_impact - impact), encode_uint(len(segment_docids)),
+                           encode_uint(len(data)), data])
+            last_impact = impact
+        record = b"".join(record)
+        file_pos = self._file_pos
+        self._file.write(record)
+        self._file_pos += len(record)
+        return file_pos
+
+    def close(self):
+        self._file.close()
+
+
+class ImpactOrderFile:
+    def __init__(self, filename: str, codec: str = DEFAULT_CODEC):
+        """Memory mapped impact ordered postings written by ImpactOrderFileWriter, the records are found with the
+        dictionary
+
+        :param filename: Name of the impact ordered postings file
+        :param codec: Name of the integer codec of the docid gaps
+        """
+        self.name = filename
+        self._codec = int_codecs.get_codec(codec)
+        self._file = open(filename, "rb")
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if os.path.getsize(filename) else b""
+
+    def read_at(self, file_pos: int):
+        """Reads the impact segments of the record found at the given position, without decoding their docids
+
+        :rtype: List[ImpactSegment]
+        """
+        segment_count, pos = decode_uint(self._map, file_pos)
+        segments = []
+        impact = IMPACT_LEVELS
+        for i in range(0, segment_count):
+            impact_gap, pos = decode_uint(self._map, pos)
+            doc_count, pos = decode_uint(self._map, pos)
+            length, pos = decode_uint(self._map, pos)
+            impact -= impact_gap
+            segments.append(ImpactSegment(impact, doc_count, self._map[pos:pos + length], self._codec))
+            pos += length
+        return segments
+
+    def close(self):
+        if self._map:
+            self._map.close()
+        self._file.close()
+
+
+class TextDictionary:
+    def __init__(self, filename: str):
+        """Dictionary of an index in the text format, loaded in memory."""
+        self.name = filename
+        self._dictionary = {}
+        with open(filename, "r") as f:
+            for next_line in f:
+                next_line = next_line.strip()
+                if next_line:
+                    term, file_pos = next_line.split(" : ")
+                    self._dictionary[term] = int(file_pos)
+
+    def lookup(self, term: str):
+        """Searches the dictionary for a term, the text format has no term statistics
+
+        :rtype: DictionaryEntry
+        """
+        file_pos = self._dictionary.get(term)
+        return DictionaryEntry(file_pos, None, None, None, None, None) if file_pos is not None else None
+
+    def __iter__(self):
+        for term in sorted(self._dictionary):
+            yield term, DictionaryEntry(self._dictionary[term], None, None, None, None, None)
+
+    def __len__(self):
+        return len(self._dictionary)
+
+    def close(self):
+        pass
+
+
+class InvertedIndexException(Exception):
+    pass
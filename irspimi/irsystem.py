@@ -1,33 +1,348 @@
-from reuters import ReutersCorpusStream
+from reuters import ReutersCorpusStream, DEFAULT_READER_BACKEND
 from spimi import SPIMI
 from merge import MergeSPIMI, MultiPassMergeSPIMI
-from typing import List
-from inverted_index import InvertedIndex, InvertedIndexDescriptor, INVERTED_INDEX_DESCRIPTOR_SUFFIX
-from expression_eval import Parser, Evaluator
+from typing import List, Iterable, Tuple, Callable
+from inverted_index import InvertedIndex, InvertedIndexDescriptor, DocLengthTable, InvertedIndexException, \
+    INVERTED_INDEX_DESCRIPTOR_SUFFIX, DEFAULT_POSTINGS_CACHE_SIZE, ImpactOrder, partition_filename, read_segments, \
+    impact_order_parameters
+from segments import SegmentMerger, TieredMergePolicy, reserve_segment, commit_segments, delete_segment, \
+    delete_segments, segment_descriptor, merge_tiers, merge_segments, mergeable_segment_sizes, has_deletes
+from partition import TermRangePartitioner, TokenRunWriter, read_token_run, TOKEN_RUN_SUFFIX
+from expression_eval import Parser, Evaluator, expression_terms, canonical_form
+from query_cache import QueryResultCache
+from nltk import word_tokenize
 from eval_result import EvaluationResult
-from rank_bm25_eval import RankedSearchBM25
+from rank_bm25_eval import RankedSearchBM25, TopKRankedSearchBM25, ImpactOrderedSearchBM25
+from int_codecs import DEFAULT_CODEC
+from collections import namedtuple
+from multiprocessing import Pool
+from multiprocessing.pool import ThreadPool
+from itertools import chain, islice
 import os
+import sys
+import resource
+import time
 import dict_compression
+from dict_compression import CompressionStats
 
 INVERTED_INDEX_FILENAME = "inverted_index.ii"
+BLOCKS_DIRECTORY = "./blocks"
+PARTITION_SAMPLE_SIZE = 100000  # Tokens sampled to choose the term ranges of the partitions
 
+BuildStats = namedtuple("BuildStats", ["index_filename", "block_count", "peak_block_memory", "peak_rss",
+                                       "compression_stats"])
+InvertedBlocks = namedtuple("InvertedBlocks", ["block_filenames", "doclength_map", "peak_block_memory",
+                                               "compression_stats"])
+ParsedRuns = namedtuple("ParsedRuns", ["run_filenames", "doclength_map", "compression_stats"])
+InvertedPartition = namedtuple("InvertedPartition", ["block_count", "peak_block_memory"])
+BatchStats = namedtuple("BatchStats", ["results", "term_count", "seconds"])
 
-def build_index(files: List[str], directory: str = ".", compression: dict_compression.Compression = None):
+
+def build_index(files: List[str], directory: str = ".", compression: dict_compression.Compression = None,
+                codec: str = DEFAULT_CODEC, memory_budget: int = SPIMI.DEFAULT_MEMORY_BUDGET, jobs: int = 1,
+                partitions: int = 1, quantize_doclengths: bool = False, reader: str = DEFAULT_READER_BACKEND,
+                out_filename: str = INVERTED_INDEX_FILENAME, impact_bm25: Tuple[float, float] = None,
+                positions: bool = True):
     """ Build the inverted index and merges it.
 
-    Builds using SPIMI and merges using an external multipass k-way merge
+    Builds using SPIMI and merges using an external multipass k-way merge.
+    With more than one job, the corpus files are inverted in parallel by a pool of processes. Each file gets its own
+    SPIMI blocks which are merged in the order of the files, this gives the same index as the serial build.
+    With more than one partition, the index is built term partitioned instead, see _build_partitioned_index.
+    Building the index in place replaces the segments added to the previous index by add_documents.
+    With impact_bm25, the merge also writes the postings of each term ordered by their quantized BM25 weight for these
+    k1 and b, for ImpactOrderedSearchBM25. The documents added to the index later have no such postings.
+    Without positions, the postings hold only the docids and term frequencies, for the deployments which never read
+    the positions of the terms.
 
     :param files: Ordered files of the Reuters Corpus
     :param directory: Directory to output the index
     :param compression: Dictionary Compression technique
+    :param codec: Name of the integer codec for the postings
+    :param memory_budget: Memory in bytes of a SPIMI block before it is flushed to disk
+    :param jobs: Number of processes inverting the corpus files
+    :param partitions: Number of term range partitions of the index
+    :param quantize_doclengths: Set to true to store the document lengths on one byte
+    :param reader: Reader backend of the corpus files
+    :param out_filename: Filename of the index in directory
+    :param impact_bm25: BM25 parameters (k1, b) of the impact ordered postings, None to not write them
+    :param positions: Set to false to not store the positions of the terms in the postings
     :type files: List[str]
     :type directory: str
     :type compression: Compression
-    :return: Filename of the index on disk
-    :rtype: str
+    :type codec: str
+    :type memory_budget: int
+    :type jobs: int
+    :type partitions: int
+    :type quantize_doclengths: bool
+    :type reader: str
+    :type out_filename: str
+    :type impact_bm25: Tuple[float, float]
+    :type positions: bool
+    :return: Filename of the index on disk and the memory used by the build
+    :rtype: BuildStats
+    """
+    if partitions > 1:
+        build_stats = _build_partitioned_index(files, directory, compression, codec, memory_budget, jobs, partitions,
+                                               quantize_doclengths, reader, out_filename, impact_bm25, positions)
+        delete_segments(build_stats.index_filename)
+        return build_stats
+
+    # Each file is inverted on its own so the blocks, and the merged index, do not depend on the number of jobs
+    tasks = [([filename], compression, codec, memory_budget, "{}/file{}".format(BLOCKS_DIRECTORY, i), reader,
+              positions) for i, filename in enumerate(files)]
+    if jobs > 1:
+        with Pool(jobs) as pool:
+            inverted_files = pool.starmap(_invert_files, tasks, chunksize=1)
+    else:
+        inverted_files = [_invert_files(*task) for task in tasks]
+
+    blocks_filenames = []
+    doclength_map = {}
+    for inverted in inverted_files:
+        blocks_filenames.extend(inverted.block_filenames)
+        doclength_map.update(inverted.doclength_map)
+
+    doclength_table = DocLengthTable.from_map(doclength_map, quantize_doclengths)
+    impact_order = impact_order_parameters(*impact_bm25, len(doclength_table)) if impact_bm25 else None
+    index_filename = _merge_index(blocks_filenames, directory, multipass=True, codec=codec, out_filename=out_filename,
+                                  doclength_table=doclength_table, impact_order=impact_order)
+
+    descriptor = InvertedIndexDescriptor(doclength_table, compression, codec=codec, impact_order=impact_order,
+                                         positions=positions)
+    descriptor.write_to_file("{}.{}".format(index_filename, INVERTED_INDEX_DESCRIPTOR_SUFFIX))
+    delete_segments(index_filename)
+    return BuildStats(index_filename, len(blocks_filenames),
+                      max(inverted.peak_block_memory for inverted in inverted_files), _peak_rss(),
+                      _sum_compression_stats(inverted.compression_stats for inverted in inverted_files))
+
+
+def add_documents(files: List[str], directory: str = ".", memory_budget: int = SPIMI.DEFAULT_MEMORY_BUDGET,
+                  jobs: int = 1, reader: str = DEFAULT_READER_BACKEND, background_merge: bool = True,
+                  merge_policy: TieredMergePolicy = None, replace: bool = False):
+    """Adds the documents of the files to the index in a new segment.
+
+    Only the new documents are parsed, inverted and merged, with the compression, codec and document lengths format
+    of the index. The segment is searched with the other live segments as soon as it is committed. The small segments
+    are then merged in the background by a SegmentMerger thread.
+    Documents already in the index are rejected, unless replace is set: their older version is then deleted.
+    The postings of the new documents hold positions only if the index does.
+
+    :param files: Ordered files of the new documents
+    :param directory: Directory of the index
+    :param memory_budget: Memory in bytes of a SPIMI block before it is flushed to disk
+    :param jobs: Number of processes inverting the files
+    :param reader: Reader backend of the files
+    :param background_merge: Set to false to not merge the segments after adding the new one
+    :param merge_policy: Merge policy of the background merge, DEFAULT TieredMergePolicy()
+    :param replace: Set to true to replace the documents already in the index
+    :type files: List[str]
+    :type directory: str
+    :type memory_budget: int
+    :type jobs: int
+    :type reader: str
+    :type background_merge: bool
+    :type merge_policy: TieredMergePolicy
+    :type replace: bool
+    :return: Build stats of the new segment and the started merger, None without background merge
+    :rtype: Tuple[BuildStats, SegmentMerger]
+    """
+    index_filename = "{}/{}".format(directory, INVERTED_INDEX_FILENAME)
+    live_segments = read_segments(index_filename).segments
+    if not live_segments:
+        raise InvertedIndexException("No index to add documents to in {}".format(directory))
+    descriptor = segment_descriptor(index_filename, live_segments[0])
+
+    segment = reserve_segment(index_filename)
+    build_stats = build_index(files, directory, descriptor.compression, descriptor.codec, memory_budget, jobs,
+                              quantize_doclengths=descriptor.doclength_table.quantized, reader=reader,
+                              out_filename=segment, positions=descriptor.positions)
+    new_docids = set(segment_descriptor(index_filename, segment).doclength_table.docids)
+    replaced_docids = []
+    for live_segment in live_segments:
+        live_docids = segment_descriptor(index_filename, live_segment).doclength_table.docids
+        segment_docids = new_docids.intersection(live_docids)
+        if segment_docids and not replace:
+            delete_segment(index_filename, segment)
+            raise InvertedIndexException("Documents of {} are already in the segment {}".format(files, live_segment))
+        replaced_docids.extend(segment_docids)
+    if replaced_docids:
+        # The older versions are deleted before the new segment is live, a search never sees both versions
+        index = InvertedIndex(index_filename)
+        try:
+            index.delete_documents(replaced_docids)
+        finally:
+            index.close()
+    commit_segments(index_filename, [segment], [])
+
+    merger = None
+    if background_merge:
+        merger = SegmentMerger(index_filename, merge_policy)
+        merger.start()
+    return build_stats, merger
+
+
+def update_documents(files: List[str], directory: str = ".", memory_budget: int = SPIMI.DEFAULT_MEMORY_BUDGET,
+                     jobs: int = 1, reader: str = DEFAULT_READER_BACKEND, background_merge: bool = True,
+                     merge_policy: TieredMergePolicy = None):
+    """Adds the documents of the files to the index, replacing the documents already in it. See add_documents
+
+    :rtype: Tuple[BuildStats, SegmentMerger]
+    """
+    return add_documents(files, directory, memory_budget, jobs, reader, background_merge, merge_policy, replace=True)
+
+
+def delete_documents(directory: str, docids: Iterable[int]):
+    """Deletes documents from the index, their postings are purged when their segment is merged
+
+    :param directory: Directory of the index
+    :param docids: Documents to delete
+    :return: Number of documents deleted
+    :rtype: int
+    """
+    index = load_index(directory)
+    try:
+        return index.delete_documents(docids)
+    finally:
+        index.close()
+
+
+def compact_index(directory: str = ".", merge_all: bool = False, merge_policy: TieredMergePolicy = None):
+    """Merges the segments of an index in the foreground
+
+    :param directory: Directory of the index
+    :param merge_all: Set to true to merge all the mergeable segments into one instead of following the policy, a
+        single segment is merged to purge its deleted documents
+    :param merge_policy: Merge policy, DEFAULT TieredMergePolicy()
+    :return: Number of merges
+    :rtype: int
+    """
+    index_filename = "{}/{}".format(directory, INVERTED_INDEX_FILENAME)
+    if merge_all:
+        segments = list(mergeable_segment_sizes(index_filename, read_segments(index_filename)))
+        if len(segments) > 1 or (segments and has_deletes(index_filename, segments[0])):
+            return 1 if merge_segments(index_filename, segments) else 0
+        return 0
+    return merge_tiers(index_filename, merge_policy)
+
+
+def _invert_files(files: List[str], compression: dict_compression.Compression, codec: str, memory_budget: int,
+                  blocks_directory: str, reader: str = DEFAULT_READER_BACKEND, positions: bool = True):
+    """Inverts the given corpus files into SPIMI blocks.
+
+    :param files: Ordered files of the Reuters Corpus
+    :param compression: Dictionary Compression technique
+    :param codec: Name of the integer codec for the postings
+    :param memory_budget: Memory in bytes of a SPIMI block before it is flushed to disk
+    :param blocks_directory: Directory to write the blocks
+    :param reader: Reader backend of the corpus files
+    :param positions: Set to false to not store the positions of the terms in the blocks
+    :return: Blocks filename and the documents found in the files
+    :rtype: InvertedBlocks
+    """
+    corpus = ReutersCorpusStream(list(files), compression, reader)
+    spimi_inverter = SPIMI(token_stream=corpus, memory_budget=memory_budget, dir=blocks_directory, codec=codec,
+                           positions=positions)
+
+    blocks_filenames = []
+    while True:
+        d = spimi_inverter.invert()
+        if d:
+            blocks_filenames.append(d)
+        else:
+            break
+    return InvertedBlocks(blocks_filenames, corpus.doclength_map, spimi_inverter.peak_block_memory,
+                          corpus.compression_stats())
+
+
+def _build_partitioned_index(files: List[str], directory: str, compression: dict_compression.Compression,
+                             codec: str, memory_budget: int, jobs: int, partitions: int, quantize_doclengths: bool,
+                             reader: str, out_filename: str, impact_bm25: Tuple[float, float] = None,
+                             positions: bool = True):
+    """Builds a term partitioned index, each partition is inverted and merged independently.
+
+    The term ranges of the partitions are chosen from a sample of the first corpus file. Parser processes tokenize
+    each corpus file and route its tokens to a token run per partition. Inverter processes then build the postings of
+    one partition from its token runs, in the order of the files, and merge its blocks into the partition index.
+
+    :return: Base filename of the index partitions and the memory used by the build
+    :rtype: BuildStats
     """
-    corpus = ReutersCorpusStream(files, compression)
-    spimi_inverter = SPIMI(token_stream=corpus, dir="./blocks/")
+    sample = [token.token for token in islice(ReutersCorpusStream(files[:1], compression, reader),
+                                                   PARTITION_SAMPLE_SIZE)]
+    partitioner = TermRangePartitioner.from_sample(sample, partitions)
+    runs_directory = "{}/runs".format(BLOCKS_DIRECTORY)
+    if not os.path.exists(runs_directory):
+        os.makedirs(runs_directory)
+
+    with Pool(jobs) as pool:
+        parse_tasks = [(filename, i, compression, partitioner, runs_directory, reader)
+                       for i, filename in enumerate(files)]
+        parsed_files = pool.starmap(_parse_to_runs, parse_tasks, chunksize=1)
+        doclength_map = {}
+        for parsed in parsed_files:
+            doclength_map.update(parsed.doclength_map)
+        doclength_table = DocLengthTable.from_map(doclength_map, quantize_doclengths)
+        impact_order = impact_order_parameters(*impact_bm25, len(doclength_table)) if impact_bm25 else None
+        invert_tasks = [([parsed.run_filenames[p] for parsed in parsed_files], directory,
+                         partition_filename(out_filename, p), codec, memory_budget,
+                         "{}/part{}".format(BLOCKS_DIRECTORY, p), doclength_table, impact_order, positions)
+                        for p in range(0, len(partitioner))]
+        inverted_partitions = pool.starmap(_invert_partition, invert_tasks, chunksize=1)
+
+    descriptor = InvertedIndexDescriptor(doclength_table, compression, codec=codec,
+                                         partitions=partitioner.first_terms(), impact_order=impact_order,
+                                         positions=positions)
+    descriptor.write_to_file("{}/{}.{}".format(directory, out_filename, INVERTED_INDEX_DESCRIPTOR_SUFFIX))
+    return BuildStats("{}/{}".format(directory, out_filename),
+                      sum(inverted.block_count for inverted in inverted_partitions),
+                      max(inverted.peak_block_memory for inverted in inverted_partitions), _peak_rss(),
+                      _sum_compression_stats(parsed.compression_stats for parsed in parsed_files))
+
+
+def _parse_to_runs(filename: str, file_index: int, compression: dict_compression.Compression,
+                   partitioner: TermRangePartitioner, runs_directory: str, reader: str = DEFAULT_READER_BACKEND):
+    """Tokenizes a corpus file and routes its tokens to the token run of their partition.
+
+    :param filename: Corpus file to parse
+    :param file_index: Index of the file in the ordered corpus files
+    :param compression: Dictionary Compression technique
+    :param partitioner: Term ranges of the partitions
+    :param runs_directory: Directory to write the token runs
+    :param reader: Reader backend of the corpus file
+    :return: Token run filename for each partition and the documents found in the file
+    :rtype: ParsedRuns
+    """
+    corpus = ReutersCorpusStream([filename], compression, reader)
+    writers = [TokenRunWriter("{}/file{}.part{}.{}".format(runs_directory, file_index, p, TOKEN_RUN_SUFFIX))
+               for p in range(0, len(partitioner))]
+    for token in corpus:
+        writers[partitioner.partition(token.token)].write(token)
+    for writer in writers:
+        writer.close()
+    return ParsedRuns([writer.name for writer in writers], corpus.doclength_map, corpus.compression_stats())
+
+
+def _invert_partition(run_filenames: List[str], directory: str, out_filename: str, codec: str, memory_budget: int,
+                      blocks_directory: str, doclength_table: DocLengthTable = None, impact_order: ImpactOrder = None,
+                      positions: bool = True):
+    """Inverts and merges the token runs of a partition into its index file.
+
+    :param run_filenames: Token runs of the partition in the order of the corpus files
+    :param directory: Directory to output the partition index
+    :param out_filename: Filename of the partition index
+    :param codec: Name of the integer codec for the postings
+    :param memory_budget: Memory in bytes of a SPIMI block before it is flushed to disk
+    :param blocks_directory: Directory to write the blocks
+    :param doclength_table: Document lengths of the collection for the impacts of the partition
+    :param impact_order: Parameters of the impact ordered postings of the partition, None to not write them
+    :param positions: Set to false to not store the positions of the terms in the partition
+    :return: Blocks and memory used to invert the partition
+    :rtype: InvertedPartition
+    """
+    tokens = chain.from_iterable(read_token_run(filename) for filename in run_filenames)
+    spimi_inverter = SPIMI(token_stream=tokens, memory_budget=memory_budget, dir=blocks_directory, codec=codec,
+                           positions=positions)
 
     blocks_filenames = []
     while True:
@@ -36,57 +351,206 @@ def build_index(files: List[str], directory: str = ".", compression: dict_compre
             blocks_filenames.append(d)
         else:
             break
+    _merge_index(blocks_filenames, directory, multipass=True, codec=codec, out_filename=out_filename,
+                 doclength_table=doclength_table, impact_order=impact_order)
+    return InvertedPartition(len(blocks_filenames), spimi_inverter.peak_block_memory)
 
-    index_filename = _merge_index(blocks_filenames, directory, multipass=True)
 
-    descriptor = InvertedIndexDescriptor(corpus.docid_list, corpus.doclength_map, compression)
-    descriptor.write_to_file("{}/{}.{}".format(directory, INVERTED_INDEX_FILENAME, INVERTED_INDEX_DESCRIPTOR_SUFFIX))
-    return index_filename
+def _sum_compression_stats(stats_list: Iterable[CompressionStats]):
+    return CompressionStats(*(sum(counters) for counters in zip(CompressionStats(0, 0, 0), *stats_list)))
 
 
-def _merge_index(filenames: list, directory: str = ".", multipass: bool = True):
+def _peak_rss():
+    """Peak resident set size in bytes of the process or of its largest worker process"""
+    peak_rss = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+                   resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+    # Linux reports the peak in kilobytes and macOS in bytes
+    return peak_rss if sys.platform == "darwin" else peak_rss * 1024
+
+
+def _merge_index(filenames: list, directory: str = ".", multipass: bool = True, codec: str = DEFAULT_CODEC,
+                 out_filename: str = INVERTED_INDEX_FILENAME, doclength_table: DocLengthTable = None,
+                 impact_order: ImpactOrder = None):
     """Merge the given list of blocks.
 
     :param filenames: List of block filename
     :param directory: directory to output the inverted index file
     :param multipass: Set to true for the multi pass k-way merge algorithm
+    :param codec: Name of the integer codec for the postings
+    :param out_filename: Filename of the inverted index in directory
+    :param doclength_table: Document lengths of the collection for the impacts of the index
+    :param impact_order: Parameters of the impact ordered postings, None to not write them
     :return: path to the inverted index on disk
     :rtype:str
     """
     if not os.path.exists(directory):
         os.makedirs(directory)
-    out_path = "{}/{}".format(directory, INVERTED_INDEX_FILENAME)
-    if multipass:
-        ms = MultiPassMergeSPIMI(filenames, out_path, input_buffer_length=10000, input_buffer_count=4)
+    out_path = "{}/{}".format(directory, out_filename)
+    # The multipass merge writes nothing without blocks, the single pass merge creates an empty index
+    if multipass and filenames:
+        ms = MultiPassMergeSPIMI(filenames, out_path, codec=codec, doclength_table=doclength_table,
+                                 impact_order=impact_order)
     else:
-        ms = MergeSPIMI(filenames, out_path, input_buffer_length=100)
+        ms = MergeSPIMI(filenames, out_path, codec=codec, doclength_table=doclength_table, impact_order=impact_order)
     ms.external_merge()
 
     return out_path
 
 
-def search_expr(index: InvertedIndex, expr: str):
-    """Search for an expression in the Inverted Index"""
-    parser = Parser(expr)
-    evaluator = Evaluator(parser, index)
+def search_expr(index: InvertedIndex, expr: str, limit: int = None, cache: QueryResultCache = None):
+    """Search for an expression in the Inverted Index
+
+    With a cache, the expressions with the same canonical form after the normalization of their terms share their
+    results, see canonical_form. The terms of the expression in each result are looked up again in their postings, so
+    the results are the ones of an evaluation of the expression. The positions of cached results are the ones of a new
+    evaluation of the expression, done when they are first asked for with EvaluationResult.get_positions.
+
+    :param index: Inverted index to use for the search
+    :param expr: Boolean expression
+    :param limit: Number of results, the first ones in docid order are enumerated from postings cursors and the
+        evaluation stops after them. DEFAULT None, all the results
+    :param cache: Cache of the results of the queries of the index, None to always evaluate the expression
+    :return: Evaluated Results
+    :rtype: EvaluationResult
+    """
+    parser = None
+    if cache is not None:
+        query = cache.canonical_key(("expr", expr, limit))
+        if query is None:
+            parser = Parser(expr)
+            tree = parser.parse()
+            query = cache.put_canonical_key(("expr", expr, limit),
+                                            ("expr", canonical_form(tree, index.normalize), limit),
+                                            tuple(expression_terms(tree)))
+        res = cache.get(query.key, index.generation)
+        if res is not None:
+            return _with_terms(index, res, query.terms, lambda: Evaluator(Parser(expr), index, limit=limit).evaluate())
+    evaluator = Evaluator(parser or Parser(expr), index, limit=limit)
     res = evaluator.evaluate()
+    if cache is not None:
+        cache.put(query.key, index.generation, res)
     return res
 
 
-def search_ranked(index: InvertedIndex, query: str, k1: float = 1.2, b: float = 0.5):
+def search_ranked(index: InvertedIndex, query: str, k1: float = 1.2, b: float = 0.5, limit: int = None,
+                  impact_ordered: bool = False, postings_budget: int = None, cache: QueryResultCache = None,
+                  max_score: bool = False):
     """Ranked search for a query (bag of word) in the Inverted Index.
 
+    With a cache, the queries with the same normalized terms in the same order share their results for the same BM25
+    parameters and limit. The order of the terms is kept since the documents with the same score are ranked by their
+    first query term. The terms of the query in each result are looked up again in their postings, as for search_expr.
+
     :param index: Inverted index to use for the search
     :param query: Bag of words query (No operators)
+    :param limit: Number of results, the best documents are selected from the vectorized scores. DEFAULT None, all
+        the documents with a query term are ranked
+    :param impact_ordered: Set to true to find the best limit documents score at a time in the impact ordered
+        postings, see ImpactOrderedSearchBM25
+    :param postings_budget: Maximum number of impact ordered postings to score, None to score them until the best
+        documents are found
+    :param cache: Cache of the results of the queries of the index, None to always evaluate the query
+    :param max_score: Set to true to find the best limit documents document at a time with the MaxScore pruning on
+        the block impacts of the index, see TopKRankedSearchBM25
     :return: Ranked Evaluated Results
     :rtype: EvaluationResult
     """
-    evaluator = RankedSearchBM25(query, index, k1, b)
+    if cache is not None:
+        query_key = ("ranked", query, k1, b, limit or None, bool(impact_ordered and limit), postings_budget,
+                     bool(max_score and limit))
+        cached_query = cache.canonical_key(query_key)
+        if cached_query is None:
+            tokens = tuple(word_tokenize(query))
+            terms = tuple(term for term in map(index.normalize, tokens) if term is not None)
+            cached_query = cache.put_canonical_key(query_key, ("ranked", terms) + query_key[2:], tokens)
+        result = cache.get(cached_query.key, index.generation)
+        if result is not None:
+            return _with_terms(index, result, cached_query.terms)
+    if impact_ordered and limit:
+        evaluator = ImpactOrderedSearchBM25(query, index, k1, b, limit, postings_budget)
+    elif max_score and limit:
+        evaluator = TopKRankedSearchBM25(query, index, k1, b, limit)
+    else:
+        evaluator = RankedSearchBM25(query, index, k1, b, limit or None)
     result = evaluator.evaluate()
+    if cache is not None:
+        cache.put(cached_query.key, index.generation, result)
     return result
 
 
-def load_index(directory: str):
-    """Load an inverted index object"""
-    index = InvertedIndex("{}/{}".format(directory, INVERTED_INDEX_FILENAME))
+def _with_terms(index: InvertedIndex, result: EvaluationResult, terms: Tuple[str, ...],
+                reevaluate: Callable[[], EvaluationResult] = None):
+    """Copy of cached results with the terms of a query, see EvaluationResult.with_terms"""
+    term_postings = []
+    for term in terms:
+        postings = index.get_postings(term)
+        term_postings.append((term, postings.postings if postings is not None else []))
+    return result.with_terms(term_postings, reevaluate)
+
+
+def load_index(directory: str, cache_size: int = DEFAULT_POSTINGS_CACHE_SIZE):
+    """Load an inverted index object
+
+    :param directory: Directory of the index
+    :param cache_size: Size in bytes of the postings cache of the index, 0 to disable it
+    """
+    index = InvertedIndex("{}/{}".format(directory, INVERTED_INDEX_FILENAME), cache_size)
     return index
+
+
+def search_many(index: InvertedIndex, queries: List[str], ranked: bool = False, k1: float = 1.2, b: float = 0.75,
+                limit: int = None, impact_ordered: bool = False, postings_budget: int = None, jobs: int = 1,
+                max_score: bool = False):
+    """Searches a batch of queries, boolean expressions or ranked queries.
+
+    All the queries are parsed first, the postings of their distinct terms are then read once, in the order of their
+    position in the postings files, see InvertedIndex.get_postings_many. The queries are evaluated on these postings,
+    with more than one job by a pool of threads which share them.
+
+    :param index: Inverted index to use for the search
+    :param queries: Boolean expressions, or bag of words queries when ranked
+    :param ranked: Set to true for ranked queries, see search_ranked
+    :param k1: BM25 parameter of the ranked queries
+    :param b: BM25 parameter of the ranked queries
+    :param limit: Number of results of each query, see search_expr and search_ranked. DEFAULT None, all the results
+    :param impact_ordered: Set to true to rank the queries score at a time, see search_ranked
+    :param postings_budget: Maximum number of impact ordered postings scored by a query, see search_ranked
+    :param jobs: Number of threads evaluating the queries
+    :param max_score: Set to true to rank the queries document at a time with MaxScore, see search_ranked
+    :return: Results of each query in the order of the queries, the number of distinct terms read and the time taken
+    :rtype: BatchStats
+    """
+    start = time.perf_counter()
+    # The evaluators share the postings map, filled once all the queries are parsed
+    postings = {}
+    if ranked:
+        evaluators = [_ranked_evaluator(query, index, k1, b, limit, impact_ordered, postings_budget, max_score,
+                                        postings) for query in queries]
+        terms = set(chain.from_iterable(evaluator.query for evaluator in evaluators))
+    else:
+        parsers = [Parser(query) for query in queries]
+        terms = set(chain.from_iterable(expression_terms(parser.parse()) for parser in parsers))
+        evaluators = [Evaluator(parser, index, limit=limit, postings=postings) for parser in parsers]
+    postings.update(index.get_postings_many(terms))
+
+    if jobs > 1:
+        with ThreadPool(jobs) as pool:
+            results = pool.map(_evaluate, evaluators)
+    else:
+        results = [evaluator.evaluate() for evaluator in evaluators]
+    term_count = len({term_postings.term for term_postings in postings.values() if term_postings is not None})
+    return BatchStats(results, term_count, time.perf_counter() - start)
+
+
+def _ranked_evaluator(query: str, index: InvertedIndex, k1: float, b: float, limit: int, impact_ordered: bool,
+                      postings_budget: int, max_score: bool, postings: dict):
+    """Evaluator of a ranked query of a batch, see search_ranked"""
+    if impact_ordered and limit:
+        return ImpactOrderedSearchBM25(query, index, k1, b, limit, postings_budget, postings)
+    elif max_score and limit:
+        return TopKRankedSearchBM25(query, index, k1, b, limit, postings)
+    return RankedSearchBM25(query, index, k1, b, limit or None, postings)
+
+
+def _evaluate(evaluator):
+    return evaluator.evaluate()
@@ -1,26 +1,56 @@
-from typing import TextIO, List
+from typing import List, Set, Optional
 from heapq import heappush, heappop
-from inverted_index import DICTIONARY_FILE_SUFFIX, extern_input, extern_output, TermPostings, Posting
-from collections import deque
+from inverted_index import DICTIONARY_FILE_SUFFIX, PostingsFileReader, PostingsFileWriter, DictionaryFileWriter, \
+    InvertedIndexException, BITMAPS_FILE_SUFFIX, BitmapFileWriter, IMPACTS_FILE_SUFFIX, ImpactsFileWriter, \
+    DocLengthTable, concat_encoded_postings, merge_encoded_postings, encode_postings, decode_postings, decode_docids, \
+    decode_tfs, read_chunk_headers, bitmap_from_docids, block_impacts, IMPACT_ORDER_FILE_SUFFIX, IMPACT_LEVELS, \
+    ImpactOrder, ImpactOrderFileWriter
+from int_codecs import DEFAULT_CODEC, decode_uint, get_codec
+from math import log2
+import resource
+
+INPUT_BUFFER_SIZE = 256 * 1024  # 256 KB
+OUTPUT_BUFFER_SIZE = 4 * 1024 * 1024  # 4 MB
+RESERVED_FILE_HANDLES = 32  # Handles kept for the output files, the standard streams and the worker processes
+MAX_FAN_IN = 1024
+
+
+def max_fan_in():
+    """Maximum number of blocks merged in one pass, bounded by the open file handles limit of the process.
+
+    :return: Maximum fan-in of a merge pass
+    :rtype: int
+    """
+    soft_limit, hard_limit = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft_limit == resource.RLIM_INFINITY:
+        return MAX_FAN_IN
+    return max(2, min(MAX_FAN_IN, soft_limit - RESERVED_FILE_HANDLES))
 
 
 class MultiPassMergeSPIMI:
-    def __init__(self, in_filenames: List[str], out_filename: str, output_buffer_length: int = 50,
-                 input_buffer_length: int = 500, input_buffer_count: int = 4):
+    def __init__(self, in_filenames: List[str], out_filename: str, input_buffer_size: int = INPUT_BUFFER_SIZE,
+                 output_buffer_size: int = OUTPUT_BUFFER_SIZE, fan_in: int = None, codec: str = DEFAULT_CODEC,
+                 doclength_table: DocLengthTable = None, impact_order: ImpactOrder = None):
         """Initializes a merger object for the SPIMI algorithm.
         This object uses an external multi-pass k-way merge to complete the work.
 
         :param in_filenames: List of index blocks filename to merge
         :param out_filename: Name of the output file for the merged index
-        :param output_buffer_length: Length of the output buffer, for each term and posting list
-        :param input_buffer_length: Length of each input buffer for each block
-        :param input_buffer_count: Number of input buffers
+        :param input_buffer_size: Size in bytes of the read buffer of each block
+        :param output_buffer_size: Size in bytes of the write buffer of the merged index
+        :param fan_in: Number of blocks merged by each merge, DEFAULT as many as the file handles allow
+        :param codec: Name of the integer codec of the blocks and of the merged index
+        :param doclength_table: Document lengths of the collection for the impacts of the merged index
+        :param impact_order: Parameters of the impact ordered postings of the merged index, None to not write them
         """
+        self._codec = codec
+        self._doclength_table = doclength_table
+        self._impact_order = impact_order
         self._in_filenames = in_filenames
         self._out_filename = out_filename
-        self._output_buffer_length = output_buffer_length
-        self._input_buffer_length = input_buffer_length
-        self._input_buffer_count = input_buffer_count
+        self._input_buffer_size = input_buffer_size
+        self._output_buffer_size = output_buffer_size
+        self._fan_in = fan_in if fan_in else max_fan_in()
         self._next_pass_filenames = []
 
     def external_merge(self):
@@ -31,7 +61,7 @@ class MultiPassMergeSPIMI:
         """
         pass_i = 0
         while True:
-            last_merge = len(self._in_filenames) <= self._input_buffer_count
+            last_merge = len(self._in_filenames) <= self._fan_in
             self._merge_pass(pass_i, last_merge)
             if len(self._next_pass_filenames) > 1:
                 self._in_filenames = self._next_pass_filenames
@@ -49,36 +79,57 @@ class MultiPassMergeSPIMI:
         :return: None
         """
         next_out_i = 0
-        for next_files in [self._in_filenames[i: i + self._input_buffer_count] for i in
-                           range(0, len(self._in_filenames), self._input_buffer_count)]:
+        for next_files in [self._in_filenames[i: i + self._fan_in] for i in
+                           range(0, len(self._in_filenames), self._fan_in)]:
             next_out_filename = self._out_filename if last_merge else "{}.{}{}-pass{}".format(self._out_filename,
                                                                                               "partial", next_out_i,
                                                                                               pass_i)
             next_out_i += 1
-            mergespimi = MergeSPIMI(next_files, next_out_filename, self._output_buffer_length,
-                                    self._input_buffer_length, not last_merge)
+            mergespimi = MergeSPIMI(next_files, next_out_filename, self._input_buffer_size,
+                                    self._output_buffer_size, not last_merge, self._codec,
+                                    doclength_table=self._doclength_table,
+                                    impact_order=self._impact_order)
             self._next_pass_filenames.append(mergespimi.external_merge())
 
 
 class MergeSPIMI:
-    def __init__(self, in_filenames: List[str], out_filename: str, output_buffer_length: int = 50,
-                 input_buffer_length: int = 50, no_external_dictionary: bool = False):
+    def __init__(self, in_filenames: List[str], out_filename: str, input_buffer_size: int = INPUT_BUFFER_SIZE,
+                 output_buffer_size: int = OUTPUT_BUFFER_SIZE, no_external_dictionary: bool = False,
+                 codec: str = DEFAULT_CODEC, deleted_docids: List[Optional[Set[int]]] = None,
+                 doclength_table: DocLengthTable = None, impact_order: ImpactOrder = None):
         """Initializes a merger object for the SPIMI algorithm.
         This object uses an external k-way merge to complete the work.
 
-        :param in_filenames: List of index blocks filename to merge
+        SPIMI consumes the documents in docid order, so the postings of a term in a block all come before its postings
+        in the next blocks. The postings are therefore merged by concatenating their encoded bytes, without decoding
+        them. The blocks must be given in the order they were created.
+        Segments of an incremental index are merged the same way in docid order, the postings of segments with
+        interleaved docids are decoded and merged, and their deleted documents are purged.
+        The final merge also writes the statistics of each term in the dictionary, the impacts of each block of postings
+        which bound the scores of its documents, and the postings of the frequent terms as bitmaps. With impact_order,
+        it writes the postings of each term ordered by impact as well, for score at a time ranking.
+
+        :param in_filenames: List of index blocks filename to merge, in block order
         :param out_filename: Name of the output file for the merged index
-        :param output_buffer_length: Length of the output buffer, for each term and posting list
-        :param input_buffer_length: Length of each input buffer for each block
+        :param input_buffer_size: Size in bytes of the read buffer of each block
+        :param output_buffer_size: Size in bytes of the write buffer of the merged index
+        :param no_external_dictionary: Set to true to not write the dictionary, for partial merges
+        :param codec: Name of the integer codec of the blocks and of the merged index
+        :param deleted_docids: Documents to purge from the postings of each block, None for a block without deletes
+        :param doclength_table: Document lengths of the merged documents for the impacts, without it the impacts
+            bound the scores as if the documents were empty
+        :param impact_order: Parameters of the impact ordered postings, None to not write them. The impacts are the
+            weights of the terms in the documents of doclength_table, which must be given with it
         """
         self._no_external_dictionary = no_external_dictionary
-        self._input_buffer_length = input_buffer_length
-        self._output_buffer_length = output_buffer_length
-        self._output_buffer = deque(maxlen=output_buffer_length)
+        self._doclength_table = doclength_table
+        self._impact_order = impact_order
+        self._codec = get_codec(codec)
+        self._deleted_docids = deleted_docids if deleted_docids else [None] * len(in_filenames)
         self._files = []
         for file_name in in_filenames:
             try:
-                f = open(file_name, "r")
+                f = PostingsFileReader(file_name, codec, input_buffer_size)
                 self._files.append(f)
             except IOError as e:
                 print("Unable to open input file {}".format(file_name))
@@ -86,19 +137,27 @@ class MergeSPIMI:
 
         try:
             cur_file = out_filename
-            self._out = open(cur_file, "w")
+            self._out = PostingsFileWriter(cur_file, codec, output_buffer_size)
             if not self._no_external_dictionary:
                 cur_file = "{}.{}".format(out_filename, DICTIONARY_FILE_SUFFIX)
-                self._out_dict = open(cur_file, "w")
+                self._out_dict = DictionaryFileWriter(cur_file)
+                cur_file = "{}.{}".format(out_filename, BITMAPS_FILE_SUFFIX)
+                self._out_bitmaps = BitmapFileWriter(cur_file)
+                cur_file = "{}.{}".format(out_filename, IMPACTS_FILE_SUFFIX)
+                self._out_impacts = ImpactsFileWriter(cur_file)
+                self._out_impact_order = None
+                if self._impact_order:
+                    cur_file = "{}.{}".format(out_filename, IMPACT_ORDER_FILE_SUFFIX)
+                    self._out_impact_order = ImpactOrderFileWriter(cur_file, self._codec)
         except IOError as e:
             print("Unable to open output file {} to write.".format(cur_file))
             print(e)
 
-        # Build the input buffer and heap
+        # Build the heap with the next record of each block
         self._next_terms_heap = []
-        self._input_buffer = [None] * len(self._files)
+        self._next_records = [None] * len(self._files)
         for i in range(0, len(self._files)):
-            self._refill_buffer(i)
+            self._read_next_record(i)
 
     def external_merge(self):
         """Execute the merge according to the initialized settings.
@@ -107,124 +166,113 @@ class MergeSPIMI:
         :rtype: str
         """
         while self._next_terms_heap:
-            self._output_buffer.append(self._get_next_postings())
-            if self._output_buffer_full() or not self._next_terms_heap:
-                self._write_out_buffer()
+            term, postings = self._get_next_postings()
+            if postings is None:
+                continue
+            file_pos = self._out.write_record(term, postings)
+            if not self._no_external_dictionary:
+                # The encoded postings start with their document count, chunk count and last docid
+                doc_freq, pos = decode_uint(postings, 0)
+                docids = decode_docids(postings, self._codec)
+                tfs = decode_tfs(postings, self._codec)
+                impacts_pos = self._write_impacts(postings, docids, tfs)
+                impact_order_pos = self._write_impact_order(docids, tfs) if self._out_impact_order else 0
+                self._out_dict.write(term, file_pos, doc_freq, sum(tfs), max(tfs), impacts_pos, impact_order_pos)
+                if BitmapFileWriter.is_dense(doc_freq, decode_uint(postings, decode_uint(postings, pos)[1])[0]):
+                    self._out_bitmaps.write(term, bitmap_from_docids(docids))
         self._out.close()
         if not self._no_external_dictionary:
             self._out_dict.close()
+            self._out_bitmaps.close()
+            self._out_impacts.close()
+            if self._out_impact_order:
+                self._out_impact_order.close()
+        for f in self._files:
+            f.close()
         return self._out.name
 
-    def _write_out_buffer(self):
-        """Empties and writes the current output buffer to the index file on disk.
+    def _get_next_postings(self):
+        """Retrieves the next merged postings from all blocks in alphabetical Order.
 
-        :return: None
+        :return: Tuple (term, encoded postings merged from all the blocks), None postings if all were deleted
+        :rtype: Tuple[str, bytes]
         """
+        next_term, next_ifile = self._next_terms_heap[0]  # peek next tuple
+        encoded_postings = []
+        # The heap pops the blocks of a term in block order
+        while self._next_terms_heap and self._next_terms_heap[0][0] == next_term:
+            next_term, next_ifile = heappop(self._next_terms_heap)
+            postings = self._next_records[next_ifile][1]
+            if self._deleted_docids[next_ifile]:
+                postings = self._purge_deleted(postings, self._deleted_docids[next_ifile])
+            if postings is not None:
+                encoded_postings.append(postings)
+            self._read_next_record(next_ifile)
+
+        if not encoded_postings:
+            return next_term, None
+        if len(encoded_postings) == 1:
+            return next_term, encoded_postings[0]
+        try:
+            return next_term, concat_encoded_postings(encoded_postings)
+        except InvertedIndexException:
+            return next_term, merge_encoded_postings(encoded_postings, self._codec)
 
-        while self._output_buffer:
-            term_postings = self._output_buffer.popleft()
-            file_pos = self._out.tell()
-            self._out.write(extern_output(term_postings))
-            if not self._no_external_dictionary:
-                self._out_dict.write("{} : {}\n".format(term_postings.term, file_pos))
-
-        self._out.flush()
-        if not self._no_external_dictionary:
-            self._out_dict.flush()
-
-    def _output_buffer_full(self):
-        """Checks if the output buffer is full.
+    def _write_impacts(self, postings: bytes, docids: List[int], tfs: List[int]):
+        """Writes the impacts of the chunks of encoded postings, a chunk is a block of the impacts
 
-        :return: True if the buffer is full, False otherwise
-        :rtype: bool
+        :return: Position of the impacts in the impacts file
+        :rtype: int
         """
-        return len(self._output_buffer) >= self._output_buffer_length
-
-    def _get_next_postings(self):
-        """Retrieves the next merged postings from all input buffers in alphabetical Order.
-
-        This will replenish an input buffer if it is empty.
-
-        :return: Merged postings list for the next term from the input buffers.
-        :rtype: TermPostings
+        # The quantized lengths are rounded down, the impacts stay upper bounds of the scores
+        doclengths = [int(self._doclength_table.get(docid)) for docid in docids] if self._doclength_table \
+            else [0] * len(docids)
+        headers = read_chunk_headers(postings)
+        blocks = []
+        start = 0
+        for header in headers:
+            end = start + header.doc_count
+            blocks.append(block_impacts(tfs[start:end], doclengths[start:end]))
+            start = end
+        return self._out_impacts.write([header.last_docid for header in headers], blocks)
+
+    def _write_impact_order(self, docids: List[int], tfs: List[int]):
+        """Writes the postings of a term ordered by impact, the BM25 weight of RankedSearchBM25 quantized on
+        IMPACT_LEVELS levels
+
+        :return: Position of the postings in the impact ordered postings file
+        :rtype: int
         """
-        postings_merged = []
-        if self._next_terms_heap:
-            next_term, next_ifile = self._next_terms_heap[0]  # peek next tuple
-
-            while self._next_terms_heap and self._next_terms_heap[0][0] == next_term:
-                next_term, next_ifile = heappop(self._next_terms_heap)
-                next_term_postings = self._input_buffer[next_ifile].popleft()
-
-                postings_merged = MergeSPIMI._merge_postings(postings_merged, next_term_postings.postings)
-
-                # Fetch next chunks if the input buffer is now empty
-                if not self._input_buffer[next_ifile]:
-                    self._refill_buffer(next_ifile)
-        return TermPostings(next_term, postings_merged)
+        k1, b, scale = self._impact_order
+        doc_count = len(self._doclength_table)
+        avg_doclength = self._doclength_table.avg_length()
+        idf = log2(doc_count / len(docids))
+        impacts = []
+        for docid, tf in zip(docids, tfs):
+            dl = self._doclength_table.get(docid)
+            weight = idf * ((k1 + 1) * tf) / (k1 * ((1 - b) + b * (dl / avg_doclength)) + tf)
+            impacts.append(min(IMPACT_LEVELS, max(1, round(weight / scale))))
+        return self._out_impact_order.write(docids, impacts)
+
+    def _purge_deleted(self, postings: bytes, deleted_docids: Set[int]):
+        """Removes the deleted documents from encoded postings
+
+        :return: Encoded live postings, None if all the postings were deleted
+        :rtype: bytes
+        """
+        decoded = decode_postings(postings, self._codec)
+        live_postings = [posting for posting in decoded if posting.docid not in deleted_docids]
+        if len(live_postings) == len(decoded):
+            return postings
+        return encode_postings(live_postings, self._codec) if live_postings else None
 
-    def _refill_buffer(self, ifile: int):
-        """ Fills the input buffer for the given file index
+    def _read_next_record(self, ifile: int):
+        """Reads the next record of the given block and pushes its term on the heap
 
-        :param ifile: File and buffer index to refill
+        :param ifile: File index of the block
         :return: None
         """
-        if self._input_buffer[ifile] is None:
-            self._input_buffer[ifile] = deque()
-
-        buffer = self._input_buffer[ifile]
-        file = self._files[ifile]
-        for i in range(0, self._input_buffer_length):
-            next_line = file.readline().strip()
-            if next_line:
-                term_postings = extern_input(next_line)
-                buffer.append(term_postings)
-                heappush(self._next_terms_heap, (term_postings.term, ifile))
-            else:
-                break
-
-    @staticmethod
-    def _merge_postings(l1, l2):
-        """Merge the given lists and return a new merged List.
-        If the input are Posting then the positions will also be merged by the same process.
-
-        :param l1: List to merge
-        :param l2: List to merge
-        :type l1: List[Posting], List[int]
-        :type l2: List[Posting], List[int]
-        :return: New merged list with the elements of l1 and l2
-        :rtype: List[Posting]
-        """
-        l1 = l1 if l1 is not None else []
-        l2 = l2 if l2 is not None else []
-        list.sort(l1)
-        list.sort(l2)
-        merged = []
-        i = 0
-        j = 0
-        while i < len(l1) and j < len(l2):
-            if l1[i] <= l2[j]:
-                next_item = l1[i]
-                i += 1
-            else:
-                next_item = l2[j]
-                j += 1
-
-            if len(merged) == 0 or next_item != merged[len(merged) - 1]:
-                merged.append(next_item)
-            elif isinstance(next_item, Posting) and next_item == merged[len(merged) - 1]:
-                last_posting = merged[len(merged) - 1]
-                last_posting.positions = MergeSPIMI._merge_postings(last_posting.positions, next_item.positions)
-
-        # Empty the remaining list
-        remaining_list, h = (l1, i) if i < len(l1) else (l2, j)
-        while h < len(remaining_list):
-            next_item = remaining_list[h]
-            h += 1
-            if len(merged) == 0 or next_item != merged[len(merged) - 1]:
-                merged.append(next_item)
-            elif isinstance(next_item, Posting) and next_item == merged[len(merged) - 1]:
-                last_posting = merged[len(merged) - 1]
-                last_posting.positions = MergeSPIMI._merge_postings(last_posting.positions, next_item.positions)
-
-        return merged
+        record = self._files[ifile].read_record()
+        self._next_records[ifile] = record
+        if record is not None:
+            heappush(self._next_terms_heap, (record[0], ifile))
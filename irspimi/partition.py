@@ -0,0 +1,85 @@
+## Term partitioned index construction
+## Parsers route the tokens of the corpus to term range partitions in token run files, inverters then build the
+## postings of each partition independently.
+from bisect import bisect_right
+from typing import Iterable, List
+from reuters import DocToken
+from int_codecs import encode_uint, decode_uint
+
+TOKEN_RUN_SUFFIX = "run"
+
+
+class TermRangePartitioner:
+    def __init__(self, split_terms: List[str]):
+        """Assigns terms to partitions of contiguous term ranges.
+
+        Partition i holds the terms t such that split_terms[i - 1] <= t < split_terms[i].
+
+        :param split_terms: Sorted first term of each partition except the first one
+        """
+        self.split_terms = split_terms
+
+    @staticmethod
+    def from_sample(terms: Iterable[str], partition_count: int):
+        """Chooses the split terms from a sample of tokens so each partition gets about the same number of tokens.
+
+        :param terms: Sample of the terms of the token stream, with repetitions
+        :param partition_count: Number of partitions
+        :return: Partitioner for the sample
+        :rtype: TermRangePartitioner
+        """
+        sample = sorted(terms)
+        split_terms = []
+        for i in range(1, partition_count):
+            split_term = sample[len(sample) * i // partition_count] if sample else None
+            if split_term and (not split_terms or split_term > split_terms[-1]):
+                split_terms.append(split_term)
+        return TermRangePartitioner(split_terms)
+
+    def partition(self, term: str):
+        """Partition index of the term"""
+        return bisect_right(self.split_terms, term)
+
+    def first_terms(self):
+        """First term of each partition, the first partition starts at the empty term"""
+        return [""] + self.split_terms
+
+    def __len__(self):
+        return len(self.split_terms) + 1
+
+
+class TokenRunWriter:
+    def __init__(self, filename: str):
+        """Writes the tokens routed to a partition.
+
+        Each token is: term length | term | docid | pos
+
+        :param filename: Name of the token run file
+        """
+        self.name = filename
+        self._file = open(filename, "wb")
+
+    def write(self, token: DocToken):
+        term = token.token.encode("utf-8")
+        self._file.write(b"".join([encode_uint(len(term)), term, encode_uint(token.docid), encode_uint(token.pos)]))
+
+    def close(self):
+        self._file.close()
+
+
+def read_token_run(filename: str):
+    """Reads the tokens of a token run file in the order they were written
+
+    :param filename: Name of the token run file
+    :return: Stream of tokens
+    :rtype: Iterable[DocToken]
+    """
+    with open(filename, "rb") as f:
+        data = f.read()
+    pos = 0
+    while pos < len(data):
+        term_length, pos = decode_uint(data, pos)
+        term = data[pos:pos + term_length].decode("utf-8")
+        docid, pos = decode_uint(data, pos + term_length)
+        token_pos, pos = decode_uint(data, pos)
+        yield DocToken(token=term, docid=docid, pos=token_pos)
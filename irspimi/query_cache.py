@@ -0,0 +1,111 @@
+## Query result cache
+## The results of the repeated queries are kept by the canonical form of the query, so the head of the query traffic
+## is answered without being parsed and evaluated again.
+from collections import namedtuple, OrderedDict
+from typing import Hashable, Tuple
+from eval_result import EvaluationResult
+
+DEFAULT_RESULT_CACHE_SIZE = 1024  # Queries
+
+# Canonical key of the text of a query, with the terms of the query in query order
+QueryKey = namedtuple("QueryKey", ["key", "terms"])
+ResultCacheStats = namedtuple("ResultCacheStats", ["hits", "misses", "evictions", "invalidations", "size",
+                                                   "capacity"])
+
+
+class QueryResultCache:
+    def __init__(self, capacity: int = DEFAULT_RESULT_CACHE_SIZE):
+        """Least recently used cache of the results of the queries of one index, bounded by a number of queries.
+
+        The results are valid for one generation of the index: the generation changes when documents are deleted, the
+        cache is then emptied. The results are cached without their postings nor the terms of their documents, see
+        EvaluationResult.cached: the queries with the same key share them, the terms of each query are looked up again
+        with EvaluationResult.with_terms and a boolean query is only evaluated again if the positions of its results are
+        asked for. The canonical keys and the terms of the queries are also memoized by the text of the queries, so a
+        repeated query is neither parsed nor normalized again.
+
+        :param capacity: Maximum number of cached queries, 0 disables the cache
+        """
+        self.capacity = capacity
+        self._entries = OrderedDict()
+        # Canonical key of the recent query texts, they do not depend on the generation of the index
+        self._keys = OrderedDict()
+        self._generation = None
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+        self._invalidations = 0
+
+    def canonical_key(self, query_key: Hashable):
+        """Canonical key and terms memoized for the text of a query
+
+        :param query_key: Text of the query with its parameters
+        :return: Canonical key of the query with its terms, None if it is not memoized
+        :rtype: QueryKey
+        """
+        key = self._keys.get(query_key)
+        if key is not None:
+            self._keys.move_to_end(query_key)
+        return key
+
+    def put_canonical_key(self, query_key: Hashable, key: Hashable, terms: Tuple[str, ...]):
+        """Memoizes the canonical key and the terms of the text of a query, within the capacity of the cache
+
+        :rtype: QueryKey
+        """
+        query = QueryKey(key, terms)
+        if self.capacity <= 0:
+            return query
+        self._keys[query_key] = query
+        self._keys.move_to_end(query_key)
+        while len(self._keys) > self.capacity:
+            self._keys.popitem(last=False)
+        return query
+
+    def get(self, key: Hashable, generation: int):
+        """Results of a query without their postings nor terms, None if they are not cached for this generation of the
+        index
+
+        :param key: Canonical key of the query
+        :param generation: Generation of the index
+        :rtype: EvaluationResult
+        """
+        self._check_generation(generation)
+        result = self._entries.get(key)
+        if result is None:
+            self._misses += 1
+            return None
+        self._hits += 1
+        self._entries.move_to_end(key)
+        return result
+
+    def put(self, key: Hashable, generation: int, result: EvaluationResult):
+        """Caches a copy of the results of a query, evicting the least recently used queries to stay within the
+        capacity"""
+        if self.capacity <= 0:
+            return
+        self._check_generation(generation)
+        self._entries[key] = result.cached()
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.capacity:
+            self._entries.popitem(last=False)
+            self._evictions += 1
+
+    def _check_generation(self, generation: int):
+        """Empties the cache when the generation of the index changed"""
+        if generation != self._generation:
+            if self._entries:
+                self._entries.clear()
+                self._invalidations += 1
+            self._generation = generation
+
+    def stats(self):
+        """Hits, misses, evictions and invalidations since the cache was created
+
+        :rtype: ResultCacheStats
+        """
+        return ResultCacheStats(self._hits, self._misses, self._evictions, self._invalidations, len(self._entries),
+                                self.capacity)
+
+    def __len__(self):
+        return len(self._entries)
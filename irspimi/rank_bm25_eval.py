@@ -1,14 +1,26 @@
 # Search module for ranked retrieval using the bag of words model and BM25 ranking function.
-from inverted_index import InvertedIndex, TermPostings
+from inverted_index import InvertedIndex, TermPostings, TermImpacts, ChunkedPostings, DocLengthTable
 from nltk import word_tokenize
-from typing import List, Dict
-from math import log2
+from typing import List, Sequence, Tuple, Dict
+from math import log2, inf
+from bisect import bisect_left
+from itertools import groupby
 from eval_result import EvaluationResult
-from operator import itemgetter
+import numpy as np
+import heapq
+import search
+
+# Relative margin of the score upper bounds over the rounding errors of the scores
+BOUND_SLACK = 1e-9
+# Score at a time search scores documents until at most this many times the number of results can be the best ones
+MAX_CANDIDATES_FACTOR = 2
+# Score at a time search scores documents term at a time when it cannot stop within this fraction of the postings
+MAX_SCORED_FRACTION = 0.3
 
 
 class RankedSearchBM25:
-    def __init__(self, query: str, index: InvertedIndex, k1: float = 1.2, b: float = 0.75):
+    def __init__(self, query: str, index: InvertedIndex, k1: float = 1.2, b: float = 0.75, limit: int = None,
+                 postings: Dict[str, TermPostings] = None):
         """Initializes the query processor for Ranked Retrieval using Okapi BM25.
         To use: create the object then call the evaluate method.
 
@@ -20,11 +32,18 @@ class RankedSearchBM25:
         :type k1: float
         :param b: Scaling in of document length, b in [0,1]. 0 -> no length normalization, 1 -> full scaling.
         :type b: float
+        :param limit: Number of results to return, None to rank all the documents of the terms
+        :type limit: int
+        :param postings: Postings of the query terms already read with InvertedIndex.get_postings_many, the other
+            terms are read from the index
+        :type postings: Dict[str, TermPostings]
         """
         self.query = word_tokenize(query)
         self.index = index
         self.k1 = k1
         self.b = b
+        self.limit = limit
+        self._postings = postings if postings is not None else {}
 
     def evaluate(self):
         """Evaluates the search query.
@@ -32,22 +51,37 @@ class RankedSearchBM25:
         :return: Ranked Search query results
         :rtype: EvaluationResult
         """
+        term_postings_list = self._get_term_postings()
+        ranked_score = self._search_scored(term_postings_list)
+        ranked_results = self._build_result(term_postings_list, ranked_score, self.limit)
+        return ranked_results
+
+    def _get_term_postings(self):
+        """Postings of the terms of the query, in query order
+
+        :rtype: List[TermPostings]
+        """
         term_postings_list = []
         for t in self.query:
-            term_postings = self.index.get_postings(t)
-            if term_postings is not None:
+            if t in self._postings:
+                if self._postings[t] is not None:
+                    term_postings_list.append(TermPostings(t, self._postings[t].postings))
+                continue
+            stats = self.index.get_term_stats(t)
+            if stats is not None:
+                # The postings of the terms missing from the index are not read
+                term_postings = self.index.get_postings(t) if stats.doc_freq else TermPostings(t, [])
                 term_postings.term = t
                 term_postings_list.append(term_postings)
-
-        scored_results = self._search_scored(term_postings_list)
-        ranked_results = self._build_result(term_postings_list, scored_results)
-        return ranked_results
+        return term_postings_list
 
     @staticmethod
-    def _build_result(term_postings_list: List[TermPostings], scored_result: Dict[int, float]):
+    def _build_result(term_postings_list: List[TermPostings], ranked_score: List[Tuple[int, float]],
+                      limit: int = None):
         """ Build the evaluation result structure based on the scoring.
 
-        :param scored_result: Dictionary of docid to weight
+        :param ranked_score: Ordered list of tuple (docid, weight)
+        :param limit: Number of results the ranking was cut to, None for all the scored documents
         :return: Ranked result as and EvaluationResult
         :rtype: EvaluationResult
         """
@@ -55,42 +89,460 @@ class RankedSearchBM25:
         for term_posting in term_postings_list:
             results.add_postings(term_posting.term, term_posting.postings)
 
-        ranked_score = sorted(scored_result.items(), key=itemgetter(1), reverse=True)
-        results.update_ranked_results(ranked_score)
+        results.update_ranked_results(ranked_score, limit)
         return results
 
+    def _get_idfs(self, term_postings_list: List[TermPostings]):
+        """Idf of each term of the query, the deleted documents are removed from the postings.
+
+        The idf comes from the term statistics of the dictionary, unless documents were deleted: the statistics still
+        count them, the live postings are counted.
+
+        :rtype: List[float]
+        """
+        doc_count = self.index.get_doc_count()
+        live_docs = self.index.get_live_docs()
+        deletions = self.index.has_deletions()
+        idfs = []
+        for term_postings in term_postings_list:
+            if live_docs is not None:
+                # The deleted documents are skipped, so the df is the one of the live documents
+                term_postings.postings = [p for p in term_postings.postings if p.docid in live_docs]
+            if deletions:
+                doc_freq = len(term_postings.postings)
+            else:
+                doc_freq = self.index.get_term_stats(term_postings.term).doc_freq
+            idfs.append(log2(doc_count / doc_freq) if doc_freq else 0)
+        return idfs
+
     def _search_scored(self, term_postings_list: List[TermPostings]):
-        """ Score the resulting list of documents using the BM25 weight.
+        """ Score the resulting list of documents using the BM25 weight and rank them.
 
-        Term at a time ranking is used in this implementation.
+        Term at a time ranking is used in this implementation, on NumPy arrays: the weights of all the postings of a
+        term are computed at once from their docids and term frequencies, then added to the dense array of the scores
+        indexed by docid. The weights of a document are added in query order.
+
+        The best limit documents are selected with argpartition. The documents of equal scores are ordered by the
+        first term they contain in the query, then by docid.
 
         :param term_postings_list: List of TermPostings for the terms in the search
         :type term_postings_list: List[TermPostings]
-        :return: Dictionary of docid to bm25 weight
-        :rtype: Dict[int, float]
+        :return: Ordered list of tuple (docid, weight)
+        :rtype: List[Tuple[int, float]]
         """
-        accumulators = {}
-        doc_count = self.index.get_doc_count()
-        for term_postings in term_postings_list:
-            idf = log2(doc_count / len(term_postings.postings)) if term_postings.postings else 0
-            for p in term_postings.postings:
-                tf = len(p.positions)
-                dl = self.index.get_doclength(p.docid)
-
-                if p.docid not in accumulators:
-                    accumulators[p.docid] = 0
-                termWeight = self._compute_bm25_term(idf, tf, dl)
-                # Useful output to evaluate the weighting components - Used in the report
-                # if p in [20891, 4008, 16780, 8593, 3560, 20860, 20719, 7525, 8500, 16824]:
-                #     print("term:{}, doc: {}, doc_len: {}, idf: {:.2f}, tf: {}, term weight: {:.2f}".format(
-                #         term_postings.term,
-                #         p.docid, dl, idf, tf,
-                #         termWeight))
-                accumulators[p.docid] += termWeight
-        return accumulators
+        table = self.index.get_doclength_table()
+        lengths = np.frombuffer(table.lengths, dtype=table.lengths.typecode)
+        quantized_lengths = np.array(DocLengthTable.QUANTIZED_LENGTHS) if table.quantized else None
+        term_docids = []
+        term_weights = []
+        for term_postings, idf in zip(term_postings_list, self._get_idfs(term_postings_list)):
+            docids, tfs = _postings_columns(term_postings.postings)
+            dl = quantized_lengths[lengths[docids]] if table.quantized else lengths[docids]
+            term_docids.append(docids)
+            term_weights.append(self._compute_bm25_term(idf, tfs, dl))
+        if not any(len(docids) for docids in term_docids):
+            return []
+
+        # bincount adds the weights in the order of the postings
+        all_docids = np.concatenate(term_docids)
+        scores = np.bincount(all_docids, weights=np.concatenate(term_weights))
+        first_terms = np.full(len(scores), len(term_docids))
+        for term in range(len(term_docids) - 1, -1, -1):
+            first_terms[term_docids[term]] = term
+        docids = np.flatnonzero(first_terms < len(term_docids))
+        scores = scores[docids]
+        first_terms = first_terms[docids]
+
+        if self.limit is not None and 0 < self.limit < len(docids):
+            # The documents tied with the last of the best ones are kept, the order of the ties decides
+            best = np.argpartition(-scores, self.limit - 1)[:self.limit]
+            selected = scores >= scores[best].min()
+            docids, scores, first_terms = docids[selected], scores[selected], first_terms[selected]
+        order = np.lexsort((docids, first_terms, -scores))[:self.limit]
+        return list(zip(docids[order].tolist(), scores[order].tolist()))
 
     def _compute_bm25_term(self, idf, tf, dl):
-        """Computes the partial bm25 weight for 1 term in a doc. This result should be accumulated for each doc"""
+        """Computes the partial bm25 weight for 1 term in a doc. This result should be accumulated for each doc
+
+        The term frequencies and document lengths can be NumPy arrays, the weights of the documents are then computed
+        at once.
+        """
         davg = self.index.avg_doclength
         return idf * ((self.k1 + 1) * tf) / (
                 self.k1 * ((1 - self.b) + self.b * (dl / davg)) + tf)
+
+
+class TopKRankedSearchBM25(RankedSearchBM25):
+    def __init__(self, query: str, index: InvertedIndex, k1: float = 1.2, b: float = 0.75, limit: int = 10,
+                 postings: Dict[str, TermPostings] = None):
+        """Initializes the query processor for the top-k Ranked Retrieval using Okapi BM25.
+
+        The documents are scored document at a time with the MaxScore dynamic pruning. The impacts stored by the merge
+        bound the weight of a term in each block of its postings, the best limit documents are kept in a heap and the
+        documents which cannot beat the lowest score of the heap are skipped: the terms whose bounds add up below it
+        are only looked up for the documents of the other terms, and the blocks of postings whose bounds add up below
+        it are jumped over without being decoded.
+
+        The results are the first limit results of RankedSearchBM25, in the same order. An index without impacts is
+        scored term at a time.
+
+        :param limit: Number of results to return
+        :type limit: int
+        :param postings: Postings of the query terms already read, see RankedSearchBM25
+        :type postings: Dict[str, TermPostings]
+        """
+        super().__init__(query, index, k1, b, limit, postings)
+
+    def evaluate(self):
+        """Evaluates the search query.
+
+        :return: Best limit results of the ranked search
+        :rtype: EvaluationResult
+        """
+        term_postings_list = self._get_term_postings()
+        term_impacts = [self.index.get_term_impacts(term_postings.term) for term_postings in term_postings_list]
+        if any(impacts is None for impacts in term_impacts):
+            ranked_score = self._search_scored(term_postings_list)
+        else:
+            ranked_score = self._search_top_k(term_postings_list, term_impacts)
+        return self._build_result(term_postings_list, ranked_score, self.limit)
+
+    def _search_top_k(self, term_postings_list: List[TermPostings], term_impacts: List[TermImpacts]):
+        """Scores the best documents with MaxScore.
+
+        A document ties with the lowest document of the heap when it has the same score and comes first in the term at
+        a time order: its first term comes first in the query, or its docid is lower. The score of a document adds the
+        weights of its terms in query order, as term at a time scoring does.
+
+        :param term_postings_list: List of TermPostings for the terms in the search
+        :param term_impacts: Impacts of each term
+        :return: Ordered list of tuple (docid, weight)
+        :rtype: List[Tuple[int, float]]
+        """
+        cursors = [_TermCursor(i, term_postings.postings, idf, impacts, self._compute_bm25_term,
+                               self.index.get_doclength)
+                   for i, (term_postings, idf, impacts)
+                   in enumerate(zip(term_postings_list, self._get_idfs(term_postings_list), term_impacts))
+                   if term_postings.postings]
+        # The terms with the lowest bounds come first, the first ones are the non essential terms
+        cursors.sort(key=lambda cursor: cursor.bound)
+        bound_sums = [0]
+        for cursor in cursors:
+            bound_sums.append(bound_sums[-1] + cursor.bound)
+
+        # Heap of (score, -first term, -docid), the lowest document first
+        top_k = []
+        threshold = -inf
+        essential = 0
+        # The block of each term is the same for all the docids of a window, up to the first end of these blocks
+        window_end = -1
+        window_bounds = []
+        window_bound = 0
+        while essential < len(cursors):
+            docid = min(cursor.docid for cursor in cursors[essential:])
+            if docid == _TermCursor.END:
+                break
+            if docid > window_end:
+                window_end = _TermCursor.END
+                window_bounds = []
+                for cursor in cursors:
+                    block = cursor.block(docid)
+                    if block < len(cursor.block_bounds):
+                        window_bounds.append(cursor.block_bounds[block])
+                        window_end = min(window_end, cursor.last_docids[block])
+                    else:
+                        window_bounds.append(0)
+                window_bound = sum(window_bounds)
+            if window_bound < threshold:
+                for cursor in cursors[essential:]:
+                    if cursor.docid <= window_end:
+                        cursor.advance(window_end + 1)
+                continue
+
+            weights = {}
+            for cursor in cursors[essential:]:
+                if cursor.docid == docid:
+                    weights[cursor.term] = cursor.weight()
+                    cursor.next()
+            upper_bound = sum(weights.values()) + sum(window_bounds[:essential])
+            for i in range(essential - 1, -1, -1):
+                if upper_bound < threshold:
+                    break
+                cursor = cursors[i]
+                upper_bound -= window_bounds[i]
+                if cursor.docid < docid:
+                    cursor.advance(docid)
+                if cursor.docid == docid:
+                    weights[cursor.term] = cursor.weight()
+                    upper_bound += weights[cursor.term]
+            else:
+                score = 0
+                for term in sorted(weights):
+                    score += weights[term]
+                entry = (score, -min(weights), -docid)
+                if len(top_k) < self.limit:
+                    heapq.heappush(top_k, entry)
+                elif entry > top_k[0]:
+                    heapq.heapreplace(top_k, entry)
+                if len(top_k) == self.limit:
+                    threshold = top_k[0][0]
+                    while essential < len(cursors) and bound_sums[essential + 1] < threshold:
+                        essential += 1
+        return [(-docid, score) for score, term, docid in sorted(top_k, reverse=True)]
+
+
+class ImpactOrderedSearchBM25(RankedSearchBM25):
+    def __init__(self, query: str, index: InvertedIndex, k1: float = 1.2, b: float = 0.75, limit: int = 10,
+                 postings_budget: int = None, postings: Dict[str, TermPostings] = None):
+        """Initializes the query processor for the score at a time Ranked Retrieval using Okapi BM25.
+
+        The impact ordered postings of an index hold the BM25 weight of each term in each of its documents, quantized
+        to an impact. The segments of postings of all the query terms are scored by decreasing impact, the highest
+        weights first, until the best limit documents cannot change: the other documents cannot catch up with them
+        even if they get the impacts of all the segments left. With a postings budget the scoring also stops once that
+        many postings are scored, the best documents found so far are returned, so the latency of a query is bounded.
+
+        The documents which may be the best ones are then ranked by their exact BM25 score, the results are the first
+        limit results of RankedSearchBM25 unless the budget stops the scoring. The queries with other BM25 parameters
+        than the impacts, and the indexes without impact ordered postings or with deleted documents, are scored by
+        RankedSearchBM25.
+
+        :param limit: Number of results to return
+        :type limit: int
+        :param postings_budget: Maximum number of postings to score, None to score until the best documents are found
+        :type postings_budget: int
+        :param postings: Postings of the query terms already read, see RankedSearchBM25
+        :type postings: Dict[str, TermPostings]
+        """
+        super().__init__(query, index, k1, b, limit, postings)
+        self.postings_budget = postings_budget
+        # Postings scored by the last evaluation and whether it stopped before the last segment
+        self.scored_postings = 0
+        self.early_termination = False
+
+    def evaluate(self):
+        """Evaluates the search query.
+
+        :return: Best limit results of the ranked search
+        :rtype: EvaluationResult
+        """
+        term_postings_list = self._get_term_postings()
+        impact_order = self.index.impact_order
+        if impact_order is None or (impact_order.k1, impact_order.b) != (self.k1, self.b) \
+                or self.index.has_deletions():
+            ranked_score = self._search_scored(term_postings_list)
+        else:
+            ranked_score = self._search_score_at_a_time(term_postings_list)
+        return self._build_result(term_postings_list, ranked_score, self.limit)
+
+    def _search_score_at_a_time(self, term_postings_list: List[TermPostings]):
+        """Scores the impact segments of the terms by decreasing impact and ranks the best documents.
+
+        The impact of a term differs by less than one level from its exact weight, so the impacts of a document are
+        within as many levels as the query has terms of its exact score. The documents which may be in the best ones
+        are the documents whose impacts, with the impacts left and the quantization error, can reach the impacts of
+        the last best document less the quantization error. The scoring stops once the documents not scored yet cannot
+        be in the best ones, and at most MAX_CANDIDATES_FACTOR times limit documents can: their exact scores are then
+        computed from the postings, so the results are the ones of RankedSearchBM25 unless the budget stops the
+        scoring.
+
+        The segments of the same impact are scored together and the stop is checked before each impact. The impacts of
+        the documents only grow, so the last best document is found among the previous best documents and the
+        documents of the last impact, and the candidates among the previous candidates and these documents: the cost
+        of an impact does not depend on the number of documents of the index. Without a budget, the documents are
+        scored term at a time once the scoring cannot stop within the first MAX_SCORED_FRACTION of the postings, or
+        when more documents can be the best ones after the last segment.
+
+        :param term_postings_list: List of TermPostings for the terms in the search
+        :return: Ordered list of tuple (docid, weight)
+        :rtype: List[Tuple[int, float]]
+        """
+        term_segments = [self.index.get_impact_segments(term_postings.term) for term_postings in term_postings_list]
+        levels = [(impact, list(level)) for impact, level
+                  in groupby(sorted(((term, segment) for term, term_segment in enumerate(term_segments)
+                                     for segment in term_segment), key=lambda term_segment: -term_segment[1].impact),
+                             key=lambda term_segment: term_segment[1].impact)]
+        # The impacts a document can still gain before each level, the next impact of each term, and the postings
+        # scored before each level, with one more entry after the last level
+        remaining = []
+        scored_before = [0]
+        next_segments = [0] * len(term_segments)
+        next_impacts = [segments[0].impact if segments else 0 for segments in term_segments]
+        for impact, level in levels:
+            remaining.append(sum(next_impacts))
+            for term, segment in level:
+                next_segments[term] += 1
+                next_impacts[term] = term_segments[term][next_segments[term]].impact \
+                    if next_segments[term] < len(term_segments[term]) else 0
+            scored_before.append(scored_before[-1] + sum(len(segment) for term, segment in level))
+        remaining.append(0)
+        quantization_error = len(term_segments)
+        max_candidates = MAX_CANDIDATES_FACTOR * self.limit
+
+        accumulators = np.zeros(len(self.index.get_doclength_table().lengths), dtype=np.int64)
+        marks = np.empty(len(accumulators), dtype=np.int64)
+        # The best limit documents so far and the impacts of the last one
+        best = np.empty(0, dtype=np.int64)
+        last_best = 0
+        # Documents which can be in the best ones, tracked once the documents not scored yet cannot
+        candidates = None
+        self.scored_postings = 0
+        self.early_termination = False
+        stop = len(levels)
+        for i, (impact, level) in enumerate(levels):
+            slack = remaining[i] + 2 * quantization_error
+            if last_best > slack:
+                if candidates is None:
+                    candidates = np.flatnonzero(accumulators >= last_best - slack)
+                else:
+                    candidates = candidates[accumulators[candidates] >= last_best - slack]
+                if len(candidates) <= max_candidates:
+                    stop = i
+                    break
+            if self.postings_budget is None:
+                # The last best document gains at most the impacts left, the first level after this one where the
+                # scoring can stop
+                reach = last_best + remaining[i] - 2 * quantization_error
+                first_stop = next((j for j in range(i + 1, len(levels)) if remaining[j] < reach), len(levels))
+                if scored_before[first_stop] > MAX_SCORED_FRACTION * scored_before[-1]:
+                    return self._search_scored(term_postings_list)
+            elif self.scored_postings >= self.postings_budget:
+                stop = i
+                break
+            level_docids = []
+            for term, segment in level:
+                if self.postings_budget is not None and self.scored_postings >= self.postings_budget:
+                    break
+                # The docids of a segment are distinct
+                docids = np.array(segment.docids(), dtype=np.int64)
+                accumulators[docids] += impact
+                level_docids.append(docids)
+                self.scored_postings += len(segment)
+            best = _union(best, level_docids, marks)
+            if len(best) > self.limit:
+                best = best[np.argpartition(-accumulators[best], self.limit - 1)[:self.limit]]
+            if len(best) == self.limit:
+                last_best = int(accumulators[best].min())
+            if candidates is not None:
+                candidates = _union(candidates, level_docids, marks)
+            if len(level_docids) < len(level):
+                # The budget stopped the scoring within the level
+                stop = i
+                break
+        budget_exhausted = self.postings_budget is not None and self.scored_postings >= self.postings_budget \
+            and self.scored_postings < scored_before[-1]
+        self.early_termination = self.scored_postings < scored_before[-1]
+
+        # The documents without impacts have none of the terms
+        bound = max(1, last_best - remaining[stop] - 2 * quantization_error)
+        if candidates is None:
+            candidates = np.flatnonzero(accumulators >= bound)
+        else:
+            candidates = candidates[accumulators[candidates] >= bound]
+        if budget_exhausted:
+            # The best documents found so far
+            candidates = candidates[np.lexsort((candidates, -accumulators[candidates]))]
+            candidates = candidates[:max_candidates]
+        elif len(candidates) > max_candidates:
+            return self._search_scored(term_postings_list)
+        return self._rank_exact(term_postings_list, candidates.tolist())[:self.limit]
+
+    def _rank_exact(self, term_postings_list: List[TermPostings], docids: List[int]):
+        """Ranks documents by their exact BM25 score, the weights are added in query order as term at a time scoring
+        does, the ties are ordered by the first term of the documents in the query then by docid.
+
+        :rtype: List[Tuple[int, float]]
+        """
+        idfs = self._get_idfs(term_postings_list)
+        ranked = []
+        for docid in docids:
+            score = 0
+            first_term = None
+            for term, (term_postings, idf) in enumerate(zip(term_postings_list, idfs)):
+                posting = search.get(term_postings.postings, docid)
+                if posting is not None:
+                    score += self._compute_bm25_term(idf, posting.tf, self.index.get_doclength(docid))
+                    first_term = term if first_term is None else first_term
+            ranked.append((score, first_term, docid))
+        ranked.sort(key=lambda entry: (-entry[0], entry[1], entry[2]))
+        return [(docid, score) for score, first_term, docid in ranked]
+
+
+class _TermCursor:
+    END = float("inf")
+
+    def __init__(self, term: int, postings: List, idf: float, impacts: TermImpacts, weight, doclength):
+        """Position in the postings of a term of a query, with the upper bounds of its weight in each block
+
+        :param term: Index of the term in the query
+        :param postings: Postings of the term
+        :param idf: Idf of the term
+        :param impacts: Impacts of the blocks of postings of the term
+        :param weight: BM25 weight of the term in a document given the idf, tf and document length
+        :param doclength: Length of a document given its docid
+        """
+        self.term = term
+        self.postings = postings
+        self.idf = idf
+        self._weight = weight
+        self._doclength = doclength
+        self.last_docids = impacts.last_docids
+        self.block_bounds = [max(weight(idf, tf, length) for tf, length in block) * (1 + BOUND_SLACK)
+                             for block in impacts.blocks]
+        self.bound = max(self.block_bounds, default=0)
+        self.i = 0
+        self.posting = postings[0]
+        self.docid = self.posting.docid
+        self._block = 0
+
+    def block(self, docid: int):
+        """Index of the block which can hold the docid, the block count past the last block.
+
+        The documents are evaluated in docid order, so the block is searched from the block of the previous docid.
+        """
+        self._block = bisect_left(self.last_docids, docid, self._block)
+        return self._block
+
+    def weight(self):
+        return self._weight(self.idf, self.posting.tf, self._doclength(self.docid))
+
+    def next(self):
+        self._move(self.i + 1)
+
+    def advance(self, docid: int):
+        """Moves to the first posting with a docid greater or equal to docid"""
+        self._move(search.search(self.postings, docid, self.i))
+
+    def _move(self, i: int):
+        self.i = i
+        if i < len(self.postings):
+            self.posting = self.postings[i]
+            self.docid = self.posting.docid
+        else:
+            self.posting = None
+            self.docid = _TermCursor.END
+
+
+def _union(docids: np.ndarray, other_docids: List[np.ndarray], marks: np.ndarray):
+    """Distinct docids of arrays of docids, in no particular order
+
+    :param marks: Array indexed by docid, overwritten
+    :rtype: np.ndarray
+    """
+    docids = np.concatenate([docids] + other_docids)
+    positions = np.arange(len(docids))
+    # Each docid keeps the last of its positions
+    marks[docids] = positions
+    return docids[marks[docids] == positions]
+
+
+def _postings_columns(postings: Sequence):
+    """Docids and term frequencies of postings as NumPy arrays, the positions of encoded postings are not decoded
+
+    :rtype: Tuple[np.ndarray, np.ndarray]
+    """
+    if isinstance(postings, ChunkedPostings):
+        docids, tfs = postings.columns()
+        return np.frombuffer(docids, dtype=docids.typecode), np.frombuffer(tfs, dtype=tfs.typecode)
+    return (np.fromiter((posting.docid for posting in postings), dtype=np.int64, count=len(postings)),
+            np.fromiter((posting.tf for posting in postings), dtype=np.int64, count=len(postings)))
@@ -1,14 +1,28 @@
 ## Module to load and parse the reuters corpus
+import re
 import string
+from html.entities import html5
 from bs4 import BeautifulSoup
 from nltk import word_tokenize, sent_tokenize
+from nltk.tokenize import NLTKWordTokenizer
 from itertools import chain
-from dict_compression import Compression
+from dict_compression import Compression, CompressionStats, compile_compression
 from collections import namedtuple, deque, OrderedDict
 from typing import List, Union
 
 LAST_DOCID = 21578
 DOC_PER_FILE = 1000
+SGML_READ_SIZE = 64 * 1024  # 64 KB
+
+# Reader backends of the corpus stream:
+# soup: BeautifulSoup tree of each file and NLTK tokenizers
+# compat: streaming SGML reader and the memoized tokenizer reproducing the NLTK tokens
+# fast: streaming SGML reader and a single regular expression tokenizer, the tokens differ from NLTK
+READER_BACKENDS = ["compat", "fast", "soup"]
+DEFAULT_READER_BACKEND = "compat"
+
+_PUNCTUATION = frozenset(string.punctuation)
+_NEWLINES_TO_SPACES = str.maketrans('\n\r', '  ')
 
 
 class ReutersDocument:
@@ -36,13 +50,8 @@ class ReutersDocument:
         if not self._soup:
             raise ReutersCorpusException("Could not parse the reuters SGML")
         # remove new line or carriage return escape chars
-        text = self._soup.get_text().translate(str.maketrans('\n\r', '  '))
-        # tokenize by words using the default NLTK word tokenizer
-        # and remove stray punctuation
-        sentences = sent_tokenize(text)
-        tokens = deque(tok for tok in chain.from_iterable([word_tokenize(sent) for sent in sentences]) if
-                       tok not in list(string.punctuation))
-        return tokens
+        text = self._soup.get_text().translate(_NEWLINES_TO_SPACES)
+        return nltk_tokenize(text)
 
     def get_title(self):
         if not self._soup:
@@ -105,17 +114,228 @@ class ReutersDocument:
         return "reut2-{:03}.sgm".format(file_id)
 
 
+class ReutersSGMLDocument:
+    _NEWID = re.compile(r'\bNEWID="(\d+)"', re.IGNORECASE)
+    _UNKNOWN = re.compile(r"<UNKNOWN\b.*?</UNKNOWN>", re.IGNORECASE | re.DOTALL)
+    _TITLE = re.compile(r"<TITLE\b[^>]*>(.*?)</TITLE>", re.IGNORECASE | re.DOTALL)
+    _TAG = re.compile(r"</?[a-zA-Z][^>]*>")
+    _CHARREF = re.compile(r"&(#[0-9]+|#[xX][0-9a-fA-F]+|[a-zA-Z][a-zA-Z0-9]*);")
+
+    def __init__(self, sgml: str, tokenize):
+        """Document of the Reuters corpus read from its raw SGML, without building a tree.
+
+        :param sgml: SGML of the document from <REUTERS> to </REUTERS>
+        :param tokenize: Tokenizer of the document text, returning a queue of tokens
+        :type tokenize: Callable[[str], deque]
+        """
+        self._sgml = sgml
+        self._tokenize = tokenize
+        newid = ReutersSGMLDocument._NEWID.search(sgml)
+        if not newid:
+            raise ReutersCorpusException("Could not find the NEWID of the reuters SGML")
+        self.docid = int(newid.group(1))
+
+    def get_text(self):
+        """Text of the document as BeautifulSoup get_text gives it, without the UNKNOWN tags."""
+        text = ReutersSGMLDocument._UNKNOWN.sub("", self._sgml)
+        return ReutersSGMLDocument._unescape(ReutersSGMLDocument._TAG.sub("", text))
+
+    def get_tokens(self):
+        """Retrieves a buffer of tokens for this document.
+
+        :return: Queue of tokens for this document
+        :rtype: deque
+        """
+        return self._tokenize(self.get_text().translate(_NEWLINES_TO_SPACES))
+
+    def get_title(self):
+        return "\n".join(ReutersSGMLDocument._unescape(ReutersSGMLDocument._TAG.sub("", title))
+                         for title in ReutersSGMLDocument._TITLE.findall(self._sgml))
+
+    def __str__(self):
+        return self._sgml
+
+    @staticmethod
+    def _unescape(text: str):
+        """Replaces the character references like the html.parser tree builder of BeautifulSoup"""
+        if "&" not in text:
+            return text
+        return ReutersSGMLDocument._CHARREF.sub(ReutersSGMLDocument._replace_charref, text)
+
+    @staticmethod
+    def _replace_charref(match):
+        name = match.group(1)
+        if name[0] != "#":
+            return html5.get(name + ";", match.group(0))
+        code = int(name[2:], 16) if name[1] in "xX" else int(name[1:])
+        if code < 256:
+            # BeautifulSoup reads the code points below 256 as Windows-1252
+            try:
+                return bytes([code]).decode("windows-1252")
+            except UnicodeDecodeError:
+                pass
+        try:
+            return chr(code)
+        except (ValueError, OverflowError):
+            return "\N{REPLACEMENT CHARACTER}"
+
+
+def read_sgml_documents(filename: str, tokenize, read_size: int = SGML_READ_SIZE):
+    """Streams the documents of a Reuters SGML file, scanning the <REUTERS> boundaries as the file is read.
+
+    :param filename: Reuters SGML file
+    :param tokenize: Tokenizer of the documents text
+    :param read_size: Number of characters read at once
+    :return: Documents of the file in order
+    :rtype: Iterable[ReutersSGMLDocument]
+    """
+    start_tag = re.compile(r"<REUTERS\b", re.IGNORECASE)
+    end_tag = re.compile(r"</REUTERS>", re.IGNORECASE)
+    with open(filename, 'r', errors='ignore') as f:
+        buffer = ""
+        while True:
+            data = f.read(read_size)
+            buffer += data
+            pos = 0
+            while True:
+                start = start_tag.search(buffer, pos)
+                if not start:
+                    # Keep a possible partial start tag for the next read
+                    pos = max(pos, len(buffer) - len("<REUTERS"))
+                    break
+                end = end_tag.search(buffer, start.start())
+                if not end:
+                    pos = start.start()
+                    break
+                yield ReutersSGMLDocument(buffer[start.start():end.end()], tokenize)
+                pos = end.end()
+            buffer = buffer[pos:]
+            if not data:
+                break
+
+
+def read_soup_documents(filename: str):
+    """Parses a whole Reuters SGML file with BeautifulSoup
+
+    :rtype: Iterable[ReutersDocument]
+    """
+    with open(filename, 'r', errors='ignore') as f:
+        soup = BeautifulSoup(f, "html.parser")
+    return (ReutersDocument(doc) for doc in soup.find_all("reuters"))
+
+
+def nltk_tokenize(text: str):
+    """Tokenizes by words using the default NLTK word tokenizer and removes stray punctuation
+
+    :rtype: deque
+    """
+    sentences = sent_tokenize(text)
+    return deque(tok for tok in chain.from_iterable(word_tokenize(sent) for sent in sentences)
+                 if tok not in _PUNCTUATION)
+
+
+class CompatTokenizer:
+    MEMO_SIZE = 256 * 1024
+    _CHUNK = re.compile(r"\S+")
+    # Closing brackets and quotes, the final period rule of the word tokenizer reaches back over them
+    _CLOSING = re.compile("[\\]\\)}>\"'\u00bb\u201d\u2019]+")
+    _SENTINEL = "x"
+    _SENTENCE_END = re.compile(r"[.?!]")
+    # Words and numbers without punctuation are tokens on their own, except the contractions split by the tokenizer
+    _PLAIN = re.compile(r"[^\W_]+")
+
+    def __init__(self):
+        """Tokenizer giving the same tokens as nltk_tokenize, much faster.
+
+        The word tokenizer of NLTK is a sequence of regular expressions over each sentence. Besides the start and the
+        end of the sentence, they only look at the characters next to a whitespace, so the tokens of a sentence are
+        the tokens of its whitespace separated chunks tokenized with their surrounding whitespace. The tokens of each
+        chunk are memoized, most chunks of a corpus are repeated words.
+        """
+        self._word_tokenizer = NLTKWordTokenizer()
+        self._memo = {}
+
+    def __call__(self, text: str):
+        """Tokenizes a text and removes stray punctuation
+
+        :rtype: deque
+        """
+        return deque(tok for tok in chain.from_iterable(self._sentence_tokens(sent) for sent in self._sentences(text))
+                     if tok not in _PUNCTUATION)
+
+    @staticmethod
+    def _sentences(text: str):
+        for sent in sent_tokenize(text):
+            # word_tokenize splits each sentence into sentences again, which can only split after a . ? or !
+            if CompatTokenizer._SENTENCE_END.search(sent, 0, len(sent) - 1) or sent[-1].isspace():
+                yield from sent_tokenize(sent)
+            else:
+                yield sent
+
+    def _sentence_tokens(self, sentence: str):
+        chunks = [(m.start(), m.end()) for m in CompatTokenizer._CHUNK.finditer(sentence)]
+        if len(chunks) > 1 and CompatTokenizer._CLOSING.fullmatch(sentence, *chunks[-1]):
+            return self._word_tokenizer.tokenize(sentence)
+        tokens = []
+        last = len(chunks) - 1
+        for i, (start, end) in enumerate(chunks):
+            key = (sentence[start - 1] if start else "", sentence[start:end], sentence[end] if i < last else "")
+            chunk_tokens = self._memo.get(key)
+            if chunk_tokens is None:
+                chunk_tokens = self._chunk_tokens(*key)
+            tokens.extend(chunk_tokens)
+        return tokens
+
+    def _chunk_tokens(self, before: str, chunk: str, after: str):
+        """Tokens of a chunk between the whitespace before and after it, empty at the start or end of the sentence"""
+        if CompatTokenizer._PLAIN.fullmatch(chunk) and \
+                not any(regexp.search(chunk + " ") for regexp in self._word_tokenizer.CONTRACTIONS2):
+            chunk_tokens = [chunk]
+        elif after:
+            # A sentinel token keeps the rules anchored at the end of the sentence from matching
+            chunk_tokens = self._word_tokenizer.tokenize(before + chunk + after + CompatTokenizer._SENTINEL)[:-1]
+        else:
+            chunk_tokens = self._word_tokenizer.tokenize(before + chunk)
+        if len(self._memo) >= CompatTokenizer.MEMO_SIZE:
+            self._memo.clear()
+        self._memo[(before, chunk, after)] = chunk_tokens
+        return chunk_tokens
+
+
+_FAST_TOKEN = re.compile(r"\w+(?:[-.,'&/:]\w+)*")
+
+
+def fast_tokenize(text: str):
+    """Tokenizes words and numbers with their inner punctuation (u.s, 2,000, it's) in a single pass.
+
+    :rtype: deque
+    """
+    return deque(_FAST_TOKEN.findall(text))
+
+
 DocToken = namedtuple("DocToken", ['token', 'docid', 'pos'])
 
 
 class ReutersCorpusStream:
-    def __init__(self, files: list, compression: Compression = None):
+    def __init__(self, files: list, compression: Compression = None, backend: str = DEFAULT_READER_BACKEND):
+        """Stream of the tokens of the Reuters corpus files, in docid order.
+
+        :param files: Ordered files of the Reuters Corpus
+        :param compression: Dictionary Compression technique applied to the tokens
+        :param backend: Reader backend of the files, one of READER_BACKENDS
+        """
+        if backend not in READER_BACKENDS:
+            raise ReutersCorpusException("Unknown reader backend: {}".format(backend))
         self._files = files if files else []
-        self._docs = []
+        self._backend = backend
+        self._tokenize = CompatTokenizer() if backend == "compat" else fast_tokenize
+        self._docs = deque()
+        self._doc_stream = self._read_files()
         self._current_tokens = None
         self._current_docid = None
         self._current_pos = 0
-        self._compression = compression
+        self._compression = compile_compression(compression) if compression else None
+        self._initial_compression_stats = self._compression.stats() if compression else CompressionStats(0, 0, 0)
         self.docid_list = []
         self.doclength_map = {}
 
@@ -143,33 +363,43 @@ class ReutersCorpusStream:
         else:
             raise StopIteration
 
+    def compression_stats(self):
+        """Counters of the normalization memo for the tokens of this stream
+
+        :rtype: CompressionStats
+        """
+        if not self._compression:
+            return CompressionStats(0, 0, 0)
+        return CompressionStats(*(now - initial for now, initial in
+                                  zip(self._compression.stats(), self._initial_compression_stats)))
+
     def _next_doc(self):
-        if not self._docs:
-            self._docs = self._fetch_next_chunk()
-        return self._docs.popleft() if self._docs else None
+        if self._docs:
+            return self._docs.popleft()
+        return next(self._doc_stream, None)
 
     def has_next_doc(self):
         if not self._docs:
-            self._docs = self._fetch_next_chunk()
-        return self._docs is not None and len(self._docs) != 0
+            nextdoc = next(self._doc_stream, None)
+            if nextdoc:
+                self._docs.append(nextdoc)
+        return len(self._docs) != 0
 
-    def _fetch_next_chunk(self):
-        """Retrieves the next chunk of documents for the Reuters Corpus
+    def _read_files(self):
+        """Streams the documents of the Reuters Corpus files with the reader backend
 
-        :return: Buffer of ReutersDocument
-        :rtype: deque
+        :return: Documents of the files in order
+        :rtype: Iterable[Union[ReutersDocument, ReutersSGMLDocument]]
         """
-        reuters_docs = deque()
-        current_file = None
-        while self._files and not current_file:
+        while self._files:
             filename = self._files.pop(0)
             try:
-                current_file = open(filename, 'r', errors='ignore')
-                soup = BeautifulSoup(current_file, "html.parser")
-                reuters_docs.extend(ReutersDocument(doc) for doc in soup.find_all("reuters"))
+                if self._backend == "soup":
+                    yield from read_soup_documents(filename)
+                else:
+                    yield from read_sgml_documents(filename, self._tokenize)
             except IOError:
                 print("Could not find {}".format(filename))
-        return reuters_docs
 
     def _save_doclength(self, docid: Union[str, int], length: int):
         docid = int(docid)
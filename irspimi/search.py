@@ -1,16 +1,214 @@
-from typing import List, Union
-from inverted_index import TermPostings, Posting
+from abc import ABC, abstractmethod
+from typing import List, Sequence, Union
+from bisect import bisect_left
+from itertools import chain, groupby
+from operator import attrgetter
+import heapq
+from inverted_index import TermPostings, Posting, LiveDocs, ChunkedPostings, bitmap_from_docids, docids_from_bitmap
 
+# Intersections of lists with a length ratio of at least GALLOP_RATIO search the docids of the short list in the long
+# one instead of walking both lists
+GALLOP_RATIO = 8
 
-def intersect(postings1: List[Posting], postings2: List[Posting]):
+
+class MergedPosting(Posting):
+    def __init__(self, docid: int, postings: Sequence[Posting]):
+        """Posting of a document found in several postings lists, as in the result of intersections and unions.
+
+        Its term frequency is the sum of the term frequencies of the postings, its positions are the sorted positions
+        of the postings, merged the first time they are read.
+
+        :param docid: Docid of the document
+        :param postings: Postings of the document in the merged postings lists
+        """
+        self.docid = docid
+        self._postings = []
+        for posting in postings:
+            if isinstance(posting, MergedPosting):
+                self._postings.extend(posting._postings)
+            else:
+                self._postings.append(posting)
+        self._tf = sum(posting.tf for posting in self._postings)
+        self._positions = None
+
+    @property
+    def tf(self):
+        return self._tf
+
+    @property
+    def positions(self):
+        if self._positions is None:
+            self._positions = sorted(chain.from_iterable(posting.positions for posting in self._postings))
+        return self._positions
+
+
+class BitmapPostings:
+    def __init__(self, bitmap: int, sources: List[Union[Sequence[Posting], "BitmapPostings"]]):
+        """Postings as a bitmap of their docids, the set operations of two bitmaps are bitwise operations on integers.
+
+        The postings are only computed for the documents enumerated at the end of the evaluation: the posting of a
+        document merges the postings it has in the sources which hold it, as in the result of successive intersections
+        and unions of postings lists.
+
+        :param bitmap: Bitmap with the bit docid set for each document
+        :param sources: Postings whose positions are merged into the positions of the documents
+        """
+        self.bitmap = bitmap
+        self.sources = sources
+
+    def source_postings(self, docid: int):
+        """Postings of a document of the bitmap in its sources"""
+        postings = []
+        for source in self.sources:
+            if isinstance(source, BitmapPostings):
+                if docid in source:
+                    postings.extend(source.source_postings(docid))
+            else:
+                posting = get(source, docid)
+                if posting is not None:
+                    postings.append(posting)
+        return postings
+
+    def to_postings(self):
+        """Enumerates the postings of the bitmap
+
+        :rtype: List[Posting]
+        """
+        return [MergedPosting(docid, self.source_postings(docid)) for docid in docids_from_bitmap(self.bitmap)]
+
+    def __contains__(self, docid: int):
+        return (self.bitmap >> docid) & 1 == 1
+
+    def __iter__(self):
+        return iter(self.to_postings())
+
+    def __len__(self):
+        return self.bitmap.bit_count()
+
+    def __bool__(self):
+        return self.bitmap != 0
+
+
+def _bitmap(postings: Union[Sequence[Posting], BitmapPostings], live_docs: LiveDocs = None):
+    """Bitmap of postings, the postings lists are converted"""
+    if isinstance(postings, BitmapPostings):
+        return postings.bitmap
+    bitmap = bitmap_from_docids(posting.docid for posting in postings) if postings else 0
+    return bitmap & live_docs.bitmap() if live_docs is not None else bitmap
+
+
+class Complement:
+    def __init__(self, excluded: Sequence[Posting]):
+        """Documents of the universe except the excluded ones, without positions, as the result of a NOT.
+
+        The complement stays symbolic through the intersections: A AND NOT B is the subtraction of B from A and
+        NOT A AND NOT B is the complement of A OR B. It is only materialized from the universe when it has to be
+        enumerated, by a union or as the result of the expression.
+
+        :param excluded: Postings of the excluded documents
+        """
+        self.excluded = excluded if excluded is not None else []
+
+    def materialize(self, universe_bitmap: int):
+        """Postings of the documents of the complement
+
+        :param universe_bitmap: Bitmap of the live documents of the collection
+        :rtype: BitmapPostings
+        """
+        return BitmapPostings(universe_bitmap & ~_bitmap(self.excluded), [])
+
+    def __bool__(self):
+        return True
+
+
+def complement(postings: Union[Sequence[Posting], Complement], live_docs: LiveDocs = None):
+    """NOT of postings, the complement of a complement is the excluded documents without their positions
+
+    :rtype: Union[Complement, List[Posting]]
+    """
+    if isinstance(postings, Complement):
+        if isinstance(postings.excluded, BitmapPostings):
+            return BitmapPostings(postings.excluded.bitmap, [])
+        return [Posting(posting.docid, []) for posting in live(postings.excluded, live_docs)]
+    return Complement(postings)
+
+
+# The live_docs bitset of the index skips the deleted documents still in the postings, None when nothing is deleted
+def live(postings: List[Posting], live_docs: LiveDocs = None):
+    """Postings of the live documents"""
+    if live_docs is None or postings is None:
+        return postings
+    return [posting for posting in postings if posting.docid in live_docs]
+
+
+def search(postings: Sequence[Posting], docid: int, lo: int = 0):
+    """Index of the first posting at or after lo with a docid greater or equal to docid.
+
+    Postings read from the index jump over their chunks with their skip pointers, lists of postings are searched
+    with an exponential search from lo, so a search close to lo is cheap.
+
+    :param postings: Postings sorted by docid
+    :param docid: Docid to search for
+    :param lo: Index where the search starts
+    :return: Index of the posting, len(postings) if all the docids after lo are lower
+    :rtype: int
+    """
+    if isinstance(postings, ChunkedPostings):
+        return postings.search(docid, lo)
+    step = 1
+    hi = lo
+    while hi < len(postings) and postings[hi].docid < docid:
+        lo = hi + 1
+        hi += step
+        step *= 2
+    return bisect_left(postings, docid, lo, min(hi, len(postings)))
+
+
+def get(postings: Sequence[Posting], docid: int):
+    """Posting of a document in sorted postings, None if the document is not in the postings
+
+    :rtype: Posting
+    """
+    if isinstance(postings, ChunkedPostings):
+        return postings.get(docid)
+    i = search(postings, docid)
+    return postings[i] if i < len(postings) and postings[i].docid == docid else None
+
+
+def contains(postings: Sequence[Posting], docid: int):
+    return get(postings, docid) is not None
+
+
+def intersect(postings1: Union[Sequence[Posting], Complement], postings2: Union[Sequence[Posting], Complement],
+              live_docs: LiveDocs = None):
+    if not postings1 or not postings2:
+        return []
+    if isinstance(postings1, Complement) and isinstance(postings2, Complement):
+        return Complement(union(postings1.excluded, postings2.excluded))
+    elif isinstance(postings2, Complement):
+        return subtract(postings1, postings2.excluded, live_docs)
+    elif isinstance(postings1, Complement):
+        return subtract(postings2, postings1.excluded, live_docs)
+    if isinstance(postings1, BitmapPostings) and isinstance(postings2, BitmapPostings):
+        return BitmapPostings(postings1.bitmap & postings2.bitmap, [postings1, postings2])
+    elif isinstance(postings1, BitmapPostings):
+        return _bitmap_intersect(postings2, postings1, live_docs)
+    elif isinstance(postings2, BitmapPostings):
+        return _bitmap_intersect(postings1, postings2, live_docs)
+    if len(postings1) * GALLOP_RATIO <= len(postings2):
+        return _gallop_intersect(postings1, postings2, live_docs)
+    elif len(postings2) * GALLOP_RATIO <= len(postings1):
+        return _gallop_intersect(postings2, postings1, live_docs)
+    postings1 = list(postings1)
+    postings2 = list(postings2)
     intersection = []
     i = 0
     j = 0
     if postings1 and postings2:
         while i < len(postings1) and j < len(postings2):
             if postings1[i] == postings2[j]:
-                intersection.append(
-                    Posting(postings1[i].docid, sorted(postings1[i].positions + postings2[j].positions)))
+                if live_docs is None or postings1[i].docid in live_docs:
+                    intersection.append(MergedPosting(postings1[i].docid, [postings1[i], postings2[j]]))
                 i += 1
                 j += 1
             elif postings1[i] < postings2[j]:
@@ -20,15 +218,37 @@ def intersect(postings1: List[Posting], postings2: List[Posting]):
     return intersection
 
 
-def union(postings1: List[Posting], postings2: List[Posting]):
+def _bitmap_intersect(postings: Sequence[Posting], bitmap_postings: BitmapPostings, live_docs: LiveDocs = None):
+    """Intersection of postings with a bitmap, testing the bit of each posting"""
+    return [MergedPosting(posting.docid, [posting] + bitmap_postings.source_postings(posting.docid))
+            for posting in live(postings, live_docs) if posting.docid in bitmap_postings]
+
+
+def _gallop_intersect(short_postings: Sequence[Posting], long_postings: Sequence[Posting], live_docs: LiveDocs = None):
+    """Intersection searching each docid of the short list in the long list, in time proportional to the short list"""
+    intersection = []
+    j = 0
+    for posting in short_postings:
+        j = search(long_postings, posting.docid, j)
+        if j == len(long_postings):
+            break
+        match = long_postings[j]
+        if match.docid == posting.docid and (live_docs is None or posting.docid in live_docs):
+            intersection.append(MergedPosting(posting.docid, [posting, match]))
+    return intersection
+
+
+def union(postings1: List[Posting], postings2: List[Posting], live_docs: LiveDocs = None):
+    if isinstance(postings1, BitmapPostings) or isinstance(postings2, BitmapPostings):
+        return union_many([postings1, postings2], live_docs)
     union_set = []
     i = 0
     j = 0
-    postings1 = postings1 if postings1 is not None else []
-    postings2 = postings2 if postings2 is not None else []
+    postings1 = list(live(postings1, live_docs)) if postings1 is not None else []
+    postings2 = list(live(postings2, live_docs)) if postings2 is not None else []
     while i < len(postings1) and j < len(postings2):
         if postings1[i] == postings2[j]:
-            union_set.append(Posting(postings1[i].docid, sorted(postings1[i].positions + postings2[j].positions)))
+            union_set.append(MergedPosting(postings1[i].docid, [postings1[i], postings2[j]]))
             i += 1
             j += 1
         elif postings1[i] < postings2[j]:
@@ -50,14 +270,49 @@ def union(postings1: List[Posting], postings2: List[Posting]):
     return union_set
 
 
-def neg(universe: List[int], postings: List[Posting]):
-    return subtract(universe, postings)
+def union_many(postings_lists: List[Sequence[Posting]], live_docs: LiveDocs = None):
+    """Union of several postings lists in one pass, with a heap merging the lists by docid.
 
+    The positions of a docid found in several lists are merged, as by successive unions.
+    """
+    union_set = []
+    postings_lists = [postings for postings in postings_lists if postings is not None]
+    if any(isinstance(postings, BitmapPostings) for postings in postings_lists):
+        bitmap = 0
+        for postings in postings_lists:
+            bitmap |= _bitmap(postings, live_docs)
+        return BitmapPostings(bitmap, postings_lists)
+    for docid, group in groupby(heapq.merge(*postings_lists), key=attrgetter("docid")):
+        if live_docs is not None and docid not in live_docs:
+            continue
+        group = list(group)
+        if len(group) == 1:
+            union_set.append(group[0])
+        else:
+            union_set.append(MergedPosting(docid, group))
+    return union_set
+
+
+def neg(universe: List[int], postings: List[Posting], live_docs: LiveDocs = None):
+    return subtract(universe, postings, live_docs)
 
-def subtract(postings1: List[Union[Posting, int]], postings2: List[Posting]):
+
+def subtract(postings1: Sequence[Union[Posting, int]], postings2: Sequence[Posting], live_docs: LiveDocs = None):
+    if isinstance(postings1, BitmapPostings):
+        return BitmapPostings(postings1.bitmap & ~_bitmap(postings2), [postings1])
+    elif isinstance(postings2, BitmapPostings):
+        return [posting if not isinstance(posting, int) else Posting(posting, [])
+                for posting in live(postings1, live_docs)
+                if (posting if isinstance(posting, int) else posting.docid) not in postings2]
     difference = []
-    postings1 = postings1 if postings1 is not None else []
-    postings2 = postings2 if postings2 is not None else []
+    if live_docs is not None and postings1:
+        postings1 = [p for p in postings1 if (p if isinstance(p, int) else p.docid) in live_docs]
+    if postings1 and postings2 and len(postings1) * GALLOP_RATIO <= len(postings2) \
+            and not isinstance(postings1[0], int):
+        # The postings of the short list are searched in the long list
+        return [posting for posting in postings1 if not contains(postings2, posting.docid)]
+    postings1 = list(postings1) if postings1 is not None else []
+    postings2 = list(postings2) if postings2 is not None else []
     i = 0
     j = 0
     while i < len(postings1) and j < len(postings2):
@@ -83,3 +338,196 @@ def subtract(postings1: List[Union[Posting, int]], postings2: List[Posting]):
         i += 1
 
     return difference
+
+
+class PostingsCursor(ABC):
+    END = float("inf")
+
+    def __init__(self):
+        """Pull based position in the results of a boolean expression, the documents are enumerated in docid order.
+
+        The cursors of an expression form a tree: next and advance only move the cursors below as far as needed to
+        find the next document, so enumerating the first results of the expression reads only the postings before
+        them. The docid is END once the results are exhausted.
+        """
+        self.docid = PostingsCursor.END
+
+    @property
+    @abstractmethod
+    def posting(self):
+        """Posting of the current document"""
+        pass
+
+    @abstractmethod
+    def next(self):
+        """Moves to the next document"""
+        pass
+
+    @abstractmethod
+    def advance(self, target: int):
+        """Moves to the first document with a docid greater or equal to target, the cursor stays on its document if
+        its docid is already greater or equal to target"""
+        pass
+
+
+class ListCursor(PostingsCursor):
+    def __init__(self, postings: Sequence[Posting]):
+        """Cursor over a postings list, postings read from the index jump over their chunks with their skip pointers
+
+        :param postings: Postings sorted by docid
+        """
+        super().__init__()
+        self._postings = postings
+        self._move(0)
+
+    def _move(self, i: int):
+        self._i = i
+        self.docid = self._postings[i].docid if i < len(self._postings) else PostingsCursor.END
+
+    @property
+    def posting(self):
+        return self._postings[self._i]
+
+    def next(self):
+        self._move(self._i + 1)
+
+    def advance(self, target: int):
+        if target > self.docid:
+            self._move(search(self._postings, target, self._i))
+
+
+class AndCursor(PostingsCursor):
+    def __init__(self, cursors: List[PostingsCursor], excluded: List[PostingsCursor] = None):
+        """Intersection of cursors, the documents of the excluded cursors are subtracted from it.
+
+        The cursors leapfrog: each one advances to the docid of the previous one, so the first cursor, the one with
+        the fewest documents, leads and the others skip the documents it does not hold.
+
+        :param cursors: Intersected cursors, at least one
+        :param excluded: Cursors of the documents subtracted from the intersection
+        """
+        super().__init__()
+        self._cursors = cursors
+        self._excluded = excluded if excluded is not None else []
+        self._match(cursors[0].docid)
+
+    def _match(self, target: int):
+        """Moves to the first document at or after target held by all the cursors and by none of the excluded ones"""
+        while target != PostingsCursor.END:
+            for cursor in self._cursors:
+                cursor.advance(target)
+                if cursor.docid != target:
+                    target = cursor.docid
+                    break
+            else:
+                if not self._is_excluded(target):
+                    break
+                target += 1
+        self.docid = target
+
+    def _is_excluded(self, docid: int):
+        for cursor in self._excluded:
+            cursor.advance(docid)
+            if cursor.docid == docid:
+                return True
+        return False
+
+    @property
+    def posting(self):
+        if len(self._cursors) == 1:
+            return self._cursors[0].posting
+        return MergedPosting(self.docid, [cursor.posting for cursor in self._cursors])
+
+    def next(self):
+        self._match(self.docid + 1)
+
+    def advance(self, target: int):
+        if target > self.docid:
+            self._match(target)
+
+
+class OrCursor(PostingsCursor):
+    def __init__(self, cursors: List[PostingsCursor]):
+        """Union of cursors, the posting of a document held by several cursors merges their postings
+
+        :param cursors: Cursors of the union, none for an empty union
+        """
+        super().__init__()
+        self._cursors = cursors
+        self.docid = min((cursor.docid for cursor in cursors), default=PostingsCursor.END)
+
+    @property
+    def posting(self):
+        postings = [cursor.posting for cursor in self._cursors if cursor.docid == self.docid]
+        return postings[0] if len(postings) == 1 else MergedPosting(self.docid, postings)
+
+    def next(self):
+        for cursor in self._cursors:
+            if cursor.docid == self.docid:
+                cursor.next()
+        self.docid = min((cursor.docid for cursor in self._cursors), default=PostingsCursor.END)
+
+    def advance(self, target: int):
+        if target > self.docid:
+            for cursor in self._cursors:
+                cursor.advance(target)
+            self.docid = min((cursor.docid for cursor in self._cursors), default=PostingsCursor.END)
+
+
+class ComplementCursor(PostingsCursor):
+    def __init__(self, universe: Sequence[int], excluded: PostingsCursor):
+        """Documents of the universe except the excluded ones, without positions, as the result of a NOT.
+
+        An AND subtracts the excluded cursor instead of intersecting with the complement, see AndCursor.
+
+        :param universe: Sorted docids of the collection
+        :param excluded: Cursor of the excluded documents
+        """
+        super().__init__()
+        self.excluded = excluded
+        self._universe = universe
+        self._skip(0)
+
+    def _skip(self, i: int):
+        """Moves to the first document of the universe at or after index i which is not excluded"""
+        while i < len(self._universe):
+            self.excluded.advance(self._universe[i])
+            if self.excluded.docid != self._universe[i]:
+                break
+            i += 1
+        self._i = i
+        self.docid = self._universe[i] if i < len(self._universe) else PostingsCursor.END
+
+    @property
+    def posting(self):
+        return Posting(self.docid, [])
+
+    def next(self):
+        self._skip(self._i + 1)
+
+    def advance(self, target: int):
+        if target > self.docid:
+            self._skip(bisect_left(self._universe, target, self._i))
+
+
+class BareCursor(PostingsCursor):
+    def __init__(self, cursor: PostingsCursor):
+        """Documents of a cursor without their positions, as the complement of a complement
+
+        :param cursor: Cursor of the documents
+        """
+        super().__init__()
+        self._cursor = cursor
+        self.docid = cursor.docid
+
+    @property
+    def posting(self):
+        return Posting(self.docid, [])
+
+    def next(self):
+        self._cursor.next()
+        self.docid = self._cursor.docid
+
+    def advance(self, target: int):
+        self._cursor.advance(target)
+        self.docid = self._cursor.docid
@@ -0,0 +1,227 @@
+## Incremental indexing
+## An incremental index is a list of immutable segments, each one built like a whole index with its own dictionary and
+## descriptor. New documents go to a new segment and a tiered merge policy merges the small segments into larger ones
+## in the background.
+from typing import Dict, List
+from itertools import chain
+from math import log
+from merge import MergeSPIMI
+from inverted_index import InvertedIndexDescriptor, DocLengthTable, SegmentManifest, BINARY_FORMAT_VERSION, \
+    BITMAPS_FILE_SUFFIX, IMPACTS_FILE_SUFFIX, DICTIONARY_FILE_SUFFIX, DOCLENGTHS_FILE_SUFFIX, DELETES_FILE_SUFFIX, \
+    IMPACT_ORDER_FILE_SUFFIX, INVERTED_INDEX_DESCRIPTOR_SUFFIX, partition_filename, segments_filename, segments_lock, \
+    read_segments, read_deleted_docids, write_deleted_docids
+import os
+import threading
+
+DEFAULT_MERGE_FACTOR = 4  # Segments of a tier merged together
+MIN_SEGMENT_SIZE = 1024 * 1024  # 1 MB, smaller segments are all in the first tier
+
+
+def reserve_segment(index_filename: str):
+    """Reserves the filename of a new segment
+
+    :return: Filename of the segment, relative to the directory of the index
+    :rtype: str
+    """
+    with segments_lock(index_filename):
+        manifest = read_segments(index_filename)
+        segment = "{}.seg{}".format(os.path.basename(index_filename), manifest.next_segment)
+        manifest.next_segment += 1
+        manifest.write_to_file(segments_filename(index_filename))
+    return segment
+
+
+def commit_segments(index_filename: str, added: List[str], removed: List[str]):
+    """Replaces the removed segments by the added ones in the live segments and increments the generation.
+
+    :param index_filename: Filename of the index
+    :param added: Segments to add, they take the place of the first removed segment
+    :param removed: Segments to remove
+    :return: False if a removed segment is no longer live, the live segments are then unchanged
+    :rtype: bool
+    """
+    with segments_lock(index_filename):
+        return _commit_segments_locked(index_filename, added, removed)
+
+
+def _commit_segments_locked(index_filename: str, added: List[str], removed: List[str]):
+    manifest = read_segments(index_filename)
+    if any(segment not in manifest.segments for segment in removed):
+        return False
+    position = manifest.segments.index(removed[0]) if removed else len(manifest.segments)
+    segments = [segment for segment in manifest.segments if segment not in removed]
+    manifest.segments = segments[:position] + added + segments[position:]
+    manifest.generation += 1
+    manifest.write_to_file(segments_filename(index_filename))
+    return True
+
+
+def segment_descriptor(index_filename: str, segment: str):
+    return InvertedIndexDescriptor.build_from_file(
+        "{}.{}".format(_segment_path(index_filename, segment), INVERTED_INDEX_DESCRIPTOR_SUFFIX))
+
+
+def delete_segment(index_filename: str, segment: str):
+    """Deletes the files of a segment, the indexes that opened it keep reading their open files"""
+    segment_path = _segment_path(index_filename, segment)
+    descriptor_filename = "{}.{}".format(segment_path, INVERTED_INDEX_DESCRIPTOR_SUFFIX)
+    filenames = [segment_path]
+    if os.path.exists(descriptor_filename):
+        partitions = InvertedIndexDescriptor.build_from_file(descriptor_filename).partitions
+        if partitions:
+            filenames = [partition_filename(segment_path, i) for i in range(0, len(partitions))]
+    filenames = filenames + ["{}.{}".format(filename, suffix) for filename in filenames
+                             for suffix in [DICTIONARY_FILE_SUFFIX, BITMAPS_FILE_SUFFIX, IMPACTS_FILE_SUFFIX,
+                                            IMPACT_ORDER_FILE_SUFFIX]]
+    filenames += [descriptor_filename, "{}.{}".format(descriptor_filename, DOCLENGTHS_FILE_SUFFIX),
+                  "{}.{}".format(segment_path, DELETES_FILE_SUFFIX)]
+    for filename in filenames:
+        if os.path.exists(filename):
+            os.remove(filename)
+
+
+def delete_segments(index_filename: str):
+    """Deletes the segments and the deleted documents of a previous incremental index once the index is rebuilt in
+    place, the rebuilt index has all its documents live"""
+    deletes_filename = "{}.{}".format(index_filename, DELETES_FILE_SUFFIX)
+    if os.path.exists(deletes_filename):
+        os.remove(deletes_filename)
+    if not os.path.exists(segments_filename(index_filename)):
+        return
+    with segments_lock(index_filename):
+        for segment in read_segments(index_filename).segments:
+            if segment != os.path.basename(index_filename):
+                delete_segment(index_filename, segment)
+        os.remove(segments_filename(index_filename))
+    os.remove("{}.lock".format(segments_filename(index_filename)))
+
+
+def _segment_path(index_filename: str, segment: str):
+    return os.path.join(os.path.dirname(index_filename), segment)
+
+
+class TieredMergePolicy:
+    def __init__(self, merge_factor: int = DEFAULT_MERGE_FACTOR, min_segment_size: int = MIN_SEGMENT_SIZE):
+        """Chooses the segments to merge so each document is merged a logarithmic number of times.
+
+        The segments are grouped in tiers of size: tier i holds the segments of min_segment_size * merge_factor ** i
+        bytes and up. As soon as a tier has merge_factor segments, they are merged into a segment of the next tier.
+
+        :param merge_factor: Number of segments of a tier merged together
+        :param min_segment_size: Size in bytes of the segments of the first tier
+        """
+        self.merge_factor = max(2, merge_factor)
+        self.min_segment_size = min_segment_size
+
+    def tier(self, size: int):
+        return int(log(max(size, self.min_segment_size) / self.min_segment_size, self.merge_factor))
+
+    def find_merge(self, segment_sizes: Dict[str, int]):
+        """Segments to merge next, from the lowest tier with enough segments
+
+        :param segment_sizes: Size in bytes of each mergeable segment
+        :return: Segments to merge together, None if no tier is full
+        :rtype: List[str]
+        """
+        tiers = {}
+        for segment, size in segment_sizes.items():
+            tiers.setdefault(self.tier(size), []).append(segment)
+        for tier in sorted(tiers):
+            if len(tiers[tier]) >= self.merge_factor:
+                return sorted(tiers[tier], key=segment_sizes.get)[:self.merge_factor]
+        return None
+
+
+def has_deletes(index_filename: str, segment: str):
+    return os.path.exists("{}.{}".format(_segment_path(index_filename, segment), DELETES_FILE_SUFFIX))
+
+
+def mergeable_segment_sizes(index_filename: str, manifest: SegmentManifest):
+    """Size in bytes of the live segments which can be merged, binary and not partitioned"""
+    sizes = {}
+    for segment in manifest.segments:
+        descriptor = segment_descriptor(index_filename, segment)
+        if descriptor.format_version == BINARY_FORMAT_VERSION and not descriptor.partitions:
+            sizes[segment] = os.path.getsize(_segment_path(index_filename, segment))
+    return sizes
+
+
+def merge_segments(index_filename: str, segments: List[str]):
+    """Merges segments into a new segment and replaces them in the live segments.
+
+    The deleted documents of the segments are purged from the merged segment, the documents deleted while the merge
+    runs are deleted from the merged segment when it is committed.
+
+    :param index_filename: Filename of the index
+    :param segments: Segments to merge, binary and not partitioned, with the same compression and codec
+    :return: The merged segment, None if the segments were merged meanwhile by another merger
+    :rtype: str
+    """
+    descriptors = {segment: segment_descriptor(index_filename, segment) for segment in segments}
+    segments = sorted(segments, key=lambda segment: descriptors[segment].doclength_table.docids[:1].tolist())
+    descriptor = descriptors[segments[0]]
+    segment_paths = [_segment_path(index_filename, segment) for segment in segments]
+    deleted_docids = [set(read_deleted_docids(path)) for path in segment_paths]
+    merged = reserve_segment(index_filename)
+    merged_path = _segment_path(index_filename, merged)
+    # A replaced document is deleted from its old segment, so the live documents of the segments are disjoint
+    doclength_table = DocLengthTable.combine([descriptors[segment].doclength_table.remove(deleted)
+                                              for segment, deleted in zip(segments, deleted_docids)])
+    MergeSPIMI(segment_paths, merged_path, codec=descriptor.codec, deleted_docids=deleted_docids,
+               doclength_table=doclength_table).external_merge()
+    InvertedIndexDescriptor(doclength_table, descriptor.compression, codec=descriptor.codec,
+                            positions=descriptor.positions).write_to_file(
+        "{}.{}".format(merged_path, INVERTED_INDEX_DESCRIPTOR_SUFFIX))
+
+    with segments_lock(index_filename):
+        late_deleted_docids = set(chain.from_iterable(set(read_deleted_docids(path)) - deleted
+                                                      for path, deleted in zip(segment_paths, deleted_docids)))
+        if late_deleted_docids:
+            write_deleted_docids(merged_path, late_deleted_docids)
+        committed = _commit_segments_locked(index_filename, [merged], segments)
+    if not committed:
+        delete_segment(index_filename, merged)
+        return None
+    for segment in segments:
+        delete_segment(index_filename, segment)
+    return merged
+
+
+def merge_tiers(index_filename: str, policy: TieredMergePolicy = None):
+    """Merges the segments chosen by the policy until no tier is full
+
+    :return: Number of merges
+    :rtype: int
+    """
+    policy = policy if policy else TieredMergePolicy()
+    merge_count = 0
+    while True:
+        segments = policy.find_merge(mergeable_segment_sizes(index_filename, read_segments(index_filename)))
+        if not segments or not merge_segments(index_filename, segments):
+            return merge_count
+        merge_count += 1
+
+
+class SegmentMerger(threading.Thread):
+    _running = threading.Lock()  # One merger per process, it picks up the segments added while it runs
+
+    def __init__(self, index_filename: str, policy: TieredMergePolicy = None):
+        """Background thread merging the segments of an index with a tiered merge policy.
+
+        The segments are immutable, so searches go on with the live segments while they are merged.
+
+        :param index_filename: Filename of the index
+        :param policy: Merge policy, DEFAULT TieredMergePolicy()
+        """
+        super().__init__(name="segment-merger")
+        self._index_filename = index_filename
+        self._policy = policy
+        self.merge_count = 0
+
+    def run(self):
+        if not SegmentMerger._running.acquire(blocking=False):
+            return
+        try:
+            self.merge_count = merge_tiers(self._index_filename, self._policy)
+        finally:
+            SegmentMerger._running.release()
@@ -1,110 +1,162 @@
 ## Implements the spimi algorithm to build an inverted index
 import os
 import sys
-from typing import Iterable, List, Dict
+import struct
+from array import array
+from typing import Iterable
 from reuters import DocToken
-from inverted_index import extern_output, TermPostings, Posting
+from inverted_index import PostingsFileWriter
+from int_codecs import DEFAULT_CODEC
+
+# Memory footprint of the in-memory block structures, used to estimate the size of a block as it grows
+_POINTER_SIZE = struct.calcsize("P")
+_EMPTY_ARRAY_SIZE = sys.getsizeof(array("I"))
+_ARRAY_ITEM_SIZE = array("I").itemsize
+# A dict entry is a hash, a key and a value pointer plus the index slot, the table is at most 2/3 full
+_DICT_ENTRY_SIZE = int((3 * _POINTER_SIZE + 1) * 3 / 2)
+# Term string, dictionary entry, its slot in each list of the block and its 3 arrays
+_TERM_SIZE = _DICT_ENTRY_SIZE + 4 * _POINTER_SIZE + 3 * _EMPTY_ARRAY_SIZE + _ARRAY_ITEM_SIZE
+
+
+class SPIMIBlock:
+    def __init__(self, positions: bool = True):
+        """In-memory block of the SPIMI algorithm.
+
+        Terms are interned to a term id which indexes array backed buffers of docids, term frequencies and positions.
+        Tokens must be added in docid order so a new posting is only an append after the last docid of the term.
+
+        :param positions: Whether the positions of the tokens are kept, their buffers stay empty otherwise
+        """
+        self._keep_positions = positions
+        self.term_ids = {}
+        self.terms = []
+        self.docids = []
+        self.tfs = []
+        self.positions = []
+        self._last_docids = array("I")
+        self.memory = 0
+
+    def add(self, term: str, docid: int, pos: int):
+        """Adds the token to the postings of its term
+
+        :param term: Term of the token
+        :param docid: Docid of the token
+        :param pos: Position of the token in the document
+        :type term: str
+        :type docid: int
+        :type pos: int
+        :return: None
+        """
+        term_id = self.term_ids.get(term)
+        if term_id is None:
+            term_id = self._add_term(term)
+        elif docid != self._last_docids[term_id]:
+            if docid < self._last_docids[term_id]:
+                raise SPIMIException("Tokens must be in docid order, received docid {} after {}".format(
+                    docid, self._last_docids[term_id]))
+        else:
+            self.tfs[term_id][-1] += 1
+            if self._keep_positions:
+                self.positions[term_id].append(pos)
+                self.memory += _ARRAY_ITEM_SIZE
+            return
+
+        self._last_docids[term_id] = docid
+        self.docids[term_id].append(docid)
+        self.tfs[term_id].append(1)
+        self.memory += 2 * _ARRAY_ITEM_SIZE
+        if self._keep_positions:
+            self.positions[term_id].append(pos)
+            self.memory += _ARRAY_ITEM_SIZE
+
+    def _add_term(self, term: str):
+        """Interns a new term and creates its empty buffers
+
+        :return: Term id of the new term
+        :rtype: int
+        """
+        term_id = len(self.terms)
+        self.term_ids[term] = term_id
+        self.terms.append(term)
+        self.docids.append(array("I"))
+        self.tfs.append(array("I"))
+        self.positions.append(array("I"))
+        self._last_docids.append(0)
+        self.memory += sys.getsizeof(term) + _TERM_SIZE
+        return term_id
+
+    def sorted_term_ids(self):
+        """Term ids in the alphabetical order of their term"""
+        return sorted(range(0, len(self.terms)), key=self.terms.__getitem__)
 
 
 class SPIMI:
     BLOCK_NAME_PREFIX = "SPIMIBLOCK"
-    DEFAULT_BLOCK_SIZE = 262144  # 64 KB (about 500 Reuter's article)
+    DEFAULT_MEMORY_BUDGET = 32 * 1024 * 1024  # 32 MB
+
+    def __init__(self, token_stream: Iterable[DocToken], memory_budget: int = DEFAULT_MEMORY_BUDGET, dir: str = ".",
+                 codec: str = DEFAULT_CODEC, positions: bool = True):
+        """Initializes the SPIMI inverter
 
-    def __init__(self, token_stream: Iterable[DocToken], blocksize: int = DEFAULT_BLOCK_SIZE, dir: str = "."):
+        :param token_stream: Stream of DocToken to invert
+        :param memory_budget: Estimated memory in bytes of a block before it is flushed to disk
+        :param dir: Directory to write the blocks
+        :param codec: Name of the integer codec of the blocks
+        :param positions: Whether the blocks hold the positions of the tokens, False for docids and tfs only
+        """
         self._next_block_suffix = 0
-        self._blocksize = blocksize
+        self._codec = codec
+        self._positions = positions
+        self._memory_budget = memory_budget
         self._token_stream = token_stream
         self._dir = dir
+        self._pending_token = None
+        self.peak_block_memory = 0
         if not os.path.exists(dir):
             os.makedirs(dir)
 
     def invert(self):
         """Executes the SPIMI algorithm with the given token stream during construction.
 
+        The block is flushed once its estimated memory footprint reaches the memory budget, at the end of the current
+        document. A document is never split between blocks so the blocks can be merged by concatenating their postings.
+
         :return: disk block file name
         :rtype: str
         """
-        dictionary = {}
-        if sys.getsizeof(dictionary) < self._blocksize:
-            for token in self._token_stream:
-                if token.token not in dictionary:
-                    posting_list = self._add_to_dict(dictionary, token.token)
-                else:
-                    posting_list = self._get_posting_list(dictionary, token.token)
-                self._add_to_posting_list(posting_list, token.docid, token.pos)
-
-                # Since we're using an iterator, check if free mem before next token
-                if sys.getsizeof(dictionary) >= self._blocksize:
-                    break
-        sorted_terms = sorted(dictionary.keys())
-
-        return self._write_to_disk(sorted_terms, dictionary) if sorted_terms else None
-
-    @staticmethod
-    def _add_to_dict(dictionary: dict, term: str):
-        """Add the term to the dictionary and create an empty postings list
-
-        :param dictionary: Dictionary onto which to add the term
-        :param term: Term to add to the dictionary
-        :type dictionary: dict
-        :type term: str
-        :return: New postings list
-        :rtype: List
-        """
-        dictionary[term] = []
-        return dictionary[term]
-
-    @staticmethod
-    def _get_posting_list(dictionary: dict, term: str):
-        """Retrieves the postings list from thedictionary for the given term
-
-        :param dictionary: Dictionary to search in
-        :param term: Term to search
-        :type dictionary: dict
-        :type term: str
-        :return: Existing postings list for term
-        :rtype: List[Posting]
-        """
-        return dictionary[term]
-
-    @staticmethod
-    def _add_to_posting_list(posting_list: List[Posting], docid: str, pos: int):
-        """Adds the given docid and position to the posting_list
-
-        :param posting_list: Posting List to add the docid and pos
-        :param docid: Docid to add
-        :param pos: Pos of the term in this doc
-        :type posting_list: List[Posting]
-        :type docid: str
-        :type pos: int
-        :return: None
-        """
-
-        existing_postings = [item for item in posting_list if item.docid is docid]
-        # Sanity check, big error if this is called
-        if len(existing_postings) > 1:
-            raise SPIMIException("This behaviour should never happen: Error in implementation")
-        if not existing_postings:
-            posting_list.append(Posting(docid, [pos]))
-        else:
-            for p in existing_postings:
-                p.positions.append(pos)
-
-    def _write_to_disk(self, sorted_terms: list, dictionary: dict):
+        block = SPIMIBlock(self._positions)
+        last_docid = None
+        if self._pending_token:
+            token = self._pending_token
+            self._pending_token = None
+            block.add(token.token, token.docid, token.pos)
+            last_docid = token.docid
+        for token in self._token_stream:
+            # Since we're using an iterator, check if free mem before the next document
+            if block.memory >= self._memory_budget and token.docid != last_docid:
+                self._pending_token = token
+                break
+            block.add(token.token, token.docid, token.pos)
+            last_docid = token.docid
+        self.peak_block_memory = max(self.peak_block_memory, block.memory)
+
+        return self._write_to_disk(block) if block.terms else None
+
+    def _write_to_disk(self, block: SPIMIBlock):
         """Writes a the partial index to a file block on disk.
 
-        :param sorted_terms: List of sorted terms in the index
-        :param dictionary: inverted index
-        :type sorted_terms: List[str]
-        :type dictionary: Dict[str, List[Posting]]
+        The postings are encoded directly from the arrays of the block.
+
+        :param block: In-memory block of the partial index
+        :type block: SPIMIBlock
         :return: block file name
         """
         output_file_name = "{}/{}_{}.blk".format(self._dir, SPIMI.BLOCK_NAME_PREFIX, self._next_block_suffix)
         try:
-            output_file = open(output_file_name, "w+")
-            for term in sorted_terms:
-                postings = dictionary[term]
-                output_file.write(extern_output(TermPostings(term, postings)))
+            output_file = PostingsFileWriter(output_file_name, self._codec)
+            for term_id in block.sorted_term_ids():
+                output_file.write_columns(block.terms[term_id], block.docids[term_id], block.tfs[term_id],
+                                          block.positions[term_id])
             output_file.flush()
             output_file.close()
             self._next_block_suffix += 1